@@ -0,0 +1,10 @@
+"""
+performance measurements for photo_work
+
+run from the repository root, e.g.:
+    python -m bench.scan        directory walk, os.walk vs scanner
+    python -m bench.tree DIR    build a synthetic media tree
+    python -m bench.encode      old ffmpeg command vs encode profiles
+    python -m bench.stages      time scan, classify, plan, image and
+                                video conversion on such a tree, as JSON
+"""
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+"""
+video encode profile benchmark
+
+times the old way (ffmpeg -i IN -vf scale=640:360 OUT.webm, encoder
+defaults) against the vidconv encode profiles on a synthetic camcorder
+like clip: 1080p25 h264 with 5.1(side) AC3 audio, all on one thread
+budget
+
+    python -m bench.encode [--seconds 10] [--clip FILE] [--threads N]
+                           [--profiles draft,standard] [--json FILE]
+
+the clip is built once with ffmpeg's test sources (matroska, the
+content is what matters) and reused; the old command gets -ac 2 as
+well, libopus rejects the 5.1(side) layout without it
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import vidconv
+
+OLD_CMD = ["-vf", "scale=640:360", "-ac", "2"]
+
+
+def build_clip(path, seconds):
+    """
+    create the synthetic source clip unless it is already there
+    """
+    if os.path.exists(path):
+        return
+    subprocess.check_call([
+        vidconv.FFMPEG, "-nostdin", "-v", "error", "-y",
+        "-f", "lavfi", "-i",
+        "testsrc2=size=1920x1080:rate=25:duration={}".format(seconds),
+        "-f", "lavfi", "-i",
+        "sine=frequency=440:duration={},aformat=channel_layouts=5.1(side)"
+        "".format(seconds),
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "12M",
+        "-c:a", "ac3", path])
+
+
+def timed(label, cmd, frames):
+    """
+    run and print one encode, return its timing dict (as bench.stages)
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    ret = subprocess.call(cmd)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime +
+           after.ru_stime - before.ru_stime)
+    size = os.path.getsize(cmd[-1]) if 0 == ret else 0
+    print "{:<10} {:8.1f}s {:8.1f}s CPU {:8.1f} fps {:>8} KB{}".format(
+        label, elapsed, cpu, frames / max(elapsed, 1e-9), size >> 10,
+        "" if 0 == ret else " (failed: {})".format(ret))
+    return {"seconds": elapsed, "cpu": cpu, "items": frames,
+            "per_second": frames / max(elapsed, 1e-9), "bytes": size,
+            "failed": 0 != ret}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--seconds', type=int, default=10,
+                        help='length of the synthetic clip')
+    parser.add_argument('--clip', default=None,
+                        help='where to build (and reuse) the clip')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='threads per encode (default: one per core)')
+    parser.add_argument('--profiles', default="draft,standard",
+                        help='comma separated vidconv profiles to time')
+    parser.add_argument('--json', default=None,
+                        help='also write the timings here, as JSON')
+    args = parser.parse_args(argv)
+    clip = args.clip
+    if clip is None:
+        clip = os.path.join(tempfile.gettempdir(),
+                            "photo_work_bench_{}s.mkv".format(args.seconds))
+    threads = args.threads or vidconv.default_threads()
+    build_clip(clip, args.seconds)
+    outdir = tempfile.mkdtemp(prefix="photo_work_bench_encode")
+    frames = args.seconds * 25
+    print "clip: {}, {} threads".format(clip, threads)
+    stages = {"old": timed("old", [
+        vidconv.FFMPEG, "-nostdin", "-v", "error", "-y",
+        "-threads", str(threads), "-i", clip] + OLD_CMD +
+        [os.path.join(outdir, "old.webm")], frames)}
+    for name in args.profiles.split(","):
+        job = vidconv.make_jobs(clip, outdir, {
+            "name": name, "type": "vid", "resizedims": vidconv.VID_DIMS,
+            "profile": name})[0]
+        job.update(duration=args.seconds, fps=25, width=1920, height=1080)
+        cmd = vidconv.encode_cmd(job, threads)
+        cmd[-1] = os.path.join(outdir, name + ".webm")
+        stages[name] = timed(name, cmd, frames)
+        print "{:<10} {:.1f}x the old command".format(
+            "", stages["old"]["seconds"] / stages[name]["seconds"])
+    for name in os.listdir(outdir):
+        os.remove(os.path.join(outdir, name))
+    os.rmdir(outdir)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"seconds": args.seconds, "threads": threads,
+                       "stages": stages}, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
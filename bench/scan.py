@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+"""
+directory scan microbenchmark
+
+compares the os.walk based walk (as in generate_file_lists) with the
+scandir based scanner on a synthetic tree, one and several threads, and
+os.walk + stat with scanner.list_stats (size and mtime, as the scan
+index reads them); on python 2 without the scandir package the scanner
+is listdir + lstat, no fewer syscalls than os.walk
+
+    python -m bench.scan [--files 500000] [--tree DIR] [--threads 8]
+                         [--json FILE]
+
+the tree is built once (empty files, <tree>/raw-media/<date>_-card/DCIM/
+<nnn>PANA/P<nnnnnnn>.JPG) and reused by later runs; timings are with a
+warm page cache unless caches are dropped between runs
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import scanner
+
+FILES_PER_DIR = 1000
+DIRS_PER_CARD = 50
+
+
+def build_tree(top, n_files):
+    """
+    create the synthetic tree below top unless it is already there
+    """
+    marker = os.path.join(top, ".bench_scan_{}".format(n_files))
+    if os.path.exists(marker):
+        return
+    made = 0
+    card = 0
+    while made < n_files:
+        card_dir = os.path.join(top, "raw-media",
+                                "2013-01-{:02d}_-card".format(card % 28 + 1),
+                                "DCIM")
+        for d in range(DIRS_PER_CARD):
+            if made >= n_files:
+                break
+            leaf = os.path.join(card_dir, "{:03d}PANA".format(100 + d))
+            if not os.path.isdir(leaf):
+                os.makedirs(leaf)
+            for i in range(min(FILES_PER_DIR, n_files - made)):
+                name = "P{:07d}.JPG".format(made)
+                open(os.path.join(leaf, name), "w").close()
+                made += 1
+        card += 1
+    open(marker, "w").close()
+
+
+def walk_os(top):
+    """
+    the current way: os.walk (a stat per entry to split dirs from files)
+    """
+    count = 0
+    for root, dirs, files in os.walk(top):
+        for walked_file in files:
+            os.path.join(root, walked_file)
+            count += 1
+    return count
+
+
+def walk_scanner(top, n_threads):
+    count = 0
+    for file_path in scanner.scan_files([top], n_threads):
+        count += 1
+    return count
+
+
+def stat_os(top):
+    """
+    os.walk plus a stat per file, what the scan index needs
+    """
+    count = 0
+    for root, dirs, files in os.walk(top):
+        for walked_file in files:
+            os.stat(os.path.join(root, walked_file))
+            count += 1
+    return count
+
+
+def _visit_stats(path):
+    listing = scanner.list_stats(path)
+    return (len([1 for name, is_dir, size, mtime in listing if not is_dir]),
+            [os.path.join(path, name)
+             for name, is_dir, size, mtime in listing if is_dir])
+
+
+def stat_scanner(top, n_threads):
+    """
+    the scan index way: list_stats, one syscall per file
+    """
+    return sum(scanner.walk([top], _visit_stats, n_threads))
+
+
+def timed(label, func, *args):
+    """
+    run and print one walk, return its timing dict (as bench.stages)
+    """
+    start = time.time()
+    count = func(*args)
+    elapsed = time.time() - start
+    print "{:<24} {:>8} files {:8.2f}s {:>10.0f} files/s".format(
+        label, count, elapsed, count / max(elapsed, 1e-9))
+    return {"seconds": elapsed, "items": count,
+            "per_second": count / max(elapsed, 1e-9)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--files', type=int, default=500000,
+                        help='files in the synthetic tree')
+    parser.add_argument('--tree', default=None,
+                        help='where to build (and reuse) the tree')
+    parser.add_argument('--threads', type=int,
+                        default=scanner.DEFAULT_THREADS,
+                        help='scanner threads for the threaded run')
+    parser.add_argument('--json', default=None,
+                        help='also write the timings here, as JSON')
+    args = parser.parse_args(argv)
+    top = args.tree
+    if top is None:
+        top = os.path.join(tempfile.gettempdir(), "photo_work_bench_scan")
+    build_tree(top, args.files)
+    print "tree: {}, scandir: {}".format(
+        top, "yes" if scanner.scandir else
+        "no (listdir + lstat, as os.walk: pip install scandir)")
+    stages = {"os_walk": timed("os.walk", walk_os, top),
+              "scanner_1": timed("scanner, 1 thread", walk_scanner, top, 1),
+              "scanner_n": timed("scanner, {} threads".format(args.threads),
+                                 walk_scanner, top, args.threads),
+              "os_walk_stat": timed("os.walk + stat", stat_os, top),
+              "scanner_stat": timed("scanner stats, 1 thread",
+                                    stat_scanner, top, 1)}
+    base = stages["os_walk"]["seconds"]
+    print ("speedup vs os.walk: {:.2f}x (1 thread), {:.2f}x ({} threads)"
+           "".format(base / stages["scanner_1"]["seconds"],
+                     base / stages["scanner_n"]["seconds"], args.threads))
+    print ("with size and mtime: {:.2f}x (1 thread)".format(
+        stages["os_walk_stat"]["seconds"] /
+        stages["scanner_stat"]["seconds"]))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"files": args.files, "threads": args.threads,
+                       "scandir": scanner.scandir is not None,
+                       "stages": stages}, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+"""
+per stage timings of the ingest path on a synthetic tree (bench.tree)
+
+the stages are the methods of ingest.foo, set up from a command line as
+ingest would be, on the tree as its set dir:
+    scan      list_input_files: scan and classify the source dirs (fresh
+              scan index, every dir listed)
+    plan      list_input_files (warm index) -> drop_duplicates ->
+              plan_img / plan_vid, for the configured job specs
+    image     conv_img of the planned image jobs
+    video     conv_vid (plans the clips again, as a run does)
+
+derivatives go where ingest puts them, into the tree, and are removed
+before and after; the scan index and journal go to a scratch state dir
+(--state-dir), so every run starts from the bare tree and a cold index
+
+each stage gets wall seconds, CPU of this process and of its children
+(gm, ffmpeg) and items per second; the result is JSON (stdout or
+--json FILE), --baseline FILE prints the speedup of each stage against
+an earlier result
+
+    python -m bench.stages [--tree DIR] [--jpeg 1000] [--video 5] ...
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import imgconv
+import ingest
+import scanner
+import vidconv
+from bench import tree
+
+STAGES = ("scan", "plan", "image", "video")
+
+
+def _cpu(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def timed(func, *args):
+    """
+    (result of func, timing dict without items)
+    """
+    start = time.time()
+    own = _cpu(resource.RUSAGE_SELF)
+    children = _cpu(resource.RUSAGE_CHILDREN)
+    result = func(*args)
+    return result, {"seconds": time.time() - start,
+                    "cpu_self": _cpu(resource.RUSAGE_SELF) - own,
+                    "cpu_children": (_cpu(resource.RUSAGE_CHILDREN) -
+                                     children)}
+
+
+def ingest_run(args, state_root):
+    """
+    ingest.foo for the tree, configured from the bench settings, with
+    its state below state_root
+    """
+    argv = ["-c", "-i", args.tree, "--state-dir", state_root,
+            "-j", str(args.jobs),
+            "-b", str(args.batch), "--threads", str(args.threads),
+            "--segment-min", str(args.segment_min), "--report", "",
+            "--no-calibrate", "--meta-jobs", "0",
+            "-v" if args.verbose else "-q"]
+    if args.single_decode:
+        argv.append("--single-decode")
+    if args.vid_jobs is not None:
+        argv.extend(["--vid-jobs", str(args.vid_jobs)])
+    run = ingest.foo()
+    run.setup_config(run.cmd_param(argv))
+    return run
+
+
+def clean(run):
+    """
+    remove what a run left: outputs in the tree, scan index and
+    journal in its state dir
+    """
+    base = run.conf.get_dir("base")
+    for spec in run.conf.get_job_specs().values():
+        if spec.get("loc"):
+            shutil.rmtree(os.path.join(base, spec["loc"]), True)
+    state = run.conf.get_dir("state")
+    for name in os.listdir(state):
+        os.remove(os.path.join(state, name))
+
+
+def scan(run):
+    return list(run.list_input_files(job_spec="img"))
+
+
+def plan(run):
+    """
+    (image jobs, video jobs) as a run plans them
+    """
+    img_jobs = list(run.plan_img(run.drop_duplicates(
+        run.list_input_files(job_spec="img"), "img"), run.job_specs("im")))
+    vid_jobs = list(run.plan_vid(run.drop_duplicates(
+        run.list_input_files(job_spec="vid"), "vid"),
+        run.job_specs("vid")))
+    return img_jobs, vid_jobs
+
+
+def convert(run, conv, *args):
+    """
+    conv (conv_img, conv_vid) with a fresh duplicate finder and journal,
+    as at the start of a run
+    """
+    run.use_set(run.conf.get_dir("base"))
+    run.open_journals()
+    try:
+        return conv(*args)
+    finally:
+        run.journal.close()
+
+
+def run(args):
+    """
+    run the stages, return the result dict
+    """
+    params = tree.build(args.tree, **tree.tree_params(args))
+    state_root = tempfile.mkdtemp(prefix="photo_work_bench_state")
+    one = ingest_run(args, state_root)
+    clean(one)
+    stages = {}
+    try:
+        #every stage runs, the ones after need its output; only the
+        #  ones asked for are reported
+        files, timing = timed(scan, one)
+        if "scan" in args.stages:
+            stages["scan"] = dict(timing, items=len(files))
+        (img_jobs, vid_jobs), timing = timed(plan, one)
+        if "plan" in args.stages:
+            stages["plan"] = dict(timing,
+                                  items=len(img_jobs) + len(vid_jobs))
+        if "image" in args.stages and img_jobs:
+            summary, timing = timed(convert, one, one.conv_img,
+                                    iter(img_jobs))
+            stages["image"] = dict(timing, items=len(img_jobs),
+                                   summary=summary)
+        if "video" in args.stages and vid_jobs:
+            summary, timing = timed(convert, one, one.conv_vid)
+            del summary["probed"]
+            stages["video"] = dict(timing, items=len(vid_jobs),
+                                   summary=summary)
+    finally:
+        clean(one)
+        shutil.rmtree(state_root, True)
+    for timing in stages.values():
+        timing["per_second"] = timing["items"] / max(timing["seconds"],
+                                                     1e-9)
+    return {"tree": params,
+            "settings": {"jobs": args.jobs, "batch": args.batch,
+                         "single_decode": args.single_decode,
+                         "vid_jobs": args.vid_jobs, "threads": args.threads,
+                         "segment_min": args.segment_min},
+            "env": {"python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": imgconv.default_jobs(),
+                    "scandir": scanner.scandir is not None,
+                    "pil": imgconv.Image is not None},
+            "stages": stages}
+
+
+def compare(result, baseline):
+    """
+    print each stage's time against the baseline result
+    """
+    for name in STAGES:
+        now = result["stages"].get(name)
+        then = baseline.get("stages", {}).get(name)
+        if now is None or then is None:
+            continue
+        print "{:<10} {:8.2f}s -> {:8.2f}s  {:5.2f}x".format(
+            name, then["seconds"], now["seconds"],
+            then["seconds"] / max(now["seconds"], 1e-9))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--tree', default=None,
+                        help='where to build (and reuse) the tree')
+    tree.add_arguments(parser)
+    parser.add_argument('--stages', default=",".join(STAGES),
+                        help='stages to time, comma separated'
+                        ' (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=imgconv.default_jobs())
+    parser.add_argument('-b', '--batch', type=int,
+                        default=imgconv.DEFAULT_BATCH)
+    parser.add_argument('--single-decode', action='store_true')
+    parser.add_argument('--vid-jobs', type=int, default=None)
+    parser.add_argument('--threads', type=int,
+                        default=vidconv.default_threads())
+    parser.add_argument('--segment-min', type=int,
+                        default=vidconv.SEGMENT_MIN)
+    parser.add_argument('--json', default=None,
+                        help='write the result here instead of stdout')
+    parser.add_argument('--baseline', default=None,
+                        help='earlier result to compare against')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every job')
+    args = parser.parse_args(argv)
+    args.stages = [name for name in args.stages.split(",") if name]
+    for name in args.stages:
+        if name not in STAGES:
+            parser.error("unknown stage: {}".format(name))
+    if args.tree is None:
+        args.tree = os.path.join(tempfile.gettempdir(),
+                                 "photo_work_bench_tree")
+    #levels are set by ingest from -v / -q (ingest_run)
+    logging.basicConfig()
+    result = run(args)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, "w") as fh:
+            fh.write(text + "\n")
+    else:
+        print text
+    if args.baseline:
+        with open(args.baseline) as fh:
+            compare(result, json.load(fh))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
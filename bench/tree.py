@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+"""
+synthetic media tree generator
+
+builds a reproducible tree (same seed and counts, same tree) in one of
+the layouts ingest looks for:
+    raw-media   <top>/raw-media/<date>_-card/DCIM/<nnn>PANA/P<nnnnnnn>.JPG
+    jpg         <top>/jpg/<nnn>/P<nnnnnnn>.JPG
+with extra directory levels below the card (depth), and a mix of
+    jpeg    real JPEGs of --jpeg-dims with PIL/Pillow (seeded noise, so
+            no two are alike); without it, a JPEG header (frame size)
+            padded to size, enough to scan, classify and plan
+    raw     TIFF based raw (.RW2): TIFF header, random body
+    video   real clips (.MTS, ffmpeg test source, numbered so none are
+            duplicates) when ffmpeg is there; otherwise transport stream
+            sync bytes and a random body
+    misc    text and sidecar files
+
+    python -m bench.tree DIR [--jpeg 1000] [--raw 200] [--video 5] ...
+
+a marker file records the parameters, an existing tree with the same
+ones is reused
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+LAYOUTS = ("raw-media", "jpg")
+DEFAULTS = {"layout": "raw-media", "seed": 1, "jpeg": 1000, "raw": 0,
+            "video": 0, "misc": 50, "cards": 2, "depth": 0,
+            "files_per_dir": 500, "jpeg_dims": "1600x1200",
+            "raw_size": 1 << 20, "video_seconds": 5,
+            "video_dims": "1280x720", "video_size": 4 << 20}
+MARKER = ".bench_tree.json"
+MISC_EXT = ("txt", "xmp", "THM", "CTG")
+
+
+def jpeg_header(width, height):
+    """
+    SOI, a JFIF APP0 and a baseline frame header of width x height,
+    what the classifier and imgconv.jpeg_dimensions read
+    """
+    app0 = "JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    sof = struct.pack(">BHHB", 8, height, width, 3) + (
+        "\x01\x22\x00\x02\x11\x01\x03\x11\x01")
+    return ("\xff\xd8" +
+            "\xff\xe0" + struct.pack(">H", len(app0) + 2) + app0 +
+            "\xff\xc0" + struct.pack(">H", len(sof) + 2) + sof)
+
+
+def _random_bytes(rnd, size):
+    if size <= 0:
+        return ""
+    return ("%0*x" % (2 * size, rnd.getrandbits(8 * size))).decode("hex")
+
+
+def write_jpeg(path, rnd, dims):
+    if Image is None:
+        with open(path, "wb") as fh:
+            fh.write(jpeg_header(*dims) + _random_bytes(rnd, 4096) +
+                     "\xff\xd9")
+        return
+    #coarse noise scaled up: compresses like a photo, not like static
+    small = Image.new("RGB", (16, 12))
+    small.putdata([(rnd.randrange(256), rnd.randrange(256),
+                    rnd.randrange(256)) for i in range(16 * 12)])
+    small.resize(dims, Image.BILINEAR).save(path, quality=90)
+
+
+def write_raw(path, rnd, size):
+    with open(path, "wb") as fh:
+        fh.write("II*\x00\x08\x00\x00\x00")
+        left = max(0, size - 8)
+        while left:
+            block = min(left, 1 << 16)
+            fh.write(_random_bytes(rnd, block))
+            left -= block
+
+
+def write_video(path, rnd, number, params):
+    """
+    a real clip if ffmpeg can make one, transport stream lookalike
+    otherwise
+    """
+    cmd = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i",
+           "testsrc=duration={}:size={}:rate=30".format(
+               params["video_seconds"], params["video_dims"]),
+           "-c:v", "libx264", "-preset", "ultrafast",
+           "-metadata", "comment=bench {}".format(number), "-f", "mpegts",
+           path]
+    try:
+        with open(os.devnull, "w") as devnull:
+            if 0 == subprocess.call(cmd, stdout=devnull, stderr=devnull):
+                return
+    except OSError:
+        pass
+    with open(path, "wb") as fh:
+        for i in xrange(max(1, params["video_size"] // 188)):
+            fh.write("\x47" + _random_bytes(rnd, 187) if i < 64 else
+                     "\x47" + "\xff" * 187)
+
+
+def leaf_dirs(top, params):
+    """
+    generate the leaf directories files go into, in order
+    """
+    number = 0
+    while True:
+        if "jpg" == params["layout"]:
+            parent = os.path.join(top, "jpg")
+        else:
+            card = "2013-01-{:02d}_-card".format(
+                number % params["cards"] % 28 + 1)
+            parent = os.path.join(top, "raw-media", card, "DCIM")
+        leaf = os.path.join(parent, "{:03d}PANA".format(100 + number))
+        for level in range(params["depth"]):
+            leaf = os.path.join(leaf, "sub{}".format(level))
+        yield leaf
+        number += 1
+
+
+def build(top, **kwargs):
+    """
+    build (or reuse) the tree below top, return its parameters
+
+    keyword arguments: see DEFAULTS
+    """
+    params = dict(DEFAULTS)
+    params.update((k, v) for k, v in kwargs.items() if v is not None)
+    if params["layout"] not in LAYOUTS:
+        raise ValueError("unknown layout: {}".format(params["layout"]))
+    marker = os.path.join(top, MARKER)
+    if os.path.exists(marker):
+        with open(marker) as fh:
+            if json.load(fh) == params:
+                return params
+        raise ValueError("{} holds a different tree".format(top))
+    rnd = random.Random(params["seed"])
+    jpeg_dims = tuple(int(v) for v in params["jpeg_dims"].split("x"))
+    kinds = (["jpeg"] * params["jpeg"] + ["raw"] * params["raw"] +
+             ["video"] * params["video"] + ["misc"] * params["misc"])
+    #interleaved like a card: photos, the odd clip and sidecars
+    rnd.shuffle(kinds)
+    leaves = leaf_dirs(top, params)
+    leaf = None
+    for number, kind in enumerate(kinds):
+        if 0 == number % params["files_per_dir"]:
+            leaf = next(leaves)
+            if not os.path.isdir(leaf):
+                os.makedirs(leaf)
+        stem = os.path.join(leaf, "P{:07d}".format(number))
+        if "jpeg" == kind:
+            write_jpeg(stem + ".JPG", rnd, jpeg_dims)
+        elif "raw" == kind:
+            write_raw(stem + ".RW2", rnd, params["raw_size"])
+        elif "video" == kind:
+            write_video(stem + ".MTS", rnd, number, params)
+        else:
+            with open(stem + "." + rnd.choice(MISC_EXT), "w") as fh:
+                fh.write("bench {}\n".format(number))
+    with open(marker, "w") as fh:
+        json.dump(params, fh, sort_keys=True)
+    return params
+
+
+def add_arguments(parser):
+    """
+    tree options, shared with the stage harness
+    """
+    parser.add_argument('--layout', choices=LAYOUTS,
+                        help='directory layout (default: raw-media)')
+    parser.add_argument('--seed', type=int, help='random seed')
+    for kind in ("jpeg", "raw", "video", "misc"):
+        parser.add_argument('--' + kind, type=int,
+                            help='number of {} files'.format(kind))
+    parser.add_argument('--cards', type=int, help='cards (raw-media)')
+    parser.add_argument('--depth', type=int,
+                        help='extra directory levels below a card')
+    parser.add_argument('--files-per-dir', type=int)
+    parser.add_argument('--jpeg-dims', help='WxH of the JPEGs')
+    parser.add_argument('--raw-size', type=int, help='bytes per raw file')
+    parser.add_argument('--video-seconds', type=int)
+    parser.add_argument('--video-dims', help='WxH of the clips')
+    parser.add_argument('--video-size', type=int,
+                        help='bytes per clip when ffmpeg can not make one')
+
+
+def tree_params(args):
+    return dict((key, getattr(args, key, None)) for key in DEFAULTS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('top', help='where to build the tree')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    params = build(args.top, **tree_params(args))
+    print json.dumps(params, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+cost estimates of a job plan, for dry runs: CPU seconds, wall time at
+the configured parallelism and output bytes, from what is known before
+converting anything:
+    images: pixel size from the JPEG frame header, the reduced size
+        libjpeg will decode at (imgconv.decode_size), gm processes
+    video: duration, frame rate and size from ffprobe, encode profile,
+        and whether a clip is linked, remuxed or transcoded
+        (vidconv.plan_clip)
+
+the per operation costs are rough figures for one core; a real run
+compares the estimate for the work it did with the CPU its children
+used (calibrate) and keeps the ratio per kind in a small JSON file, so
+estimates settle on the speed of the machine they run on; it estimates
+from what the conversion already knew (summaries, the clips run_jobs
+probed), so calibrating costs no extra reads or probes
+"""
+
+import json
+import logging
+import os
+
+import imgconv
+import vidconv
+
+DEFAULT_PATH = os.path.join("~", ".cache", "photo_work", "costs.json")
+#CPU seconds per megapixel decoded (gm, JPEG), per job (resize, encode,
+#  write) and per gm process started
+IMG_DECODE_MPX = 0.012
+IMG_JOB = 0.02
+IMG_SPAWN = 0.04
+#output bytes per pixel of a quality 50 JPEG
+JPEG_BYTES_PX = 0.12
+#bytes per pixel of a source that is not a JPEG (no header read)
+OTHER_BYTES_PX = 0.5
+#CPU seconds per megapixel of output frames, by encode profile, and per
+#  megapixel of source frames decoded
+VID_ENCODE_MPX = {"draft": 0.015, "standard": 0.07, "archive": 0.3}
+VID_DECODE_MPX = 0.001
+#seek + keyframe decode of a poster or scrub thumbnail, per source
+#  megapixel
+VID_THUMB_MPX = 0.03
+#stream copy, CPU seconds per MB
+VID_COPY_MB = 0.003
+#bits/s (video + audio) by profile at REF_PX, scaled with output pixels
+VID_BITRATE = {"draft": 864000, "standard": 800000, "archive": 1330000}
+REF_PX = 640 * 360
+#guesses for clips ffprobe could not tell about
+GUESS_DIMS = (1920, 1080)
+GUESS_FPS = 30.0
+#threads one encode makes good use of (libvpx row-mt)
+ENCODE_THREADS = 4
+#learned ratios are moved this far towards a new run's ratio
+WEIGHT = 0.5
+
+
+def _mpx(dims):
+    return dims[0] * dims[1] / 1e6
+
+
+def _fit(dims, spec, default):
+    """
+    output size of a spec for a source of dims (resize, then crop)
+    """
+    box = imgconv.parse_dims(spec.get("resizedims", default))
+    out = imgconv._fit_size(dims, box)
+    if spec.get("crop") and spec.get("cropdims"):
+        crop = imgconv.parse_dims(spec["cropdims"])
+        out = (min(out[0], crop[0]), min(out[1], crop[1]))
+    return out
+
+
+def _total(kind):
+    return {"kind": kind, "jobs": 0, "existing": 0, "cpu": 0.0,
+            "wall": 0.0, "bytes": 0, "src_bytes": 0}
+
+
+class cost_model(object):
+    """
+    the costs above times a learned scale per kind (img, vid)
+
+    path: JSON file the scales are kept in, None to keep nothing
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = os.path.expanduser(path) if path else None
+        self.scale = {"img": 1.0, "vid": 1.0}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as fh:
+                    self.scale.update(json.load(fh))
+            except (IOError, ValueError):
+                pass
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path, "w") as fh:
+                json.dump(self.scale, fh)
+        except (IOError, OSError), e:
+            logging.getLogger("base").warn(
+                "cannot keep cost calibration: {}".format(e))
+
+    def calibrate(self, kind, estimated, actual):
+        """
+        move the scale of kind towards what a run actually used, both
+        in CPU seconds, estimated with the current scale
+        """
+        if estimated <= 0 or actual <= 0:
+            return
+        self.scale[kind] *= (float(actual) / estimated) ** WEIGHT
+
+    def img_cpu(self, px_decoded, jobs, spawns):
+        """
+        CPU seconds of image work, also from a run summary (done,
+        px_decoded, spawns) to calibrate
+        """
+        return self.scale["img"] * (IMG_DECODE_MPX * px_decoded / 1e6 +
+                                    IMG_JOB * jobs + IMG_SPAWN * spawns)
+
+    def images(self, jobs, n_jobs, batch_size, single_decode):
+        """
+        estimate of image conversion jobs (list), a dict of
+        jobs, cpu, wall, bytes (output), src_bytes
+        """
+        total = _total("img")
+        by_source = {}
+        for job in jobs:
+            by_source.setdefault(job["infile"], []).append(job)
+        px_decoded = 0
+        for infile, source_jobs in by_source.items():
+            try:
+                src_bytes = os.path.getsize(infile)
+            except OSError:
+                continue
+            total["src_bytes"] += src_bytes
+            dims = imgconv.jpeg_dimensions(infile)
+            if dims is None:
+                #full decode of a size guessed from the file
+                side = int((src_bytes / OTHER_BYTES_PX / 1.5) ** 0.5)
+                dims = decoded = (side * 3 // 2, side)
+                decodes = [decoded] * len(source_jobs)
+            elif single_decode:
+                decodes = [imgconv.decode_size(
+                    dims, [job["spec"] for job in source_jobs])]
+            else:
+                decodes = [imgconv.decode_size(dims, [job["spec"]])
+                           for job in source_jobs]
+            px_decoded += sum(w * h for w, h in decodes)
+            for job in source_jobs:
+                out = _fit(dims, job["spec"], "800x800")
+                total["bytes"] += int(out[0] * out[1] * JPEG_BYTES_PX)
+        total["jobs"] = len(jobs)
+        if single_decode:
+            spawns = 0
+        elif batch_size > 1:
+            spawns = -(-len(jobs) // batch_size)
+        else:
+            spawns = len(jobs)
+        total["cpu"] = self.img_cpu(px_decoded, len(jobs), spawns)
+        #many small jobs, they spread evenly over the workers
+        total["wall"] = total["cpu"] / max(1, min(n_jobs, len(jobs) or 1))
+        return total
+
+    def video_job(self, job, info):
+        """
+        (cpu, output bytes) of one probed video job
+        """
+        spec = job["spec"]
+        dims = (info["width"], info["height"])
+        if None in dims:
+            dims = GUESS_DIMS
+        mode = job.get("mode", "transcode")
+        if "poster" == mode or "sprite" == mode:
+            count = spec.get("sprite", 1) if "sprite" == mode else 1
+            dims_key = "spritedims" if "sprite" == mode else "resizedims"
+            out = _fit(dims, {"resizedims": spec.get(dims_key,
+                                                     vidconv.VID_DIMS)},
+                       vidconv.VID_DIMS)
+            return (count * VID_THUMB_MPX * _mpx(dims),
+                    int(count * out[0] * out[1] * JPEG_BYTES_PX))
+        try:
+            src_bytes = os.path.getsize(job["infile"])
+        except OSError:
+            src_bytes = 0
+        if "link" == mode:
+            return 0.0, 0
+        if "remux" == mode:
+            return VID_COPY_MB * src_bytes / 1e6, src_bytes
+        duration = info["duration"]
+        if duration is None:
+            duration = float(src_bytes) / vidconv.BYTES_PER_SECOND
+        frames = duration * (info["fps"] or GUESS_FPS)
+        out = _fit(dims, spec, vidconv.VID_DIMS)
+        profile = spec.get("profile", vidconv.DEFAULT_PROFILE)
+        cpu = frames * (VID_ENCODE_MPX.get(profile, VID_ENCODE_MPX[
+            vidconv.DEFAULT_PROFILE]) * _mpx(out) +
+            VID_DECODE_MPX * _mpx(dims))
+        bitrate = VID_BITRATE.get(profile,
+                                  VID_BITRATE[vidconv.DEFAULT_PROFILE])
+        return cpu, int(duration * bitrate * out[0] * out[1] / REF_PX / 8)
+
+    def video_cpu(self, jobs):
+        """
+        CPU seconds of probed video jobs (the "probed" jobs of a
+        vidconv.run_jobs summary), to calibrate
+        """
+        return self.scale["vid"] * sum(self.video_job(job, job)[0]
+                                       for job in jobs)
+
+    def videos(self, jobs, threads, segment_min, probes=None):
+        """
+        estimate of video jobs (list), as images(); jobs whose preview
+        exists are counted as existing, not costed
+
+        probes: scanindex.scan_index with recorded ffprobe results
+        """
+        total = _total("vid")
+        longest = 0.0
+        for job in jobs:
+            if [name for name in vidconv.preview_names(job)
+                    if os.path.exists(name)]:
+                total["existing"] += 1
+                continue
+            info = vidconv.probe(job["infile"], probes)
+            job = dict(job, **info)
+            if "transcode" == job.get("mode", "transcode"):
+                job["mode"], job["outfile"] = vidconv.plan_clip(job)
+            cpu, out_bytes = self.video_job(job, info)
+            cpu *= self.scale["vid"]
+            total["jobs"] += 1
+            total["cpu"] += cpu
+            total["bytes"] += out_bytes
+            try:
+                total["src_bytes"] += os.path.getsize(job["infile"])
+            except OSError:
+                pass
+            #long clips are encoded as segments, in parallel
+            if (segment_min and info["duration"] and
+                    info["duration"] >= segment_min):
+                cpu *= float(vidconv.SEGMENT_SECONDS) / info["duration"]
+            longest = max(longest, cpu / ENCODE_THREADS)
+        total["wall"] = max(total["cpu"] / max(1, threads), longest)
+        return total
+
+
+def report(log, totals, n_duplicates=0):
+    """
+    log plan estimates (dicts from images() / videos())
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    for total in totals:
+        log.info("plan {kind}: {jobs} jobs, {existing} outputs there"
+                 " already, {mb_in} MB in, ~{mb_out} MB out,"
+                 " ~{cpu:.0f}s CPU, ~{wall:.0f}s wall".format(
+                     mb_in=total["src_bytes"] >> 20,
+                     mb_out=total["bytes"] >> 20, **total))
+    log.info("plan: {} duplicates left out, ~{:.0f}s CPU, ~{:.0f}s wall"
+             " (run one after the other), ~{} MB out".format(
+                 n_duplicates, sum(t["cpu"] for t in totals),
+                 sum(t["wall"] for t in totals),
+                 sum(t["bytes"] for t in totals) >> 20))
@@ -37,7 +37,7 @@ VERSION
 """
 
 import argparse
-import hashlib
+import contextlib
 import logging
 import optparse
 import os
@@ -48,6 +48,16 @@ import sys
 import time
 import traceback
 
+import derivcache
+import filetypes
+import imgconv
+import metrics
+import profiling
+import progress
+import scanindex
+import statedir
+import vidconv
+
 ###
 #Configurations:
 #external utilities
@@ -87,7 +97,7 @@ rawExt=[#ref:   http://en.wikipedia.org/wiki/Raw_image_format
     '.r3d',
     '.raf',
     '.raw','.rw2',
-    '.raw','.rwl','.dng'
+    '.raw','.rwl','.dng',
     '.rwz',
     '.x3f',
     '.tiff',
@@ -118,7 +128,8 @@ outputConfig.append({'name':'800','loc':'0800','image':True,
 #   'resize':True,'crop':False,'resizedims':'1200x1200'})
 outputConfig.append({'name':'img','loc':None,'image':False,'ext':imgExt})
 outputConfig.append({'name':'raw','loc':'raw','image':False,'ext':rawExt})
-outputConfig.append({'name':'video','loc':'vid','image':False,'ext':vidExt})
+outputConfig.append({'name':'video','loc':'vid','image':False,'ext':vidExt,
+    'resizedims':'640x360','profile':'draft'})
 outputConfig.append({'name':'misc','loc':'misc','image':False,'ext':allExt})
 #TODO: Set the default log format to something quieter:
 #Levels:
@@ -141,6 +152,12 @@ outputConfig.append({'name':'misc','loc':'misc','image':False,'ext':allExt})
 def shutdown_logging():
         logging.shutdown()
 
+def verbosity_level(cmd_opts=dict()):
+    #+1 per '-q', -1 per '-v' (unverbosity - verbosity: -v is more verbose)
+    if "verbosity" in cmd_opts and "unverbosity" in cmd_opts:
+        return cmd_opts["unverbosity"] - cmd_opts["verbosity"]
+    return 0
+
 def setup_logging(cmd_opts=dict()):
     #ref: http://onlamp.com/pub/a/python/2005/06/02/logging.html
     #ref: http://docs.python.org/library/logging.html
@@ -150,9 +167,7 @@ def setup_logging(cmd_opts=dict()):
     #create console handler (C H) and set level to debug
     ch = logging.StreamHandler()
     # +5 per '-q', -5 per '-v'
-    verb_level = 0
-    if "verbosity" in cmd_opts and "unverbosity" in cmd_opts:
-        verb_level = cmd_opts["unverbosity"] + cmd_opts["verbosity"]
+    verb_level = verbosity_level(cmd_opts)
     ch.setLevel(logging.INFO+5*( verb_level ))
 
     #create formatter
@@ -188,43 +203,43 @@ def prep_base_dir( log, dir, cmd_opts=dict()):
         log.error('missing subdirectory ("jpg") with images')
         sys.exit(-1)
 
-def generate_file_lists(log, basedir):
+def _open_index(basedir, cmd_opts=dict()):
+    #scan index of basedir, kept in its state dir (--state-dir)
+    return scanindex.scan_index(basedir, scanindex.index_path(
+        statedir.state_dir(basedir, cmd_opts.get("state_dir"))))
+
+def generate_file_lists(log, basedir, cmd_opts=dict(), run_metrics=None):
     """
     generate multiple lists of files on which to then work
 
+    the scan goes through the set's scan index, so only directories
+    changed since the last run are listed and classified again
+    run_metrics: metrics.run_metrics to count the files in, if any
+
     TODO: this should be fixed up with everything else someday
     """
+    exts = {}
     for outConf in outputConfig:
-        if "img" == outConf["name"]:
-            patStr = "$|".join(outConf["ext"])+"$"
-            img_pat = re.compile(patStr, re.I)
-        if "raw" == outConf["name"]:
-            patStr = "$|".join(outConf["ext"])+"$"
-            raw_pat = re.compile(patStr, re.I)
-        if "video" == outConf["name"]:
-            patStr = "$|".join(outConf["ext"])+"$"
-            vid_pat = re.compile(patStr, re.I)
-    jpglist = []
-    rawlist = []
-    vidlist = []
-    otherlist = []
+        if outConf["name"] in ("img", "raw", "video"):
+            exts[outConf["name"]] = outConf["ext"]
+    #suffix lookup, header sniffing for files the suffix says nothing of
+    classifier = filetypes.file_classifier(exts["img"], exts["raw"],
+        exts["video"])
     proc_lists = {"img":[],"raw":[],"vid":[],"misc":[]}
-    for root, dirs, files in os.walk(basedir):
-        for walked_file in files:
-            file_path = os.path.join(root,walked_file)
-            #print file_path
-            if img_pat.search(file_path):
-                jpglist.append(file_path)
-                proc_lists["img"].append(file_path)
-            elif raw_pat.search(file_path):
-                rawlist.append(file_path)
-                proc_lists["raw"].append(file_path)
-            elif vid_pat.search(file_path):
-                vidlist.append(file_path)
-                proc_lists["vid"].append(file_path)
-            else:
-                otherlist.append(file_path)
-                proc_lists["misc"].append(file_path)
+    index = _open_index(basedir, cmd_opts)
+    for file_path, size, mtime, file_class in index.scan(
+            classify=classifier.classify,
+            full=cmd_opts.get("full_scan", False)):
+        proc_lists[file_class].append(file_path)
+    index.close()
+    log.log(15, "scan: %(dirs_listed)d dirs listed, %(dirs_skipped)d "
+        "unchanged, %(files_classified)d files classified" % index.stats)
+    if run_metrics is not None:
+        for file_class in proc_lists:
+            run_metrics.count("files_scanned", len(proc_lists[file_class]),
+                file_class=file_class)
+        run_metrics.count("files_classified",
+            index.stats["files_classified"])
     #for pl in proc_lists: print pl, proc_lists[pl]
     #return(alllist,jpglist,otherlist) #OLD RETURN
     return(proc_lists)
@@ -263,7 +278,7 @@ def _WIP_generate_file_lists(log,basedir):
     return dir_info
     return(all_list,jpg_list,other_list)
 
-def handle_non_jpg(log,basedir):
+def handle_non_jpg(log,basedir,cmd_opts=dict(),run_metrics=None):
     """
     Move non-jpg files
     
@@ -279,7 +294,7 @@ def handle_non_jpg(log,basedir):
     #indir = os.path.join(basedir,'jpg')
     #create lists of jpg and other files
     #(alllist,jpglist,otherlist) = generate_file_lists(log,basedir)
-    proc_lists = generate_file_lists(log, basedir)
+    proc_lists = generate_file_lists(log, basedir, cmd_opts)
     log.info("trace: handle_non_jpg enter")
     log.warn("NOTE: hardcoding configuration; TODO: rework config framework")
     pathStyle_old = re.compile("^[^A-Za-z0-9]*jpg", re.I)
@@ -307,7 +322,7 @@ def handle_non_jpg(log,basedir):
             for filetype in outputConfig:
                 if filetype["image"]: continue  #image processing, deal later
                 if name == filetype["name"]:
-                    print "moving?!?", path
+                    log.log(imgconv.FILE_LOG, "moving %s"%path)
                     config = filetype
                     outdir = os.path.join(basedir, config["loc"])
                     infile = os.path.join(basedir, path)
@@ -318,8 +333,12 @@ def handle_non_jpg(log,basedir):
                     if not os.path.exists(outdir):
                         log.warn("creating: %s"%outdir)
                         os.mkdir(outdir)
+                        if run_metrics is not None:
+                            run_metrics.count("dirs_created")
                     #log.info("not moving:\n\t\t%s\n\t\t%s"%(infile,outfile))
                     os.rename(infile,outfile)
+                    if run_metrics is not None:
+                        run_metrics.count("files_moved", file_class=key)
     log.info("trace: handle_non_jpg exit")
     return
 
@@ -336,17 +355,56 @@ def placeholder():
                         if not os.path.exists(outdir):  os.mkdir(outdir)
                         os.rename(infile,outfile)
 
-def convert_jpg(log, basedir, cmd_opts=dict()):
+def plan_img_jobs(log, basedir, img_files, reporter=None):
+    """
+    conversion jobs for the image outputs not there yet
+
+    a name is taken by the first source to want it, be it an output
+    already on disk or one planned earlier in this run (jpg/a/IMG.JPG
+    and jpg/b/IMG.JPG write the same derivative)
+    """
+    img_jobs = []
+    #one listing per output dir rather than a stat per output
+    out_names = {}
+    for filetype in outputConfig:
+        if filetype["image"]:
+            outdir = os.path.join(basedir,filetype['loc'])
+            if not os.path.exists(outdir):  os.mkdir(outdir)
+            out_names[outdir] = set(os.listdir(outdir))
+    for img_file in img_files:
+        for filetype in outputConfig:
+            if filetype["image"]:
+                outdir = os.path.join(basedir,filetype['loc'])
+                outfile = os.path.join(outdir, os.path.basename(img_file))
+                infile = img_file
+                if os.path.basename(img_file) in out_names[outdir]:
+                    log.log(imgconv.FILE_LOG,
+                        "skipping existant file: %s"%outfile)
+                        #filetype['name']+'/'+str(file)+' exists, skipping')
+                    continue
+                img_jobs.append(imgconv.make_job(infile, outfile, filetype))
+                #also keeps two sources with one name from colliding
+                out_names[outdir].add(os.path.basename(img_file))
+                if reporter is not None:
+                    reporter.planned("img", filetype["name"])
+    if reporter is not None:
+        reporter.planning_done("img")
+    return img_jobs
+
+def convert_jpg(log, basedir, cmd_opts=dict(), run_metrics=None,
+        reporter=None):
     """
     resize/crop images
     
     run convert/gm convert on jpg files
     also, consider ffmpeg for video files
     maybe use config to set raw conversion (thumbnailing?)
+    run_metrics: metrics.run_metrics to account the jobs to, if any
+    reporter: progress.progress_reporter to count the planned jobs in
     """
     log.info("trace: convert_jpg enter")
     log.warn("NOTE: hardcoding configuration; TODO: rework config framework")
-    proc_lists = generate_file_lists(log, basedir)
+    proc_lists = generate_file_lists(log, basedir, cmd_opts, run_metrics)
     pathStyle_old = re.compile("^[^A-Za-z0-9]*jpg", re.I)
     pathStyle_new = re.compile("^[^A-Za-z0-9]*raw-media", re.I)
     keys_names = [  #this is a kluge to map sorting methods
@@ -354,59 +412,34 @@ def convert_jpg(log, basedir, cmd_opts=dict()):
         ( "vid","video"),
         ( "misc","misc"),
         ]
-    for img_file in proc_lists["img"]:
-        for filetype in outputConfig:
-            if filetype["image"]:
-                outdir = os.path.join(basedir,filetype['loc'])
-                if not os.path.exists(outdir):  os.mkdir(outdir)
-                outfile = os.path.join(outdir, os.path.basename(img_file))
-                infile = img_file
-                if os.path.exists(outfile):
-                    log.warn("skipping existant file: %s"%outfile)
-                        #filetype['name']+'/'+str(file)+' exists, skipping')
-                    continue
-                shutil.copy2(infile,outfile)
-                subprocess.call(["gm", "mogrify", "-quality", "50",
-                    "-resize", filetype["resizedims"], outfile])
-                if filetype['crop']:
-                    subprocess.call(['gm', 'mogrify', '-gravity center',
-                        '-extent', filetype['cropdims'], outfile])
-                log.info("proccessed %s"%outfile)
+    img_jobs = plan_img_jobs(log, basedir, proc_lists["img"], reporter)
+    #resize/crop on a pool of worker processes (-j/--jobs)
+    summary = imgconv.run_jobs(log, img_jobs, cmd_opts.get("jobs"),
+        cmd_opts.get("batch", imgconv.DEFAULT_BATCH),
+        cmd_opts.get("single_decode", False),
+        derivcache.open_cache(cmd_opts.get("cache_dir"),
+            cmd_opts.get("cache_size", derivcache.DEFAULT_SIZE_MB)),
+        metrics=run_metrics)
+    vid_jobs = []
     for filetype in outputConfig:
         if "video" == filetype["name"]:
+            outdir = os.path.join(basedir,'vid-sm')
+            if not os.path.exists(outdir):  os.mkdir(outdir)
             for vid_file in proc_lists["vid"]:
-                log.warn("TODO: integrate hardcoded config into framework")
-                outdir = os.path.join(basedir,'vid-sm')
-                if not os.path.exists(outdir):  os.mkdir(outdir)
-                log.warn("Hardcoding raw-media directory name here")
-                sha = hashlib.sha256()
-                sha.update(vid_file)
-                sub_hash = sha.hexdigest()[0:6]
-                med_strip = vid_file.split("raw-media")[1][1:]
-                vid_card_date = med_strip[0:11]
-                #print vid_file
-                #print "hash", sub_hash
-                #print "date", vid_card_date
-                infile = vid_file
-                out_pre= vid_card_date
-                outbase = os.path.splitext( os.path.basename(vid_file) )[0]
-                out_ext = "webm"
-                outname = "{}_{}.{}".format(out_pre, outbase, out_ext)
-                outfile = os.path.join(outdir, outname)
-                print infile
-                print outfile
-                print os.path.exists(outfile)
-                if os.path.exists(outfile):
-                    log.warn("skipping existant file: %s"%outfile)
-                    continue
-                #print "\n>>>>>SKIP FFMPEG CALL FOR NOW<<<<<\n"
-                #continue
-                log.warn("TODO: autoscale to keep aspect ratio w/ ffmpeg")
-                subprocess.call(["ffmpeg", "-i", infile, "-vf",
-                    "scale=640:360", outfile])
-                print vid_file
-                print filetype
-
+                #vid-sm previews, encode profile from the spec
+                vid_jobs.extend(vidconv.make_jobs(vid_file, outdir,
+                                                  filetype))
+    if reporter is not None:
+        for job in vid_jobs:
+            reporter.planned("vid", job["spec"]["name"])
+        reporter.planning_done("vid")
+    #several encodes at once, sharing a thread budget (--threads)
+    #clips are probed once, results kept in the scan index
+    index = _open_index(basedir, cmd_opts)
+    summary["video"] = vidconv.run_jobs(log, vid_jobs,
+        cmd_opts.get("vid_jobs"), cmd_opts.get("threads"),
+        cmd_opts.get("segment_min"), index, metrics=run_metrics)
+    index.close()
 
     #time for i in [0FMP]*[IVS];
     #    do out=`echo $i | sed -Ee 's/(MTS)|(AVI)|(MOV)/webm/'`;
@@ -421,7 +454,7 @@ def convert_jpg(log, basedir, cmd_opts=dict()):
 
     log.info("TODO: unify processing, esp vid/img")
     log.info("trace: convert_jpg exit")
-    return
+    return summary
 
 def old_convert_jpg(log, basedir):
     indir = os.path.join(basedir,'jpg')
@@ -485,28 +518,49 @@ def parse_command_line():
     parser.add_argument('-v', '--verbose', action='count', dest='verbosity',default=0, help='verbose output')
     parser.add_argument('-q', '--quiet', action='count', dest='unverbosity',default=0, help='quiet output')
     parser.add_argument('-i', '--imagedir', action='store', default='.', help='directory containing images, examples: <dir>/jpg/<images>; <dir>/<raw-media>/*/DCIM/<addl_dir>/<images>', dest='imagedir')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=imgconv.default_jobs(), help='number of parallel conversion processes (default: number of cores)', dest='jobs')
+    parser.add_argument('-b', '--batch', action='store', type=int, default=imgconv.DEFAULT_BATCH, help='images per gm batch session, 1 to run gm once per command (default: %(default)s)', dest='batch')
+    parser.add_argument('--single-decode', action='store_true', default=False, help='decode each image once for all output sizes (needs PIL/Pillow)', dest='single_decode')
+    parser.add_argument('--cache-dir', action='store', nargs='?', const=derivcache.DEFAULT_DIR, default=None, help='keep derivatives in a cache shared by all sets and reuse them for sources converted before; costs a sha256 of every source, so off unless given (default dir: %s)'%derivcache.DEFAULT_DIR, dest='cache_dir')
+    parser.add_argument('--cache-size', action='store', type=int, default=derivcache.DEFAULT_SIZE_MB, help='derivative cache size limit in MB (default: %(default)s)', dest='cache_size')
+    parser.add_argument('--vid-jobs', action='store', type=int, default=None, help='number of video encodes at once (default: thread budget / %d)'%vidconv.MIN_THREADS, dest='vid_jobs')
+    parser.add_argument('--threads', action='store', type=int, default=vidconv.default_threads(), help='CPU threads shared by the video encodes (default: %(default)s)', dest='threads')
+    parser.add_argument('--segment-min', action='store', type=int, default=vidconv.SEGMENT_MIN, help='encode clips this long (seconds) in parallel segments, 0 to never split (default: %(default)s)', dest='segment_min')
+    parser.add_argument('--full-scan', action='store_true', default=False, help='list every directory, not only the ones changed since the last run', dest='full_scan')
+    parser.add_argument('--report', action='store', default=None, help='JSON run report, empty for none (default: %s in the state dir)'%metrics.REPORT_NAME, dest='report')
+    parser.add_argument('--profile', action='store', nargs='?', const='', default=None, help='profile prep and conv (cProfile) and time every gm and ffmpeg run, writes PROFILE.<stage>.pstats (default: %s in the state dir)'%profiling.PROFILE_NAME, dest='profile')
+    parser.add_argument('--state-dir', action='store', default=None, help='keep the scan index, run report and profile of the image dir in a dir of its own below this one, not in the image dir (default: %s)'%statedir.DEFAULT_ROOT, dest='state_dir')
+    parser.add_argument('--prom-file', action='store', default=None, help='also write the run metrics in the Prometheus text format (node_exporter textfile collector)', dest='prom_file')
     return vars(parser.parse_args())
 
+@contextlib.contextmanager
+def _profiled(profile, name):
+    #a profile stage when profiling, nothing otherwise
+    if profile is None:
+        yield
+    else:
+        with profile.stage(name):
+            yield
+
 def main ():
 
     options = parse_command_line()
     print "early return"
-    # use a dict for the summary info.
-    # fix to be a class, so self.summary_info works...
-    summary_info = {}
-    #add: directory
-    #start,prep_start,conv_start,stop times
-    #directories created
-    #files:
-    #   moved
-    #   converted
-    #   skipped
+    #--profile: cProfile per stage, tool runs, slowest files and specs
+    profile = None
+    if options["profile"] is not None:
+        profile = profiling.run_profile()
 
     #note the time for summary
     time_start = time.time()
 
-    log=setup_logging()
+    log=setup_logging(options)
     log.info('Image Processing!')
+
+    #files/s, MB/s and ETA from a thread, not a line per file; off with -q
+    reporter = progress.for_verbosity(verbosity_level(options), log)
+    #counters, latencies and stage times, summary_info is its report
+    run_metrics = metrics.run_metrics(profile, reporter)
     
     #it would be nice to be able to run on multiple directories, glob
     basedir=options['imagedir']
@@ -515,14 +569,24 @@ def main ():
     time_start_prep = time.time()
 
     #directory setup and related work
-    prep_base_dir(log, basedir, cmd_opts=options)
-    handle_non_jpg(log, basedir)
+    with run_metrics.stage("prep"), _profiled(profile, "prep"):
+        prep_base_dir(log, basedir, cmd_opts=options)
+        handle_non_jpg(log, basedir, cmd_opts=options,
+            run_metrics=run_metrics)
 
     #note the time for summary
     time_start_conv = time.time()
 
     #image conversion
-    convert_jpg(log,basedir)
+    if reporter is not None:
+        reporter.start()
+    try:
+        with run_metrics.stage("conv"), _profiled(profile, "conv"):
+            conv_summary = convert_jpg(log,basedir,cmd_opts=options,
+                run_metrics=run_metrics, reporter=reporter)
+    finally:
+        if reporter is not None:
+            reporter.stop()
 
     #note the time for summary
     time_stop_conv = time.time()
@@ -534,6 +598,45 @@ def main ():
     ##files, non-image, image, converted
     log.info("\tprep time:\t"+str(time_prep))
     log.info("\twork time:\t"+str(time_conv))
+    log.info("\tconverted:\t"+str(conv_summary["done"]))
+    log.info("\tskipped:\t"+str(conv_summary["skipped"]))
+    log.info("\tfrom cache:\t"+str(conv_summary["cached"]))
+    log.info("\tfailed:\t\t"+str(conv_summary["failed"]))
+    log.info("\tgm processes:\t"+str(conv_summary["spawns"]))
+    speedup = imgconv.decode_speedup(conv_summary)
+    if speedup:
+        log.info("\tdecode speedup:\t%.1fx (fewer pixels decoded)"%speedup)
+    vid_summary = conv_summary["video"]
+    log.info("\tvideos encoded:\t"+str(vid_summary["done"]))
+    log.info("\tvideos remuxed:\t"+str(vid_summary["remuxed"]))
+    log.info("\tvideos linked:\t"+str(vid_summary["linked"]))
+    log.info("\tvideos failed:\t"+str(vid_summary["failed"]))
+    encode_fps = vidconv.encode_fps(vid_summary)
+    if encode_fps:
+        log.info("\tencode speed:\t%.1f fps"%encode_fps)
+
+    report = options["report"]
+    if report is None:
+        report = metrics.report_path(
+            statedir.state_dir(basedir, options["state_dir"]))
+    try:
+        summary_info = run_metrics.write(report, options["prom_file"],
+            dir=os.path.abspath(basedir), times={"start": time_start,
+                "prep_start": time_start_prep, "conv_start": time_start_conv,
+                "stop": time_stop_conv})
+        metrics.report(log, summary_info)
+    except (IOError, OSError), e:
+        log.warn("cannot write the run report: %s"%e)
+
+    if profile is not None:
+        profile.report(log)
+        try:
+            paths = profile.dump(options["profile"] or os.path.join(
+                statedir.state_dir(basedir, options["state_dir"]),
+                profiling.PROFILE_NAME))
+            log.info("profile stats: %s"%" ".join(paths))
+        except (IOError, OSError), e:
+            log.warn("cannot write the profile: %s"%e)
 
     shutdown_logging()
 
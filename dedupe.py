@@ -0,0 +1,223 @@
+"""
+exact duplicate detection (the same card copied in twice, ...)
+
+files are compared in stages, each one only for the files the previous
+one could not tell apart:
+    size: a file with a size not seen before is unique, no reading
+    edges: sha256 of the first and last 64KiB
+    full: sha256 of the whole file
+
+hashes are kept per path so every file is read at most once per stage;
+a batch of POOL_MIN files or more is hashed on a pool of threads
+(hashlib releases the GIL while it works on a block), smaller ones right
+on the calling thread
+
+duplicate_finder.check works on a stream (each file against the ones
+seen before it, one or two files to hash at a time, so mostly without
+the pool), duplicate_finder.find on a whole list (every candidate of a
+stage in one batch)
+"""
+
+import hashlib
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+EDGE_SIZE = 64 << 10
+READ_SIZE = 1 << 20
+DEFAULT_THREADS = 4
+#fewest files to hash worth handing to the thread pool
+POOL_MIN = 4
+#what to do with a source that is a copy of an earlier one
+MODES = ("skip", "link", "off")
+
+
+def edge_hash(path):
+    """
+    sha256 of the first and last EDGE_SIZE bytes (all of a small file),
+    None if unreadable
+    """
+    sha = hashlib.sha256()
+    try:
+        with open(path, "rb") as fh:
+            sha.update(fh.read(EDGE_SIZE))
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() > EDGE_SIZE:
+                fh.seek(max(EDGE_SIZE, fh.tell() - EDGE_SIZE))
+                sha.update(fh.read(EDGE_SIZE))
+    except (IOError, OSError):
+        return None
+    return sha.hexdigest()
+
+
+def full_hash(path):
+    """
+    sha256 of the whole file, None if unreadable
+    """
+    sha = hashlib.sha256()
+    try:
+        with open(path, "rb") as fh:
+            while True:
+                block = fh.read(READ_SIZE)
+                if not block:
+                    break
+                sha.update(block)
+    except (IOError, OSError):
+        return None
+    return sha.hexdigest()
+
+
+def _cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class duplicate_finder(object):
+    """
+    staged duplicate check, see module doc
+    """
+    def __init__(self, n_threads=DEFAULT_THREADS):
+        self.n_threads = max(1, n_threads)
+        self.pool = None
+        #size -> paths kept (not duplicates), in the order seen
+        self.by_size = {}
+        self.edges = {}
+        self.fulls = {}
+        self.stats = {"files": 0, "duplicates": 0, "dup_bytes": 0,
+                      "edge_hashed": 0, "full_hashed": 0,
+                      "bytes_hashed": 0, "hash_cpu": 0.0}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _hash(self, func, known, paths, sizes):
+        """
+        fill known (path -> hash) for paths, on the thread pool if there
+        are POOL_MIN or more to hash
+        """
+        todo = [path for path in set(paths) if path not in known]
+        if not todo:
+            return
+        start = _cpu()
+        if len(todo) < POOL_MIN or 1 == self.n_threads:
+            digests = [func(path) for path in todo]
+        else:
+            if self.pool is None:
+                self.pool = ThreadPool(self.n_threads)
+            digests = self.pool.map(func, todo)
+        for path, digest in zip(todo, digests):
+            known[path] = digest
+        #process CPU time, the pool threads included
+        self.stats["hash_cpu"] += _cpu() - start
+        if func is edge_hash:
+            self.stats["edge_hashed"] += len(todo)
+            self.stats["bytes_hashed"] += sum(
+                min(sizes[path], 2 * EDGE_SIZE) for path in todo)
+        else:
+            self.stats["full_hashed"] += len(todo)
+            self.stats["bytes_hashed"] += sum(sizes[path] for path in todo)
+
+    def _same(self, path, others, sizes):
+        """
+        the paths of others with the same contents as path
+        """
+        self._hash(edge_hash, self.edges, others + [path], sizes)
+        edge = self.edges[path]
+        if edge is None:
+            return []
+        others = [p for p in others if self.edges[p] == edge]
+        if not others:
+            return []
+        self._hash(full_hash, self.fulls, others + [path], sizes)
+        full = self.fulls[path]
+        if full is None:
+            return []
+        return [p for p in others if self.fulls[p] == full]
+
+    def check(self, path, size):
+        """
+        earlier path with the same contents as this one, None if unique
+
+        for streams: only files of a size seen before are read
+        """
+        self.stats["files"] += 1
+        seen = self.by_size.setdefault(size, [])
+        original = None
+        if seen:
+            sizes = dict.fromkeys(seen + [path], size)
+            same = self._same(path, seen, sizes)
+            if same:
+                original = same[0]
+        if original is None:
+            seen.append(path)
+        else:
+            self.stats["duplicates"] += 1
+            self.stats["dup_bytes"] += size
+        return original
+
+    def find(self, files):
+        """
+        groups of paths with the same contents, first path of a group
+        (in path order) is its original
+
+        files: iterable of (path, size)
+        """
+        buckets = {}
+        for path, size in files:
+            self.stats["files"] += 1
+            buckets.setdefault(size, []).append(path)
+        sizes = {}
+        candidates = []
+        for size, paths in buckets.items():
+            if len(paths) > 1:
+                sizes.update(dict.fromkeys(paths, size))
+                candidates.extend(paths)
+        #all candidates at once, the pool stays busy
+        self._hash(edge_hash, self.edges, candidates, sizes)
+        by_edge = {}
+        for path in candidates:
+            if self.edges[path] is not None:
+                by_edge.setdefault((sizes[path], self.edges[path]),
+                                   []).append(path)
+        candidates = [path for paths in by_edge.values() if len(paths) > 1
+                      for path in paths]
+        self._hash(full_hash, self.fulls, candidates, sizes)
+        by_full = {}
+        for path in candidates:
+            if self.fulls[path] is not None:
+                by_full.setdefault(self.fulls[path], []).append(path)
+        groups = sorted(sorted(paths) for paths in by_full.values()
+                        if len(paths) > 1)
+        for group in groups:
+            self.stats["duplicates"] += len(group) - 1
+            self.stats["dup_bytes"] += sizes[group[0]] * (len(group) - 1)
+        return groups
+
+
+def report(log, finder, duplicates=(), cpu_saved=None):
+    """
+    log what duplicate detection found and saved
+
+    duplicates: (duplicate, original) pairs to list
+    cpu_saved: estimated conversion CPU seconds not spent on the
+        duplicates, hashing is taken off
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    stats = finder.stats
+    for duplicate, original in duplicates:
+        log.info("duplicate {} of {}".format(duplicate, original))
+    log.info("duplicates: {} of {} files, {} MB not converted again"
+             "".format(stats["duplicates"], stats["files"],
+                       stats["dup_bytes"] >> 20))
+    log.info("dedupe: {} edge and {} full hashes, {} MB read,"
+             " {:.1f}s CPU".format(stats["edge_hashed"],
+                                   stats["full_hashed"],
+                                   stats["bytes_hashed"] >> 20,
+                                   stats["hash_cpu"]))
+    if cpu_saved is not None and stats["duplicates"]:
+        log.info("dedupe: about {:.1f}s of conversion CPU saved".format(
+            cpu_saved - stats["hash_cpu"]))
@@ -0,0 +1,213 @@
+"""
+content addressed cache of image derivatives
+
+shared by every dated set, so a renamed, re-copied or re-ingested source
+is copied out of the cache instead of converted again; opt-in (--cache-dir)
+since every source is read through for its sha256 before it is converted
+
+entries go in and out as copies, reflinks (shared blocks, copy on
+write) where the filesystem can, never as hardlinks: a derivative
+edited or saved over in place must not change the cache entry
+
+layout under the cache root:
+    <key[:2]>/<key>/deriv<ext>
+
+the key is the sha256 of the source contents, the engine that made the
+derivative (gm or PIL, they do not give the same pixels) and the output
+affecting part of the job spec; the mtime of the entry directory is its
+last use, for LRU eviction down to a size limit
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+#job spec keys that change the derivative (not name, loc, ...)
+SPEC_KEYS = ("type", "resize", "resizedims", "crop", "cropdims")
+#bump when the conversion itself changes (quality, resize rules, ...)
+ENGINE_TAG = "img-q50-shrink"
+#what makes the derivatives (imgconv: gm commands, PIL single decode)
+ENGINES = ("gm", "pil")
+DEFAULT_DIR = os.path.join("~", ".cache", "photo_work", "derivatives")
+DEFAULT_SIZE_MB = 4096
+READ_SIZE = 1 << 20
+#ioctl sharing the blocks of one file with another (linux/fs.h), btrfs,
+#  xfs and others
+FICLONE = 0x40049409
+
+
+class derivative_cache(object):
+    """
+    on disk derivative cache, size bounded, least recently used out
+
+    only holds paths and limits, so it can be handed to worker processes
+    """
+    def __init__(self, root, max_bytes=DEFAULT_SIZE_MB << 20):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.max_bytes = max_bytes
+
+    def source_hash(self, infile):
+        sha = hashlib.sha256()
+        with open(infile, "rb") as fh:
+            while True:
+                block = fh.read(READ_SIZE)
+                if not block:
+                    break
+                sha.update(block)
+        return sha.hexdigest()
+
+    def key(self, source_hash, spec, engine="gm"):
+        """
+        cache key for a source (by content hash), job spec and engine
+        (ENGINES)
+        """
+        if engine not in ENGINES:
+            raise ValueError("unknown engine: {}".format(engine))
+        spec_part = dict((k, spec.get(k)) for k in SPEC_KEYS)
+        sha = hashlib.sha256()
+        sha.update(source_hash)
+        sha.update(ENGINE_TAG)
+        sha.update(engine)
+        sha.update(json.dumps(spec_part, sort_keys=True))
+        return sha.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def entry_path(self, key, outfile):
+        ext = os.path.splitext(outfile)[1].lower()
+        return os.path.join(self.entry_dir(key), "deriv" + ext)
+
+    def fetch(self, key, outfile, tmpfile, infile=None):
+        """
+        put a copy of the cached derivative for key at outfile (via
+        tmpfile)
+
+        infile: source to take the times (and mode) from, as a converted
+            derivative does
+        return False on a miss
+        """
+        cached = self.entry_path(key, outfile)
+        if not os.path.exists(cached):
+            return False
+        try:
+            copy_file(cached, tmpfile)
+            if infile is not None:
+                shutil.copystat(infile, tmpfile)
+            os.rename(tmpfile, outfile)
+        except (IOError, OSError):
+            _remove(tmpfile)
+            return False
+        try:
+            os.utime(self.entry_dir(key), None)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, outfile):
+        """
+        add a finished derivative to the cache, best effort
+        """
+        cached = self.entry_path(key, outfile)
+        if os.path.exists(cached):
+            return
+        part = os.path.join(os.path.dirname(cached),
+                            ".part-{}".format(os.getpid()))
+        try:
+            _makedirs(os.path.dirname(cached))
+            copy_file(outfile, part)
+            os.rename(part, cached)
+        except (IOError, OSError), e:
+            logging.getLogger("base").debug(
+                "not caching {}: {}".format(outfile, e))
+            _remove(part)
+
+    def entries(self):
+        """
+        (last use, size, entry dir) for every cache entry
+        """
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    used = os.stat(entry).st_mtime
+                    size = sum(os.stat(os.path.join(entry, name)).st_size
+                               for name in os.listdir(entry))
+                except OSError:
+                    continue
+                found.append((used, size, entry))
+        return found
+
+    def evict(self, log=None):
+        """
+        drop least recently used entries until under the size limit
+
+        return (entries removed, bytes freed)
+        """
+        if log is None:
+            log = logging.getLogger("base")
+        found = self.entries()
+        total = sum(size for used, size, entry in found)
+        removed = freed = 0
+        found.sort()
+        for used, size, entry in found:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            freed += size
+            removed += 1
+        if removed:
+            log.info("cache: evicted {} entries, {} MB".format(
+                removed, freed >> 20))
+        return removed, freed
+
+
+def open_cache(root, size_mb=DEFAULT_SIZE_MB):
+    """
+    derivative_cache for command line settings, None when disabled
+    (no or empty root, the default)
+    """
+    if not root:
+        return None
+    return derivative_cache(root, int(size_mb) << 20)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if errno.EEXIST != e.errno:
+            raise
+
+
+def copy_file(src, dst):
+    """
+    copy src to dst, a reflink where the filesystem can; never a
+    hardlink, so editing one of them leaves the other as it was
+    """
+    with open(src, "rb") as fin:
+        with open(dst, "wb") as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+                return
+            except (IOError, OSError):
+                pass  # not supported here, or another filesystem
+            shutil.copyfileobj(fin, fout, READ_SIZE)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,143 @@
+"""
+file type classification: img, raw, vid or misc
+
+fast path: lowercase suffix looked up in frozen sets built from the
+configured extension lists, no file access at all
+
+fallback: for files whose suffix says nothing (or, with sniff="all",
+for every file, to catch mislabeled ones) a bounded read of the header
+is matched against known signatures:
+    JPEG SOI, TIFF based raw (CR2, NEF, DNG, ...), RAF, ORF, RW2, CRW,
+    ISO-BMFF "ftyp" (mp4/mov, CR3), MPEG-TS / M2TS sync bytes, AVI,
+    MPEG-PS, Matroska/WebM
+sniffed results are memoized per (device, inode, mtime)
+"""
+
+import os
+
+CLASSES = ("img", "raw", "vid", "misc")
+#enough for the M2TS check (sync byte at 4 + 2 * 192)
+HEADER_SIZE = 512
+#job spec "type" -> file class
+SPEC_TYPES = {"im": "img", "img": "img", "raw": "raw", "vid": "vid"}
+#ISO-BMFF major brands that are not video
+BMFF_BRANDS = {"crx ": "raw", "heic": "misc", "heix": "misc",
+               "mif1": "misc", "avif": "misc"}
+
+
+def ext_set(exts):
+    """
+    frozen set of lowercase suffixes, leading dot optional in the input
+    """
+    return frozenset(e.lower().lstrip(".") for e in exts if e != "*")
+
+
+def sniff_header(head):
+    """
+    class from the first bytes of a file, None if nothing matched
+    """
+    if head.startswith("\xff\xd8\xff"):
+        return "img"
+    if head[:4] in ("II*\x00", "MM\x00*", "IIRO", "IIRS", "IIU\x00"):
+        return "raw"  # TIFF (CR2, NEF, DNG, ...), ORF, RW2
+    if head.startswith("FUJIFILMCCD-RAW"):
+        return "raw"
+    if head.startswith("II\x1a\x00\x00\x00HEAPCCDR"):
+        return "raw"  # CRW
+    if "ftyp" == head[4:8]:
+        return BMFF_BRANDS.get(head[8:12], "vid")
+    if _sync_every(head, 0, 188) or _sync_every(head, 4, 192):
+        return "vid"  # MPEG-TS, M2TS (.mts)
+    if head.startswith("RIFF") and "AVI " == head[8:12]:
+        return "vid"
+    if head[:4] in ("\x00\x00\x01\xba", "\x00\x00\x01\xb3"):
+        return "vid"  # MPEG program stream / elementary video
+    if head.startswith("\x1a\x45\xdf\xa3"):
+        return "vid"  # Matroska, WebM
+    return None
+
+
+def _sync_every(head, start, step):
+    """
+    MPEG transport stream sync byte at start and the next two packets
+    """
+    points = range(start, start + 3 * step, step)
+    return (len(head) > points[-1] and
+            all("\x47" == head[i] for i in points))
+
+
+class file_classifier(object):
+    """
+    classify paths by suffix, by header when the suffix does not tell
+
+    sniff: "unknown" reads headers only for unlisted suffixes,
+        "all" reads every header and trusts it over the suffix,
+        "none" never reads (unlisted suffixes are misc)
+    """
+    def __init__(self, img_ext, raw_ext, vid_ext, sniff="unknown"):
+        #checked in this order, a suffix listed twice goes to the first
+        self.ext_sets = (("img", ext_set(img_ext)),
+                         ("raw", ext_set(raw_ext)),
+                         ("vid", ext_set(vid_ext)))
+        self.sniff = sniff
+        self.memo = {}
+        self.stats = {"by_ext": 0, "sniffed": 0, "memo": 0}
+
+    def classify(self, path):
+        """
+        img, raw, vid or misc
+        """
+        ext = os.path.splitext(path)[1][1:].lower()
+        file_class = None
+        for ext_class, exts in self.ext_sets:
+            if ext in exts:
+                file_class = ext_class
+                break
+        if "none" == self.sniff or (file_class is not None and
+                                    "all" != self.sniff):
+            self.stats["by_ext"] += 1
+            return file_class or "misc"
+        sniffed = self.sniff_file(path)
+        return sniffed or file_class or "misc"
+
+    def sniff_file(self, path):
+        """
+        class from the header of path, memoized, None if unknown
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (st.st_dev, st.st_ino, st.st_mtime)
+        if key in self.memo:
+            self.stats["memo"] += 1
+            return self.memo[key]
+        try:
+            with open(path, "rb") as fh:
+                head = fh.read(HEADER_SIZE)
+        except (IOError, OSError):
+            return None
+        self.stats["sniffed"] += 1
+        self.memo[key] = sniff_header(head)
+        return self.memo[key]
+
+    def wanted_class(self, ft):
+        """
+        file class for a class name or a job spec (its "type")
+        """
+        if isinstance(ft, dict):
+            ft = ft.get("type")
+        if ft in CLASSES:
+            return ft
+        return SPEC_TYPES.get(ft)
+
+    def check(self, ft, path, file_class=None):
+        """
+        is path of type ft (class name or job spec)
+
+        file_class: class already known for path (scan index), skips
+            classifying it again
+        """
+        if file_class is None:
+            file_class = self.classify(path)
+        return file_class == self.wanted_class(ft)
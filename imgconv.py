@@ -0,0 +1,829 @@
+"""
+image derivative conversion engine
+
+shared by cropresize.py and ingest.py
+
+a conversion job is a dict:
+    infile  source image
+    outfile derivative to create
+    spec    output config / job spec dict (name, resizedims, crop, ...)
+
+jobs run in series (jobs=1) or on a bounded pool of worker processes
+
+jobs can be a list or a stream (pipeline.stage); a stream is read only
+as fast as the workers take it, a few units ahead of them
+
+with a batch size above 1, each worker sends a chunk of jobs through one
+"gm batch" session instead of starting gm once per command, which is
+most of the cost for small previews
+
+with single_decode, all specs for one source are made from one decode
+of it (PIL/Pillow), largest first, each smaller size resized from the
+previous one
+
+derivatives are written straight from the source to a hidden temporary
+name next to the outfile and renamed into place when complete, so an
+outfile that exists is always a finished one
+
+JPEG sources are decoded at the largest libjpeg reduced scale (1/2, 1/4,
+1/8) that still covers the output size: a -size hint for gm, draft() for
+PIL; the decoded vs full pixel counts are summed for the run summary
+
+with a derivative cache (derivcache.py), a job whose source content and
+spec were converted before is copied out of the cache (status: cached)
+and new derivatives are added to it
+
+with a journal (journal.py), jobs are noted as started when handed out
+and as done or failed when accounted for, flushed after every unit
+(fsynced on an interval, see journal.job_journal.sync)
+
+every unit handed to the pool is accounted for: an error in a worker
+fails the jobs of its unit, and so does a worker that dies (OOM killer,
+a crash in a library) while it works on one; the pool starts a new
+worker and the run goes on
+"""
+
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.queues
+import os
+import errno
+import Queue
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+import pipeline
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_BATCH = 50
+#libjpeg scale denominators, most reduced first
+JPEG_SCALES = (8, 4, 2, 1)
+#SOFn markers carrying the frame size (not DHT, JPG, DAC)
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - frozenset([0xC4, 0xC8, 0xCC])
+
+#log level of the per file lines (halfDEBUG, shown with -v)
+FILE_LOG = 15
+#units handed to the pool per worker, the rest of a stream waits
+IN_FLIGHT = 2
+#how often the parent looks up from waiting on workers (seconds)
+POLL = 0.2
+
+#derivative cache of this (worker) process, see run_jobs
+_cache = None
+#queue a worker notes (unit number, its pid) in when it takes a unit
+_started = None
+
+
+def default_jobs():
+    """
+    number of worker processes to use when not told otherwise
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def make_job(infile, outfile, spec):
+    return {"infile": infile, "outfile": outfile, "spec": spec}
+
+
+def jpeg_dimensions(path):
+    """
+    (width, height) from the JPEG frame header, None if not a JPEG
+
+    reads only the markers ahead of the frame header
+    """
+    try:
+        with open(path, "rb") as fh:
+            if "\xff\xd8" != fh.read(2):
+                return None
+            while True:
+                byte = fh.read(1)
+                while byte and "\xff" != byte:
+                    byte = fh.read(1)
+                while "\xff" == byte:  # fill bytes
+                    byte = fh.read(1)
+                if not byte:
+                    return None
+                marker = ord(byte)
+                if 0xD8 <= marker <= 0xD9 or 0xD0 <= marker <= 0xD7:
+                    continue  # no length field
+                seg = fh.read(2)
+                if len(seg) < 2:
+                    return None
+                length = (ord(seg[0]) << 8) + ord(seg[1])
+                if marker in SOF_MARKERS:
+                    frame = fh.read(5)
+                    if len(frame) < 5:
+                        return None
+                    height = (ord(frame[1]) << 8) + ord(frame[2])
+                    width = (ord(frame[3]) << 8) + ord(frame[4])
+                    return (width, height)
+                if 0xDA == marker:  # start of scan, no frame seen
+                    return None
+                fh.seek(length - 2, os.SEEK_CUR)
+    except (IOError, OSError):
+        return None
+
+
+def _ceil_div(num, denom):
+    return -(-num // denom)
+
+
+def decode_scale(size, need):
+    """
+    largest libjpeg scale denominator whose decode still covers need
+    """
+    for denom in JPEG_SCALES:
+        if (_ceil_div(size[0], denom) >= need[0] and
+                _ceil_div(size[1], denom) >= need[1]):
+            return denom
+    return 1
+
+
+def decode_size(size, specs):
+    """
+    reduced decode size for a source of size covering all specs
+    """
+    need = (0, 0)
+    for spec in specs:
+        want = _fit_size(size, parse_dims(spec["resizedims"]))
+        need = (max(need[0], want[0]), max(need[1], want[1]))
+    denom = decode_scale(size, need)
+    return (_ceil_div(size[0], denom), _ceil_div(size[1], denom))
+
+
+def _count_decode(result, size, decoded):
+    result["px_full"] = size[0] * size[1]
+    result["px_decoded"] = decoded[0] * decoded[1]
+
+
+def tmp_path(outfile):
+    """
+    hidden name the derivative is written to before the final rename
+
+    keeps the extension, gm picks the output format from it
+    """
+    out_dir, name = os.path.split(outfile)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(out_dir, ".{}.part{}".format(stem, ext))
+
+
+def convert_cmd(job, result=None):
+    """
+    gm command line to write the derivative from the source
+
+    with a result dict, JPEG sources get a reduced decode size hint and
+    the decode pixel counts are noted in the result
+    """
+    spec = job["spec"]
+    cmd = ["gm", "convert"]
+    size = None
+    if result is not None:
+        size = jpeg_dimensions(job["infile"])
+    if size:
+        decoded = decode_size(size, [spec])
+        _count_decode(result, size, decoded)
+        if decoded != size:
+            cmd.extend(["-size", "{}x{}".format(*decoded)])
+    #">": only ever shrink, as PIL's thumbnail() in convert_multi
+    cmd.extend([job["infile"], "-quality", "50",
+                "-resize", spec["resizedims"] + ">"])
+    if spec.get("crop"):
+        cmd.extend(["-gravity", "center", "-extent", spec["cropdims"]])
+    cmd.append(tmp_path(job["outfile"]))
+    return cmd
+
+
+def _new_result(job):
+    return {"infile": job["infile"], "outfile": job["outfile"],
+            "spec": job["spec"]["name"], "status": "done", "error": None,
+            "spawns": 0, "px_full": 0, "px_decoded": 0, "cache_key": None,
+            "seconds": None, "bytes_in": 0, "bytes_out": 0}
+
+
+def _prepare(job, result, hashes=None, engine="gm"):
+    """
+    skip and cache checks, common to all engines
+
+    hashes: source content hashes already computed by the caller
+    engine: what will make the derivative (derivcache.ENGINES), part of
+        its cache key
+
+    return True if the job still has work to do
+    """
+    if os.path.exists(job["outfile"]):
+        #another job (or another run) got here first
+        result["status"] = "skipped"
+        return False
+    if _cache is None:
+        return True
+    if hashes is None:
+        hashes = {}
+    try:
+        if job["infile"] not in hashes:
+            hashes[job["infile"]] = _cache.source_hash(job["infile"])
+    except (IOError, OSError):
+        return True  # let the conversion report the problem
+    result["cache_key"] = _cache.key(hashes[job["infile"]], job["spec"],
+                                     engine)
+    if _cache.fetch(result["cache_key"], job["outfile"],
+                    tmp_path(job["outfile"]), job["infile"]):
+        result["status"] = "cached"
+        return False
+    return True
+
+
+def _finish(job, result):
+    """
+    move a complete temporary file into place
+    """
+    tmp = tmp_path(job["outfile"])
+    try:
+        #keep the source times (and mode) on the derivative, as copy2 did
+        shutil.copystat(job["infile"], tmp)
+        os.rename(tmp, job["outfile"])
+        result["bytes_in"] = os.path.getsize(job["infile"])
+        result["bytes_out"] = os.path.getsize(job["outfile"])
+    except (IOError, OSError), e:
+        _fail(result, e)
+        return
+    if _cache is not None and result["cache_key"]:
+        _cache.store(result["cache_key"], job["outfile"])
+
+
+def _fail(result, error):
+    result["status"] = "failed"
+    result["error"] = str(error)
+    _remove_partial(tmp_path(result["outfile"]))
+
+
+def convert_one(job):
+    """
+    convert a single job, worker side
+
+    never raises for per-file problems, the outcome is reported in the
+    returned result dict (status: done, skipped or failed)
+    """
+    result = _new_result(job)
+    if not _prepare(job, result):
+        return result
+    cmd = convert_cmd(job, result)
+    try:
+        result["spawns"] += 1
+        ret = subprocess.call(cmd)
+        if ret:
+            raise OSError("{} exited with {}".format(" ".join(cmd[:2]), ret))
+    except (IOError, OSError), e:
+        _fail(result, e)
+        return result
+    _finish(job, result)
+    return result
+
+
+def batch_quote(arg):
+    """
+    quote one argument for a gm batch command line (-escape unix)
+    """
+    return '"{}"'.format(arg.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def convert_batch(jobs):
+    """
+    convert a chunk of jobs through a single gm batch session, worker side
+
+    gm reports PASS or FAIL for every command line (-feedback on), which
+    is mapped back to the job that queued it
+    """
+    results = []
+    script = []
+    owners = []
+    hashes = {}
+    for job in jobs:
+        result = _new_result(job)
+        results.append(result)
+        if not _prepare(job, result, hashes):
+            continue
+        #drop the leading "gm", batch lines are gm subcommands
+        cmd = convert_cmd(job, result)
+        script.append(" ".join(batch_quote(a) for a in cmd[1:]))
+        owners.append((job, result))
+    if not script:
+        return results
+    cmd = ["gm", "batch", "-escape", "unix", "-feedback", "on",
+           "-stop-on-error", "off", "-pass", "PASS", "-fail", "FAIL", "-"]
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        out = proc.communicate("\n".join(script) + "\n")[0]
+    except (IOError, OSError), e:
+        for job, result in owners:
+            _fail(result, e)
+        return results
+    owners[0][1]["spawns"] = 1  # one session for the whole chunk
+    feedback = [line.strip() for line in out.splitlines()
+                if line.strip() in ("PASS", "FAIL")]
+    for i, (job, result) in enumerate(owners):
+        if i >= len(feedback):
+            _fail(result, "gm batch exited early ({})"
+                          "".format(proc.returncode))
+        elif "FAIL" == feedback[i]:
+            _fail(result, "gm batch command failed")
+        else:
+            _finish(job, result)
+    return results
+
+
+def parse_dims(dims):
+    """
+    "800x600" -> (800, 600)
+    """
+    w, h = dims.lower().split("x")
+    return int(w), int(h)
+
+
+def _fit_size(size, box):
+    """
+    size of an image fitted into box, never enlarged
+    """
+    scale = min(float(box[0]) / size[0], float(box[1]) / size[1], 1.0)
+    return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+
+
+def _extent(img, size):
+    """
+    center img on a canvas of size (crop and/or pad, like gm -extent)
+    """
+    canvas = Image.new(img.mode, size, "white")
+    canvas.paste(img, ((size[0] - img.size[0]) // 2,
+                       (size[1] - img.size[1]) // 2))
+    return canvas
+
+
+def _spec_area(job):
+    w, h = parse_dims(job["spec"]["resizedims"])
+    return w * h
+
+
+def convert_multi(jobs):
+    """
+    convert all jobs for one source from a single decode, worker side
+
+    specs run largest first; a size is made from the previous (smaller,
+    uncropped) result when that still holds enough pixels, otherwise
+    from the full decode
+    """
+    results = [_new_result(job) for job in jobs]
+    hashes = {}
+    todo = [(job, result) for job, result in zip(jobs, results)
+            if _prepare(job, result, hashes, "pil")]
+    if not todo:
+        return results
+    todo.sort(key=lambda jr: _spec_area(jr[0]), reverse=True)
+    try:
+        full = Image.open(todo[0][0]["infile"])
+        size = full.size
+        if "JPEG" == full.format:
+            decoded = decode_size(size, [job["spec"] for job, r in todo])
+            full.draft(full.mode, decoded)
+            #one decode serves all specs of this source
+            _count_decode(todo[0][1], size, full.size)
+        full.load()
+    except (IOError, OSError), e:
+        for job, result in todo:
+            _fail(result, e)
+        return results
+    save_opts = {"quality": 50}
+    if full.info.get("exif"):
+        save_opts["exif"] = full.info["exif"]
+    if full.mode not in ("RGB", "L", "CMYK"):
+        full = full.convert("RGB")
+    base = full
+    for job, result in todo:
+        spec = job["spec"]
+        box = parse_dims(spec["resizedims"])
+        want = _fit_size(full.size, box)
+        src = base
+        if base.size[0] < want[0] or base.size[1] < want[1]:
+            src = full
+        try:
+            out = src.copy()
+            out.thumbnail(box, Image.ANTIALIAS)
+            if spec.get("crop"):
+                out = _extent(out, parse_dims(spec["cropdims"]))
+            else:
+                base = out
+            out.save(tmp_path(job["outfile"]), "JPEG", **save_opts)
+        except (IOError, OSError, ValueError), e:
+            _fail(result, e)
+            continue
+        _finish(job, result)
+    return results
+
+
+def group_by_source(jobs):
+    """
+    list of job lists, one per source file, in first seen order
+    """
+    groups = {}
+    order = []
+    for job in jobs:
+        if job["infile"] not in groups:
+            groups[job["infile"]] = []
+            order.append(job["infile"])
+        groups[job["infile"]].append(job)
+    return [groups[infile] for infile in order]
+
+
+def _remove_partial(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _init_worker(cache=None, started=None):
+    global _cache, _started
+    _cache = cache
+    _started = started
+    #Ctrl-C is handled by the parent, which tears down the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def chunk_jobs(jobs, batch_size, n_jobs):
+    """
+    split jobs into chunks of at most batch_size, small enough that
+    every worker gets at least one
+    """
+    size = (len(jobs) + n_jobs - 1) // n_jobs
+    size = max(1, min(batch_size, size))
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+def stream_units(jobs, batch_size, single_decode, n_jobs=1):
+    """
+    work units from a job stream, made as the jobs come in
+
+    single_decode: one unit per source (the jobs of a source must come
+        together, as a plan makes them)
+    batch_size: up to this many jobs per unit, whatever is ready when
+        a worker needs one (pipeline.stage), no waiting to fill it
+    n_jobs: workers to spread the jobs over; each round of n_jobs units
+        shares out what the stage has ready, as chunk_jobs does a list,
+        so a planner running ahead does not fill one unit for one
+        worker while the others wait
+    """
+    if single_decode:
+        for infile, group in itertools.groupby(jobs,
+                                               lambda job: job["infile"]):
+            yield list(group)
+        return
+    if batch_size <= 1:
+        for job in jobs:
+            yield job
+        return
+    own = not hasattr(jobs, "take")
+    if own:
+        #read ahead on a thread, so what is ready can be told
+        jobs = pipeline.stage(jobs, name="units")
+    try:
+        size = left = 0
+        while True:
+            if not left:
+                size = max(1, min(batch_size,
+                                  _ceil_div(jobs.ready(), n_jobs)))
+                left = n_jobs
+            try:
+                chunk = jobs.take(size)
+            except StopIteration:
+                return
+            left -= 1
+            yield chunk
+    finally:
+        if own:
+            jobs.close()
+
+
+def _unit_jobs(unit):
+    return [unit] if isinstance(unit, dict) else unit
+
+
+def _usage():
+    """
+    (wall, user, sys) clocks of this process and its reaped children
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (time.time(), own.ru_utime + children.ru_utime,
+            own.ru_stime + children.ru_stime)
+
+
+def _failed_unit(unit, error):
+    """
+    results failing every job of a unit
+    """
+    results = []
+    for job in _unit_jobs(unit):
+        result = _new_result(job)
+        _fail(result, error)
+        results.append(result)
+    return results
+
+
+def run_unit(work, unit, number=None):
+    """
+    run one work unit, worker side, as (list of results, usage)
+
+    an unexpected error fails the jobs of the unit instead of the run;
+    the time the unit took is shared out between the jobs it converted
+    (seconds), a batch or single decode can not tell them apart
+
+    usage: the unit as one tool run, a dict of tool (gm, or pil for a
+    single decode), runs (gm processes, or decodes), wall, user, sys;
+    in a worker process that is the gm it waited for or its own
+    decoding, run in this process (one job at a time) the CPU of other
+    threads is counted along
+    """
+    if _started is not None and number is not None:
+        _started.put((number, os.getpid()))
+    start = _usage()
+    try:
+        unit_result = work(unit)
+    except Exception, e:
+        unit_result = _failed_unit(unit, e)
+    if isinstance(unit_result, dict):
+        unit_result = [unit_result]
+    wall, user, system = [b - a for a, b in zip(start, _usage())]
+    done = [result for result in unit_result if "done" == result["status"]]
+    for result in done:
+        result["seconds"] = wall / len(done)
+    if work is convert_multi:
+        usage = {"tool": "pil", "runs": int(bool(done))}
+    else:
+        usage = {"tool": "gm",
+                 "runs": sum(result["spawns"] for result in unit_result)}
+    usage.update(wall=wall, user=user, sys=system)
+    return unit_result, usage
+
+
+def run_jobs(log, jobs, n_jobs=None, batch_size=DEFAULT_BATCH,
+             single_decode=False, cache=None, journal=None, metrics=None):
+    """
+    run conversion jobs, return a summary dict of counts
+
+    jobs: list of jobs, or any iterable (a pipeline.stage) to convert
+        them as they come in, without waiting for the whole list
+    n_jobs: number of worker processes, None for one per core,
+        1 runs in this process
+    batch_size: jobs per gm batch session, 1 for one gm process per
+        command
+    single_decode: decode each source once for all of its specs
+        (needs PIL/Pillow, falls back to gm without it)
+    cache: derivcache.derivative_cache to reuse and keep derivatives,
+        None for no cache
+    journal: journal.job_journal to record the jobs in, None for none
+    metrics: metrics.run_metrics to account the jobs to, None for none
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    if n_jobs is None:
+        n_jobs = default_jobs()
+    summary = {"done": 0, "skipped": 0, "cached": 0, "failed": 0,
+               "spawns": 0, "px_full": 0, "px_decoded": 0}
+    if single_decode and Image is None:
+        log.warn("single decode needs PIL/Pillow, using gm instead")
+        single_decode = False
+    if single_decode:
+        work = convert_multi
+    elif batch_size > 1:
+        work = convert_batch
+    else:
+        work = convert_one
+    if isinstance(jobs, (list, tuple)):
+        #known up front, split evenly over the workers
+        if single_decode:
+            units = group_by_source(jobs)
+        elif batch_size > 1:
+            units = chunk_jobs(jobs, batch_size, max(1, n_jobs))
+        else:
+            units = jobs
+        n_jobs = max(1, min(n_jobs, len(units)))
+    else:
+        n_jobs = max(1, n_jobs)
+        units = stream_units(jobs, batch_size, single_decode, n_jobs)
+    _run_units(log, work, units, n_jobs, cache, summary, journal, metrics)
+    if cache is not None:
+        cache.evict(log)
+    return summary
+
+
+def _run_units(log, work, units, n_jobs, cache, summary, journal=None,
+               metrics=None):
+    """
+    feed units to the workers, at most IN_FLIGHT per worker at a time,
+    so a stream is only read as fast as it is converted
+
+    a unit whose result is an error, or whose worker is gone, is
+    accounted as failed
+    """
+    global _cache
+    #outfiles of submitted jobs not yet accounted for
+    pending = set()
+    if 1 == n_jobs:
+        _cache = cache
+        try:
+            for unit in units:
+                _hand_out(pending, unit, journal)
+                _account_unit(log, summary, pending, run_unit(work, unit),
+                              journal, metrics)
+                if journal is not None:
+                    journal.sync()
+        except BaseException:
+            _stopped(log, None, pending)
+            raise
+        finally:
+            _cache = None
+        return
+    pool = None
+    #unit number -> (unit, AsyncResult)
+    in_flight = {}
+    #unit number -> pid of the worker that took it
+    workers = {}
+    #written straight to the pipe (no feeder thread), so the note is
+    #  out even if the worker dies right after
+    started = multiprocessing.queues.SimpleQueue()
+    wake = Queue.Queue()
+    units = iter(units)
+    number = 0
+    lost = False
+    more = True
+    try:
+        while more or in_flight:
+            while more and len(in_flight) < IN_FLIGHT * n_jobs:
+                try:
+                    unit = next(units)
+                except StopIteration:
+                    more = False
+                    break
+                if pool is None:
+                    log.info("converting with {} workers".format(n_jobs))
+                    pool = multiprocessing.Pool(n_jobs, _init_worker,
+                                                (cache, started))
+                _hand_out(pending, unit, journal)
+                number += 1
+                in_flight[number] = (unit, pool.apply_async(
+                    run_unit, (work, unit, number),
+                    callback=wake.put))
+            if not in_flight:
+                continue
+            try:
+                #a timeout keeps the wait interruptible by Ctrl-C, and
+                #  has errors and lost workers looked for
+                wake.get(timeout=POLL)
+            except Queue.Empty:
+                pass
+            _note_started(started, workers)
+            for unit_number in sorted(in_flight):
+                unit_done = _collect(in_flight[unit_number],
+                                     workers.get(unit_number))
+                if unit_done is None:
+                    continue
+                del in_flight[unit_number]
+                workers.pop(unit_number, None)
+                lost = lost or unit_done[1].get("lost", False)
+                _account_unit(log, summary, pending, unit_done, journal,
+                              metrics)
+            if journal is not None:
+                journal.sync()
+    except BaseException:
+        _stopped(log, pool, pending)
+        raise
+    if pool is None:
+        return
+    if lost:
+        #the pool keeps waiting for the results of lost units, even
+        #  though every unit is accounted for here
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+
+def _note_started(started, workers):
+    while not started.empty():
+        unit_number, pid = started.get()
+        workers[unit_number] = pid
+
+
+def _alive(pid):
+    """
+    is a worker process still there; the pool reaps a worker that
+    died, after which its pid is gone
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return errno.ESRCH != e.errno
+    return True
+
+
+def _collect(entry, pid):
+    """
+    (results, usage) of a unit handed to the pool, None while it runs
+
+    an error raised on the way (a result that can not be sent back, ...)
+    or a worker that died with the unit fails its jobs, usage of a unit
+    whose worker died has "lost" set
+    """
+    unit, async_result = entry
+    usage = {"tool": "gm", "runs": 0, "wall": 0.0, "user": 0.0, "sys": 0.0}
+    if async_result.ready():
+        try:
+            return async_result.get()
+        except Exception, e:
+            return _failed_unit(unit, e), usage
+    if pid is None or _alive(pid):
+        return None
+    #lost: the pool still waits for its result
+    usage["lost"] = True
+    return _failed_unit(unit, "worker {} died".format(pid)), usage
+
+
+def _stopped(log, pool, pending):
+    """
+    tear down after Ctrl-C (or a failing job stream)
+    """
+    if sys.exc_info()[0] is KeyboardInterrupt:
+        log.warn("interrupted, stopping workers")
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    #unfinished jobs never reach their outfile, only clean up the
+    #  temporary files of the ones that were handed out
+    for outfile in pending:
+        _remove_partial(tmp_path(outfile))
+
+
+def _hand_out(pending, unit, journal):
+    outfiles = [job["outfile"] for job in _unit_jobs(unit)]
+    pending.update(outfiles)
+    if journal is not None:
+        journal.started(outfiles)
+
+
+def _account_unit(log, summary, pending, unit_done, journal=None,
+                  metrics=None):
+    """
+    account for the results of a unit and its tool run
+    """
+    unit_result, usage = unit_done
+    for result in unit_result:
+        _account(log, summary, pending, result, journal, metrics)
+    if metrics is not None and usage["runs"]:
+        label = unit_result[0]["infile"]
+        if len(unit_result) > 1:
+            label += " (+{} jobs)".format(len(unit_result) - 1)
+        metrics.tool(usage["tool"], usage["wall"], usage["user"],
+                     usage["sys"], label)
+
+
+def _account(log, summary, pending, result, journal=None, metrics=None):
+    pending.discard(result["outfile"])
+    if journal is not None:
+        journal.finished(result["outfile"], "failed" != result["status"])
+    if metrics is not None:
+        metrics.job("img", result["spec"], result["status"],
+                    result["seconds"], result["bytes_in"],
+                    result["bytes_out"], result["infile"])
+    summary[result["status"]] += 1
+    summary["spawns"] += result["spawns"]
+    summary["px_full"] += result["px_full"]
+    summary["px_decoded"] += result["px_decoded"]
+    if "failed" == result["status"]:
+        log.error("failed {}: {}".format(result["outfile"], result["error"]))
+    elif "skipped" == result["status"]:
+        log.log(FILE_LOG, "skipping existant file: %s" % result["outfile"])
+    elif "cached" == result["status"]:
+        log.log(FILE_LOG, "from cache %s" % result["outfile"])
+    else:
+        log.log(FILE_LOG, "proccessed %s" % result["outfile"])
+
+
+def decode_speedup(summary):
+    """
+    full vs reduced decode pixel ratio for a run summary, None if no
+    JPEG was decoded
+    """
+    if not summary["px_decoded"]:
+        return None
+    return float(summary["px_full"]) / summary["px_decoded"]
@@ -24,17 +24,36 @@ VERSION
 #* http://pypi.python.org/pypi/skeleton/0.4
 
 import argparse
+import copy
+import cProfile
 import glob
 import hashlib
 import logging
 import os
 import re
+import resource
 import shutil
 import subprocess
 import sys
 #import time
 import traceback
 
+import costmodel
+import dedupe
+import derivcache
+import filetypes
+import imgconv
+import journal
+import metadata
+import metrics
+import phash
+import pipeline
+import profiling
+import progress
+import scanindex
+import statedir
+import vidconv
+
 
 class config_state(object):
     """
@@ -77,6 +96,7 @@ class config_state(object):
         self.set_directories_default()
         self.set_extensions_default()
         self.set_job_spec_default()
+        self.set_run_default()
 
     def set_util_default(self, **kwargs):
         self.img_mod = "gm mogrify"
@@ -98,6 +118,9 @@ class config_state(object):
         self.dir_conf["im_sources"] = None
         self.dir_conf["im_out"] = "img"
         self.dir_conf["vid_out"] = "vid"
+        #scan index, journal, report and profile of the set (statedir),
+        #  set with base
+        self.dir_conf["state"] = None
 
     def set_extensions_default(self, **kwargs):
         """
@@ -136,7 +159,7 @@ class config_state(object):
             '.r3d',
             '.raf',
             '.raw', '.rw2',
-            '.raw', '.rwl', '.dng'
+            '.raw', '.rwl', '.dng',
             '.rwz',
             '.x3f',
             '.tiff',
@@ -160,8 +183,16 @@ class config_state(object):
         #outputConfig.append({'name':'1080','loc':'1080',"type":"im",
         #   'resize':True,'crop':True,'resizedims':'2000x2000',
         #   'cropdims':'1920x1080'})
-        #outputConfig.append({'name':'vid_thumbs','loc':'th_vid',"type":"vid",
-        #   'resize':True,'crop':False,'resizedims':'640x360'})
+        #poster + scrub strip per clip, from keyframes (vidconv)
+        self.output_config["vid_thumbs"] = {
+            'name': 'vid_thumbs', 'loc': 'th_vid', "type": "vid",
+            'resize': True, 'crop': False, 'resizedims': '640x360',
+            'sprite': 8, 'spritedims': '160x90'}
+        #small webm preview per clip, the fast encode profile (vidconv)
+        self.output_config["vid_sm"] = {
+            'name': 'vid-sm', 'loc': 'vid-sm', "type": "vid",
+            'resize': True, 'crop': False, 'resizedims': '640x360',
+            'profile': 'draft'}
         #outputConfig.append({'name':'img','loc':None,'image':False,
         #    'ext':imgExt})
         #outputConfig.append({'name':'raw','loc':'raw','image':False,
@@ -171,6 +202,49 @@ class config_state(object):
         #outputConfig.append({'name':'misc','loc':'misc','image':False,
         #    'ext':allExt})
 
+    def set_run_default(self, **kwargs):
+        """
+        how to run the work
+        """
+        self.run_conf = dict()
+        self.run_conf["jobs"] = imgconv.default_jobs()
+        self.run_conf["batch"] = imgconv.DEFAULT_BATCH
+        self.run_conf["single_decode"] = False
+        #opened from the command line (--cache-dir), off by default
+        self.run_conf["cache"] = None
+        self.run_conf["full_scan"] = False
+        self.run_conf["vid_jobs"] = None
+        self.run_conf["threads"] = vidconv.default_threads()
+        self.run_conf["segment_min"] = vidconv.SEGMENT_MIN
+        self.run_conf["dupes"] = "skip"
+        self.run_conf["near_dupes"] = phash.DEFAULT_DISTANCE
+        self.run_conf["meta_jobs"] = metadata.DEFAULT_WORKERS
+        #learn the job costs of the machine from real runs (costmodel)
+        self.run_conf["calibrate"] = True
+        self.run_conf["resume"] = False
+        self.run_conf["dry_run"] = False
+        self.run_conf["report"] = None
+        self.run_conf["prom_file"] = None
+        self.run_conf["profile"] = None
+        #root of the per set state dirs, None for statedir.DEFAULT_ROOT
+        self.run_conf["state_dir"] = None
+
+    def update_run(self, **kwargs):
+        """
+        update run settings, no additions
+        """
+        keys = self.run_conf.keys()
+        for k in kwargs:
+            if not k in keys:
+                raise ValueError("bad keyname for run: {}".format(k))
+        self.run_conf.update(kwargs)
+
+    def get_run(self, key):
+        """
+        get one run setting
+        """
+        return self.run_conf[key]
+
     def update_dirs(self, **kwargs):
         """
         update dir settings, no additions
@@ -238,6 +312,41 @@ class config_state(object):
         return self.output_config[spec_name.lower()]
 
 
+def expand_sets(patterns):
+    """
+    the set dirs of -i: each pattern as given, or, if it is a glob, the
+    dirs it matches in order; no dir twice
+    """
+    bases = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            found = [path for path in sorted(glob.glob(pattern))
+                     if os.path.isdir(path)]
+        else:
+            found = [pattern]
+        for base in found:
+            if base not in bases:
+                bases.append(base)
+    return bases
+
+
+def common_dir(dirs):
+    """
+    the deepest dir all of dirs lie in
+    """
+    prefix = os.path.commonprefix([os.path.join(os.path.abspath(path), "")
+                                   for path in dirs])
+    return os.path.dirname(prefix)
+
+
+def _child_cpu():
+    """
+    CPU seconds (user + sys) of the finished child processes
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
 class foo(object):
     def __init__(self, **kwargs):
         pass
@@ -279,12 +388,14 @@ class foo(object):
         trace_log.info("exit")
         return
 
-    def cmd_param(self):
+    def cmd_param(self, argv=None):
         """
         parse command line parameters
         -i    image directory(s)
         -prep create/move/rearrange directory(s)
         ...and more
+
+        argv: arguments to parse instead of sys.argv[1:] (bench.stages)
         """
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
@@ -296,8 +407,9 @@ class foo(object):
             action='version', version='%(prog)s 2.0')
 
         parser.add_argument(
-            '-i', '--imagedir', action='store', default='.',
-            help="base directory [for dated set] containing images",
+            '-i', '--imagedir', action='store', nargs='+', default=['.'],
+            help="base directory [for dated set] containing images;"
+            " several, or a glob ('2013/*'), to run the sets together",
             #", examples: <dir>/jpg/<images>; "
             #"<dir>/<raw-media>/*-card/**/<images>",
             dest='imagedir')
@@ -307,13 +419,108 @@ class foo(object):
         parser.add_argument(
             '-c', '--convert', action='store_true',
             help='convert input media and create small previews')
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int,
+            default=imgconv.default_jobs(),
+            help='number of parallel conversion processes'
+            ' (default: number of cores)')
+        parser.add_argument(
+            '-b', '--batch', action='store', type=int,
+            default=imgconv.DEFAULT_BATCH,
+            help='images per gm batch session, 1 to run gm once per'
+            ' command (default: %(default)s)')
+        parser.add_argument(
+            '--single-decode', action='store_true',
+            help='decode each image once for all output sizes'
+            ' (needs PIL/Pillow)')
+        parser.add_argument(
+            '--cache-dir', action='store', nargs='?',
+            const=derivcache.DEFAULT_DIR, default=None, metavar='DIR',
+            help='keep derivatives in a cache shared by all sets and'
+            ' reuse them for sources converted before; costs a sha256 of'
+            ' every source, so off unless given (default dir: {})'
+            ''.format(derivcache.DEFAULT_DIR))
+        parser.add_argument(
+            '--cache-size', action='store', type=int,
+            default=derivcache.DEFAULT_SIZE_MB,
+            help='derivative cache size limit in MB'
+            ' (default: %(default)s)')
+        parser.add_argument(
+            '--vid-jobs', action='store', type=int, default=None,
+            help='number of video jobs at once'
+            ' (default: thread budget / {})'.format(vidconv.MIN_THREADS))
+        parser.add_argument(
+            '--threads', action='store', type=int,
+            default=vidconv.default_threads(),
+            help='CPU threads shared by the video jobs'
+            ' (default: %(default)s)')
+        parser.add_argument(
+            '--segment-min', action='store', type=int,
+            default=vidconv.SEGMENT_MIN,
+            help='encode clips this long (seconds) in parallel segments,'
+            ' 0 to never split (default: %(default)s)')
+        parser.add_argument(
+            '--dupes', action='store', choices=dedupe.MODES,
+            default='skip',
+            help='exact copies of a source (same card copied twice):'
+            ' skip them, give them copies of the original\'s outputs'
+            ' (link) or convert them anyway (off) (default: %(default)s)')
+        parser.add_argument(
+            '--near-dupes', action='store', type=int,
+            default=phash.DEFAULT_DISTANCE, metavar='BITS',
+            help='list clusters of near identical images (bursts,'
+            ' re-exports) whose perceptual hashes differ in at most BITS'
+            ' bits, 0 for none (default: %(default)s)')
+        parser.add_argument(
+            '--meta-jobs', action='store', type=int,
+            default=metadata.DEFAULT_WORKERS,
+            help='exiftool processes reading capture time, orientation,'
+            ' size and camera model of the sources into the scan index'
+            ' (for later runs and tools, conversion does not use it),'
+            ' 0 for none (default: %(default)s)')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='carry on after an interrupted run: jobs its journal'
+            ' has as done are skipped without checking their files,'
+            ' jobs it left unfinished are made again; without it the'
+            ' previous journal is kept as <journal>.1')
+        parser.add_argument(
+            '--full-scan', action='store_true',
+            help='list every directory, not only the ones changed since'
+            ' the last run')
+        parser.add_argument(
+            '--report', action='store', default=None, metavar='FILE',
+            help='JSON run report (counts, bytes, latencies, stage and'
+            ' tool CPU times), empty for none (default: {} in the state'
+            ' dir)'.format(metrics.REPORT_NAME))
+        parser.add_argument(
+            '--prom-file', action='store', default=None, metavar='FILE',
+            help='also write the run metrics here in the Prometheus text'
+            ' format, for the node_exporter textfile collector (*.prom)')
+        parser.add_argument(
+            '--profile', action='store', nargs='?', const='',
+            default=None, metavar='PREFIX',
+            help='profile the stages (cProfile) and time every gm and'
+            ' ffmpeg run; logs the slowest functions, tool runs, files'
+            ' and specs and writes PREFIX.<stage>.pstats (default'
+            ' prefix: {} in the state dir)'.format(profiling.PROFILE_NAME))
+        parser.add_argument(
+            '--state-dir', action='store', default=None, metavar='DIR',
+            help='keep the scan index, job journal, run report and'
+            ' profile of each set in a dir of its own below DIR, not in'
+            ' the set dir (default: {})'.format(statedir.DEFAULT_ROOT))
+        parser.add_argument(
+            '--no-calibrate', action='store_false', dest='calibrate',
+            help='do not tune the cost estimates of dry runs from this'
+            ' run, leaves {} as it is'.format(costmodel.DEFAULT_PATH))
         parser.add_argument(
             '-s', '--settings-file', action='store_true',
             help='file from which to load settings')
 
         parser.add_argument(
             '-n', '--dry-run', action='store_true',
-            help="don't change any files")
+            help="don't change any files, plan the run and estimate its"
+            " cost instead")
         parser.add_argument(
             '-d', '--debug', action='count', default=0,
             help='more verbose debugging output')
@@ -322,8 +529,11 @@ class foo(object):
             help='destination for log messages')
         parser.add_argument(
             '-v', '--verbose', action='count', default=0,
-            help='more verbose output')
-        args = parser.parse_args()
+            help='more verbose output, -v also logs every file')
+        parser.add_argument(
+            '-q', '--quiet', action='count', default=0,
+            help='less output, -q also drops the progress line')
+        args = parser.parse_args(argv)
 
         trace_log.info("exit")
         return args
@@ -337,85 +547,453 @@ class foo(object):
 
         self.conf = config_state()
         self.conf.update_dirs()
-        self.conf.update_dirs(base=args.imagedir)
-        base = self.conf.get_dir("base")
-        pats = self.conf.get_dir("source_patterns")
+        bases = expand_sets(args.imagedir)
+        if not bases:
+            logging.getLogger("base").error(
+                "no set dirs match {}".format(" ".join(args.imagedir)))
+            sys.exit(-1)
+        self.classifier = filetypes.file_classifier(
+            self.conf.imgExt, self.conf.rawExt, self.conf.vidExt)
+        self.conf.update_run(jobs=args.jobs, batch=args.batch,
+                             single_decode=args.single_decode,
+                             cache=derivcache.open_cache(args.cache_dir,
+                                                         args.cache_size),
+                             full_scan=args.full_scan,
+                             vid_jobs=args.vid_jobs, threads=args.threads,
+                             segment_min=args.segment_min,
+                             dupes=args.dupes, near_dupes=args.near_dupes,
+                             meta_jobs=args.meta_jobs,
+                             calibrate=args.calibrate, resume=args.resume,
+                             dry_run=args.dry_run, report=args.report,
+                             prom_file=args.prom_file, profile=args.profile,
+                             state_dir=args.state_dir)
+        #+5 per -q, -5 per -v (or -d), as cropresize
+        verb_level = args.quiet - args.verbose - args.debug
+        logging.getLogger("base").setLevel(logging.INFO + 5 * verb_level)
+        self.progress = progress.for_verbosity(verb_level)
+        self.profile = None
+        if args.profile is not None:
+            self.profile = profiling.run_profile()
+        self.metrics = metrics.run_metrics(self.profile, self.progress)
+        self.costs = costmodel.cost_model()
+        #one set: this object is the set; several: a view per set
+        #  (for_set) and this one, at their common parent dir, runs them
+        #  together
+        if 1 == len(bases):
+            self.use_set(bases[0])
+            self.sets = [self]
+        else:
+            self.use_set(common_dir(bases))
+            self.sets = [self.for_set(base) for base in bases]
+            logging.getLogger("base").info("{} sets: {}".format(
+                len(bases), " ".join(bases)))
+
+    def use_set(self, base):
+        """
+        make this the object of the set dir base: its source dirs,
+        duplicates and journal
+        """
         in_dirs = []
-        for pat in pats:
+        for pat in self.conf.get_dir("source_patterns"):
             for in_dir in glob.glob(os.path.join(base, pat)):
                 if os.path.exists(in_dir):
                     in_dirs.append(in_dir)
-        self.conf.update_dirs(im_sources=in_dirs)
+        self.conf.update_dirs(base=base, im_sources=in_dirs,
+                              state=statedir.state_dir(
+                                  base, self.conf.get_run("state_dir"),
+                                  not self.conf.get_run("dry_run")))
+        self.dupes = dedupe.duplicate_finder()
+        self.duplicates = {"img": [], "vid": []}
+        self.journal = None
+        #outputs found there already by plan_img
+        self.existing = 0
+
+    def for_set(self, base):
+        """
+        a view of this run for one of several set dirs: its own dirs,
+        duplicates and journal; settings, derivative cache, metrics,
+        progress and profile are shared
+        """
+        view = copy.copy(self)
+        view.conf = copy.copy(self.conf)
+        view.conf.dir_conf = self.conf.get_dirs()
+        view.use_set(base)
+        view.sets = [view]
+        return view
+
+    def conv_img(self, jobs=None):
+        """
+        convert image jobs (default: a fresh preconv stream) with the
+        run settings, return the summary
+        """
+        trace_log = logging.getLogger("trace")
+        trace_log.info("enter")
+        log = logging.getLogger("base")
+        if jobs is None:
+            jobs = self.preconv()
+        cpu = _child_cpu()
+        summary = imgconv.run_jobs(log, jobs, self.conf.get_run("jobs"),
+                                   self.conf.get_run("batch"),
+                                   self.conf.get_run("single_decode"),
+                                   self.conf.get_run("cache"),
+                                   self.journal, self.metrics)
+        #outputs found already there never became jobs, skipped all the
+        #  same, as vidconv.run_jobs counts existing previews
+        summary["skipped"] += sum(one.existing for one in self.sets)
+        #from what was done, failures cost next to nothing
+        if self.conf.get_run("calibrate"):
+            self.costs.calibrate("img", self.costs.img_cpu(
+                summary["px_decoded"], summary["done"], summary["spawns"]),
+                _child_cpu() - cpu)
+        log.info("images: {done} converted, {skipped} skipped,"
+                 " {cached} from cache, {failed} failed".format(**summary))
+        log.info("gm processes: {}".format(summary["spawns"]))
+        speedup = imgconv.decode_speedup(summary)
+        if speedup:
+            log.info("decode speedup: {:.1f}x (fewer pixels decoded)"
+                     "".format(speedup))
+        for one in self.sets:
+            one.link_duplicates("img", one.img_outfiles)
+        trace_log.info("exit")
+        return summary
 
-    def conv_img(self, jobID=None):
+    def near_duplicates(self):
         """
-        load details from config
+        clusters of near identical images in the set, as lists of paths
+        of their smallest derivative
 
-        #TODO: multiple job spec (specify as parameter?)
-        or is this a preconv source file lister?
+        perceptual hashes come from the derivatives conversion already
+        wrote (phash), cached in the scan index while size and mtime
+        match, so a rerun only hashes new outputs
         """
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
+        log = logging.getLogger("base")
+        max_dist = self.conf.get_run("near_dupes")
+        job_specs = self.job_specs("im")
+        if not max_dist or not job_specs:
+            return []
+        if phash.Image is None:
+            log.warn("near duplicates: no PIL, not looked for")
+            return []
+        base = self.conf.get_dir("base")
+        #the smallest derivative, or any spec if none is resized
+        sized = [spec for spec in job_specs if spec.get("resizedims")]
+        spec = min(sized or job_specs, key=lambda spec: imgconv.parse_dims(
+            spec.get("resizedims", "0x0")))
+        outdir = os.path.join(base, spec["loc"])
+        if not os.path.isdir(outdir):
+            return []
+        files = []
+        for name in sorted(os.listdir(outdir)):
+            path = os.path.join(outdir, name)
+            if self.check_file_type("img", path):
+                st = os.stat(path)
+                files.append((path, st.st_size, st.st_mtime))
+        index = self.open_index()
+        try:
+            known = index.get_phashes()
+            todo = [f for f in files if known.get(f[0], (None,))[:2] != f[1:]]
+            fresh = phash.hash_files([f[0] for f in todo])
+            index.put_phashes([f + (phash.to_signed(value),)
+                               for f, value in zip(todo, fresh)
+                               if value is not None])
+            known = index.get_phashes()
+        finally:
+            index.close()
+        log.info("near duplicates: {} of {} derivatives hashed".format(
+            len(todo), len(files)))
+        paths = [f[0] for f in files if f[0] in known]
+        clusters = phash.hash_index(
+            [known[path][2] for path in paths]).clusters(max_dist)
+        phash.report(log, paths, clusters)
         trace_log.info("exit")
-        return
+        return [[paths[i] for i in group] for group in clusters]
 
-    def list_input_files(self, job_spec=None):
+    def read_metadata(self):
         """
-        load details from config
+        {path: info} of the image, raw and video sources (see metadata),
+        kept in the scan index so unchanged files are not read again
 
-        #TODO: multiple job spec (specify as parameter?)
-        or is this a preconv source file lister?
+        conv() runs it for the index alone and drops the result
+        """
+        trace_log = logging.getLogger("trace")
+        trace_log.info("enter")
+        if not self.conf.get_run("meta_jobs"):
+            return {}
+        service = metadata.metadata_service(self.conf.get_run("meta_jobs"),
+                                            exiftool=self.conf.img_exif)
+        index = self.open_indexes()
+        try:
+            #the files of all sets go through one service
+            files = [(path, size, mtime) for one in self.sets
+                     for path, size, mtime, file_class
+                     in index.of(one.conf.get_dir("base")).scan(
+                         one.conf.get_dir("im_sources"),
+                         classify=self.classifier.classify,
+                         full=self.conf.get_run("full_scan"))
+                     if file_class in ("img", "raw", "vid")]
+            found = service.read(files, cache=index)
+        finally:
+            service.close()
+            index.close()
+        metadata.report(logging.getLogger("base"), service)
+        trace_log.info("exit")
+        return found
+
+    def conv_vid(self):
+        """
+        make the outputs of the video job specs, return the summary
         """
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
         log = logging.getLogger("base")
-        src_paths = []
-        for in_dir in self.conf.get_dir("im_sources"):
-            for root, dirs, files in os.walk(in_dir):
-                for file_name in files:
-                    file_path = os.path.join(root, file_name)
-                    if self.check_file_type(foo, file_path):
-                        src_paths.append(file_path)
-        log.warn("prints to follow")
-        print ("listed {} files; starting with: \n  {}"
-               "".format(len(src_paths), src_paths[0]))
-        trace_log.error("early return")
-        return
+        job_specs = self.job_specs("vid")
+        jobs = []
+        if job_specs:
+            jobs = [job for one in self.sets
+                    for job in one.plan_vid(one.drop_duplicates(
+                        one.list_input_files(job_spec="vid"), "vid"),
+                        job_specs)]
+        if self.progress is not None:
+            self.progress.planning_done("vid")
+        #probe results are kept in the scan index of each set
+        index = self.open_indexes()
+        try:
+            summary = vidconv.run_jobs(log, jobs,
+                                       self.conf.get_run("vid_jobs"),
+                                       self.conf.get_run("threads"),
+                                       self.conf.get_run("segment_min"),
+                                       probes=index, journal=self.journal,
+                                       metrics=self.metrics)
+        finally:
+            index.close()
+        #estimated from the clips run_jobs probed and planned anyway,
+        #  against what their ffmpeg runs used; failed ones would skew it
+        if self.conf.get_run("calibrate") and not summary["failed"]:
+            self.costs.calibrate("vid",
+                                 self.costs.video_cpu(summary["probed"]),
+                                 summary["cpu"])
+        log.info("videos: {done} done ({remuxed} remuxed, {linked} linked),"
+                 " {skipped} skipped, {failed} failed".format(**summary))
+        encode_fps = vidconv.encode_fps(summary)
+        if encode_fps:
+            log.info("encode speed: {:.1f} fps".format(encode_fps))
+        for one in self.sets:
+            one.link_duplicates("vid", one.vid_outfiles)
+        trace_log.info("exit")
+        return summary
 
-        base_dir = "."
-        in_media = "raw-media"
-        in_dir = os.path.join(base_dir, in_media)
-        out_dir = os.path.join(base_dir, "preview")
-        out_dir = out_dir
-        image_paths = []
-        for root, dirs, files in os.walk(in_dir):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                if self.check_file_type(foo, file_path):
-                    image_paths.append(os.path.join(root, file_name))
-                #ext = os.path.splitext(file_name.lower())[-1][1:]
-                #if "jpg" == ext:
-
-        print "file extensions"
-        "jpg"
-        #image_tool = "gm convert"
-        #image_params = "-resize", "600x600"
-        #image_output = "preview"
+    def open_index(self):
+        """
+        scan index of the base dir, kept in its state dir; an in memory
+        copy for dry runs
+        """
+        return scanindex.scan_index(
+            self.conf.get_dir("base"),
+            scanindex.index_path(self.conf.get_dir("state")),
+            read_only=self.conf.get_run("dry_run"))
+
+    def open_indexes(self):
+        """
+        the scan indexes of all sets as one (scanindex.index_set)
+        """
+        return scanindex.index_set(dict(
+            (one.conf.get_dir("base"), one.open_index())
+            for one in self.sets))
+
+    def list_input_files(self, job_spec=None):
+        """
+        generate (path, size) of the source files of the job spec's
+        type (or file class)
+
+        scan index of the base dir: unchanged dirs are not listed
+        again, the source dirs are walked together on threads; paths
+        come out as their directory is read, not after the whole scan
+        """
+        trace_log = logging.getLogger("trace")
+        trace_log.info("enter")
+        log = logging.getLogger("base")
+        count = 0
+        #opened here, so it lives on the thread iterating this
+        index = self.open_index()
+        try:
+            for file_path, size, mtime, file_class in index.scan(
+                    self.conf.get_dir("im_sources"),
+                    classify=self.classifier.classify,
+                    full=self.conf.get_run("full_scan")):
+                if self.check_file_type(job_spec, file_path, file_class):
+                    count += 1
+                    yield file_path, size
+        finally:
+            index.close()
+        self.metrics.count("files_scanned", count, file_class=str(job_spec))
+        self.metrics.count("files_classified",
+                           index.stats["files_classified"])
+        log.info("listed {} source files".format(count))
         trace_log.info("exit")
-        pass
 
-    def check_file_type(self, ft, file_path):
+    def drop_duplicates(self, records, file_class):
+        """
+        pass on (path, size) records that are not exact copies of an
+        earlier source (dedupe), the copies are kept in
+        self.duplicates[file_class] as (duplicate, original)
+        """
+        if "off" == self.conf.get_run("dupes"):
+            for record in records:
+                yield record
+            return
+        for file_path, size in records:
+            original = self.dupes.check(file_path, size)
+            if original is None:
+                yield file_path, size
+            else:
+                self.duplicates[file_class].append((file_path, original))
+
+    def link_duplicates(self, file_class, outfiles):
+        """
+        give duplicates copies of the outputs of their originals
+        (--dupes link), reflinks where the filesystem can but never
+        hardlinks, so editing one derivative leaves the other alone
+
+        outfiles: callable(source path) -> its possible output paths
+        """
+        if "link" != self.conf.get_run("dupes"):
+            return
+        for duplicate, original in self.duplicates[file_class]:
+            for dup_out, orig_out in zip(outfiles(duplicate),
+                                         outfiles(original)):
+                if (dup_out == orig_out or os.path.exists(dup_out) or
+                        not os.path.exists(orig_out)):
+                    continue
+                tmp = imgconv.tmp_path(dup_out)
+                try:
+                    derivcache.copy_file(orig_out, tmp)
+                    shutil.copystat(orig_out, tmp)
+                    os.rename(tmp, dup_out)
+                except (IOError, OSError), e:
+                    imgconv._remove_partial(tmp)
+                    logging.getLogger("base").warn(
+                        "cannot copy {}: {}".format(dup_out, e))
+
+    def resume_state(self, outfiles):
+        """
+        "done" if the journal has the job making outfiles (the first is
+        its planned name) as done, "redo" if it was started and never
+        finished, None otherwise; a redo loses whatever it may have
+        half written
+
+        jobs that are not done are noted as planned
+        """
+        if self.journal is None:
+            return None
+        if outfiles[0] in self.journal.done:
+            return "done"
+        self.journal.planned(outfiles[0])
+        if outfiles[0] not in self.journal.in_flight:
+            return None
+        for outfile in outfiles:
+            imgconv._remove_partial(outfile)
+            imgconv._remove_partial(imgconv.tmp_path(outfile))
+        return "redo"
+
+    def img_outfiles(self, file_path):
+        base = self.conf.get_dir("base")
+        return [os.path.join(base, spec["loc"], os.path.basename(file_path))
+                for spec in self.job_specs("im")]
+
+    def vid_outfiles(self, file_path):
+        base = self.conf.get_dir("base")
+        return [name for spec in self.job_specs("vid")
+                for job in vidconv.make_jobs(
+                    file_path, os.path.join(base, spec["loc"]), spec)
+                for name in vidconv.preview_names(job)]
+
+    def plan_img(self, src_records, job_specs):
+        """
+        generate conversion jobs for source images, all specs of one
+        source together
+
+        outputs that exist already are left out, counted as skipped
+        (self.existing, and in the metrics as vidconv counts an existing
+        preview); each output dir is listed once, when the first job for
+        it comes up
+        """
+        base = self.conf.get_dir("base")
+        out_names = {}
+        for file_path, size in src_records:
+            name = os.path.basename(file_path)
+            for spec in job_specs:
+                outdir = os.path.join(base, spec["loc"])
+                state = self.resume_state([os.path.join(outdir, name)])
+                if "done" == state:
+                    continue
+                if outdir not in out_names:
+                    out_names[outdir] = set()
+                    if os.path.isdir(outdir):
+                        out_names[outdir].update(os.listdir(outdir))
+                    elif not self.conf.get_run("dry_run"):
+                        os.makedirs(outdir)
+                if name in out_names[outdir] and "redo" != state:
+                    self.existing += 1
+                    if not self.conf.get_run("dry_run"):
+                        logging.getLogger("base").log(
+                            imgconv.FILE_LOG, "skipping existant file: %s"
+                            % os.path.join(outdir, name))
+                        self.planned("img", spec)
+                        self.metrics.job("img", spec["name"], "skipped")
+                    continue
+                #also keeps two sources with one name from colliding
+                out_names[outdir].add(name)
+                self.planned("img", spec)
+                yield imgconv.make_job(file_path,
+                                       os.path.join(outdir, name), spec)
+
+    def plan_vid(self, src_records, job_specs):
+        """
+        generate video jobs for source clips (see vidconv.make_jobs)
+        """
+        base = self.conf.get_dir("base")
+        for file_path, size in src_records:
+            for spec in job_specs:
+                outdir = os.path.join(base, spec["loc"])
+                if (not os.path.isdir(outdir) and
+                        not self.conf.get_run("dry_run")):
+                    os.makedirs(outdir)
+                for job in vidconv.make_jobs(file_path, outdir, spec):
+                    if "done" != self.resume_state(
+                            [job["outfile"]] + vidconv.preview_names(job)):
+                        self.planned("vid", spec)
+                        yield job
+
+    def planned(self, kind, spec):
+        """
+        count a planned job of kind (img, vid) and spec for the progress
+        reporter
+        """
+        if self.progress is not None:
+            self.progress.planned(kind, spec["name"])
+
+    def job_specs(self, spec_type):
+        """
+        configured job specs of a type ("im", "vid"), by name
+        """
+        return sorted((spec for spec in self.conf.get_job_specs().values()
+                       if spec_type == spec.get("type")),
+                      key=lambda spec: spec["name"])
+
+    def check_file_type(self, ft, file_path, file_class=None):
         """
         check if path is of type or not
 
+        ft: file class ("img", "raw", "vid", "misc") or job spec
+        file_class: class already known (scan index), if any
+
         examples:
         * cft(config_img, "example/image.jpg") -> True
         * cft(config_img, "example/foo.txt") -> False
         """
-        trace_log = logging.getLogger("trace")
-        trace_log.info("enter")
-        trace_log.info("exit")
-        return False
+        return self.classifier.check(ft, file_path, file_class)
 
     def prep(self):
         """
@@ -428,22 +1006,91 @@ class foo(object):
 
     def preconv(self):
         """
-        gather sets of files for processing
+        stream of image conversion jobs of every set, one set after the
+        other, so the worker pool goes on to the next set without waiting
+        """
+        jobs = self.set_jobs()
+        if len(self.sets) > 1:
+            jobs = pipeline.stage(self.profiled(jobs), name="sets")
+        return self.all_planned("img", jobs)
 
-        list of files w/ each entry noting:
-            file path,
-            name,
-            output path,
-            :cc
+    def set_jobs(self):
+        """
+        the image jobs of each set in turn, the stages of a set closed
+        when it is done with or the stream is given up
+        """
+        for one in self.sets:
+            jobs = one.img_jobs()
+            try:
+                for job in jobs:
+                    yield job
+            finally:
+                jobs.close()
+
+    def all_planned(self, kind, jobs):
+        """
+        jobs, telling the progress reporter once there are no more
+        """
+        try:
+            for job in jobs:
+                yield job
+        finally:
+            if hasattr(jobs, "close"):
+                jobs.close()
+        if self.progress is not None:
+            self.progress.planning_done(kind)
+
+    def img_jobs(self):
+        """
+        stream of the image conversion jobs of this set
+
+        scan -> classify -> dedupe -> plan, each stage on its own thread
+        and joined by a bounded queue (pipeline.stage): conversion can
+        start with the first image found, and a stage that gets ahead waits
+        for the one after it instead of piling up a file list
 
+        closing the returned stage closes the ones before it
         """
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
+        job_specs = self.job_specs("im")
+        files = pipeline.stage(self.profiled(
+            self.list_input_files(job_spec="img")), name="scan")
+        #exact copies (a card copied in twice) are left out here
+        src_records = pipeline.stage(self.profiled(
+            self.drop_duplicates(files, "img")), name="dedupe",
+            inputs=[files])
+        jobs = pipeline.stage(self.profiled(
+            self.plan_img(src_records, job_specs)), name="plan",
+            inputs=[src_records])
+        trace_log.info("exit")
+        return jobs
 
-        self.list_input_files(job_spec=self.conf.get_job_spec())
+    def profiled(self, gen):
+        """
+        gen, profiled on the thread that runs it as part of preconv
+        (--profile)
+        """
+        if self.profile is None:
+            return gen
+        return self.profile.thread_stage("preconv", gen)
 
-        trace_log.info("exit")
-        pass
+    def write_profile(self):
+        """
+        log the profile (--profile) and dump its stats
+        """
+        if self.profile is None:
+            return
+        log = logging.getLogger("base")
+        self.profile.report(log)
+        prefix = self.conf.get_run("profile") or os.path.join(
+            self.conf.get_dir("state"), profiling.PROFILE_NAME)
+        try:
+            paths = self.profile.dump(prefix)
+        except (IOError, OSError), e:
+            log.warn("cannot write the profile: {}".format(e))
+            return
+        log.info("profile stats: {}".format(" ".join(paths)))
 
     def conv(self):
         """
@@ -458,17 +1105,143 @@ class foo(object):
         """
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
-        log = logging.getLogger("base")
 
-        self.preconv()
-        log.info("skip image conversion")
-        #self.conv_img()
-        log.info("skip video conversion")
-        #self.conv_vid()
+        if self.conf.get_run("dry_run"):
+            self.plan_run()
+            trace_log.info("exit")
+            return
+        self.open_journals()
+        cpu = _child_cpu()
+        if self.progress is not None:
+            self.progress.start()
+        try:
+            with self.metrics.stage("img"):
+                img_summary = self.conv_img(self.preconv())
+            with self.metrics.stage("near_dupes"):
+                for one in self.sets:
+                    one.near_duplicates()
+            with self.metrics.stage("vid"):
+                vid_summary = self.conv_vid()
+        finally:
+            if self.progress is not None:
+                self.progress.stop()
+            self.journal.close()
+        #only fills the metadata kept in the scan index, the conversions
+        #  above do not need it (derivatives carry the source EXIF,
+        #  orientation included), so it runs after them
+        with self.metrics.stage("metadata"):
+            self.read_metadata()
+        #average CPU per output, for what skipping duplicates saved
+        cpu = _child_cpu() - cpu
+        made = img_summary["done"] + vid_summary["done"]
+        for one in self.sets:
+            cpu_saved = None
+            if made:
+                skipped = (len(one.duplicates["img"]) *
+                           len(self.job_specs("im")) +
+                           len(one.duplicates["vid"]) *
+                           len(self.job_specs("vid")))
+                cpu_saved = skipped * cpu / made
+            dedupe.report(logging.getLogger("base"), one.dupes,
+                          one.duplicates["img"] + one.duplicates["vid"],
+                          cpu_saved)
+            one.dupes.close()
+        if self.conf.get_run("calibrate"):
+            self.costs.save()
+        self.write_report()
 
         trace_log.info("exit")
         pass
 
+    def open_journals(self):
+        """
+        the job journal of each set; with several sets, self.journal
+        notes each job in the journal of its set (journal.journal_set)
+        """
+        resume = self.conf.get_run("resume")
+        for one in self.sets:
+            base = one.conf.get_dir("base")
+            one.journal = journal.job_journal(
+                journal.journal_path(one.conf.get_dir("state")), resume)
+            if resume:
+                logging.getLogger("base").info(
+                    "resume {}: {} jobs done, {} unfinished to make"
+                    " again".format(base, len(one.journal.done),
+                                    len(one.journal.in_flight)))
+        if self.sets != [self]:
+            self.journal = journal.journal_set(dict(
+                (one.conf.get_dir("base"), one.journal)
+                for one in self.sets))
+
+    def write_report(self):
+        """
+        the run's metrics as a JSON report (--report) and Prometheus
+        textfile (--prom-file)
+        """
+        log = logging.getLogger("base")
+        path = self.conf.get_run("report")
+        if path is None:
+            path = metrics.report_path(self.conf.get_dir("state"))
+        duplicates = sum(len(one.duplicates["img"]) +
+                         len(one.duplicates["vid"]) for one in self.sets)
+        try:
+            run = self.metrics.write(path, self.conf.get_run("prom_file"),
+                                     base=self.conf.get_dir("base"),
+                                     sets=[one.conf.get_dir("base")
+                                           for one in self.sets],
+                                     duplicates=duplicates)
+        except (IOError, OSError), e:
+            log.warn("cannot write the run report: {}".format(e))
+            return
+        metrics.report(log, run)
+
+    def plan_run(self):
+        """
+        -n: the whole job plan (sources, specs, outputs, what is there
+        already, duplicates) and an estimate of its cost (costmodel)
+
+        nothing is written: output dirs are not made, the scan index is
+        an in memory copy, there is no journal
+        """
+        trace_log = logging.getLogger("trace")
+        trace_log.info("enter")
+        log = logging.getLogger("base")
+        img_jobs = [job for one in self.sets
+                    for job in one.plan_img(one.drop_duplicates(
+                        one.list_input_files(job_spec="img"), "img"),
+                        self.job_specs("im"))]
+        vid_jobs = []
+        if self.job_specs("vid"):
+            vid_jobs = [job for one in self.sets
+                        for job in one.plan_vid(one.drop_duplicates(
+                            one.list_input_files(job_spec="vid"), "vid"),
+                            self.job_specs("vid"))]
+        for job in img_jobs + vid_jobs:
+            log.debug("plan: {} -> {} ({})".format(
+                job["infile"], job["outfile"], job["spec"]["name"]))
+        duplicates = [pair for one in self.sets
+                      for pair in one.duplicates["img"] +
+                      one.duplicates["vid"]]
+        for duplicate, original in duplicates:
+            log.debug("plan: {} is a duplicate of {}".format(duplicate,
+                                                             original))
+        img_total = self.costs.images(img_jobs, self.conf.get_run("jobs"),
+                                      self.conf.get_run("batch"),
+                                      self.conf.get_run("single_decode"))
+        img_total["existing"] = sum(one.existing for one in self.sets)
+        index = self.open_indexes()
+        try:
+            vid_total = self.costs.videos(vid_jobs,
+                                          self.conf.get_run("threads"),
+                                          self.conf.get_run("segment_min"),
+                                          probes=index)
+        finally:
+            index.close()
+        for one in self.sets:
+            one.dupes.close()
+        costmodel.report(log, [img_total, vid_total], len(duplicates))
+        trace_log.info("exit")
+
     def clean():
         trace_log = logging.getLogger("trace")
         trace_log.info("enter")
@@ -489,10 +1262,23 @@ def main():
     # -c - convert media
 
     conv_obj = foo()
-    conv_obj.setup()  # parse parameters, config, log
+    #--profile is only known once setup has read it, so setup is
+    #  always profiled and the result kept if it was asked for
+    setup_profile = cProfile.Profile()
+    setup_profile.enable()
+    try:
+        conv_obj.setup()  # parse parameters, config, log
+    finally:
+        setup_profile.disable()
+    if conv_obj.profile is None:
+        conv_obj.conv()  # convert inputs w/out convertions
+        return
+    conv_obj.profile.add("setup", setup_profile)
     #conv_obj.prep()  # create file list(s) check directory access
-    conv_obj.conv()  # convert inputs w/out convertions
+    with conv_obj.profile.stage("conv"):
+        conv_obj.conv()
     #conv_obj.clean()  # remove temp files?
+    conv_obj.write_profile()
 
 
 if __name__ == '__main__' or __name__ == sys.argv[0]:
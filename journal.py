@@ -0,0 +1,160 @@
+"""
+append-only job journal of a run, for resuming after a crash
+
+one line per event, "<state>\t<outfile>":
+    P   planned
+    S   started, handed to a worker (gm, ffmpeg)
+    D   done (converted, from cache or found existing)
+    F   failed
+lines are flushed at batch boundaries (each unit of image jobs, each
+ffmpeg run), so a crash or OOM kill loses at most the last batch, and
+fsynced at most every SYNC_SECONDS or SYNC_EVERY lines (and at close),
+so power loss costs at most that much more; a torn last line is dropped
+
+a run that does not resume moves the previous journal aside (<name>.1,
+replacing an older one) rather than truncating it
+
+replaying it (resume) gives the jobs known done, which a resumed run
+skips without looking at their files, and the ones started but never
+finished, whose outputs may be half written and are made again
+"""
+
+import os
+import threading
+import time
+
+import scanner
+
+JOURNAL_NAME = ".photo_work_journal"
+STATES = {"P": "planned", "S": "started", "D": "done", "F": "failed"}
+#fsync when this long (seconds) or this many lines went unsynced
+SYNC_SECONDS = 1.0
+SYNC_EVERY = 1000
+
+
+def journal_path(state_dir):
+    return os.path.join(state_dir, JOURNAL_NAME)
+
+
+class job_journal(object):
+    """
+    journal file of a base dir, see module doc
+
+    resume: replay the existing journal and append to it, otherwise it
+        is moved aside (<path>.1) and a new one started
+    writes are locked, planning and converting run on different threads
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        #started, neither done nor failed
+        self.in_flight = set()
+        self.failed = set()
+        #lines written since the last fsync, and its time
+        self.unsynced = 0
+        self.synced = time.time()
+        if resume and os.path.exists(path):
+            self._replay()
+        elif os.path.exists(path):
+            os.rename(path, path + ".1")
+        self.fh = open(path, "a")
+
+    def _replay(self):
+        #length of the complete lines
+        good = 0
+        with open(self.path) as fh:
+            for line in fh:
+                if not line.endswith("\n"):
+                    break  # torn write, the crash hit here
+                good += len(line)
+                state, sep, outfile = line[:-1].partition("\t")
+                if not sep or state not in STATES:
+                    continue
+                if "S" == state:
+                    self.in_flight.add(outfile)
+                elif "D" == state:
+                    self.done.add(outfile)
+                    self.in_flight.discard(outfile)
+                    self.failed.discard(outfile)
+                elif "F" == state:
+                    self.failed.add(outfile)
+                    self.in_flight.discard(outfile)
+        if good < os.path.getsize(self.path):
+            #appending to a torn line would garble the next one
+            with open(self.path, "r+") as fh:
+                fh.truncate(good)
+
+    def _write(self, state, outfiles):
+        #one line per entry, a newline in a name would break it
+        lines = "".join("{}\t{}\n".format(state, outfile)
+                        for outfile in outfiles if "\n" not in outfile)
+        with self.lock:
+            self.fh.write(lines)
+            self.unsynced += lines.count("\n")
+
+    def planned(self, outfile):
+        self._write("P", [outfile])
+
+    def started(self, outfiles):
+        self._write("S", outfiles)
+
+    def finished(self, outfile, ok=True):
+        self._write("D" if ok else "F", [outfile])
+
+    def sync(self, force=False):
+        """
+        make what was written so far survive a crash of this process,
+        and power loss too once an fsync is due (SYNC_SECONDS,
+        SYNC_EVERY) or forced
+        """
+        with self.lock:
+            self.fh.flush()
+            if not self.unsynced:
+                return
+            now = time.time()
+            if (force or self.unsynced >= SYNC_EVERY or
+                    now - self.synced >= SYNC_SECONDS):
+                os.fsync(self.fh.fileno())
+                self.unsynced = 0
+                self.synced = now
+
+    def close(self):
+        self.sync(True)
+        self.fh.close()
+
+
+class journal_set(object):
+    """
+    the journals of several sets as one, for a run over all of them:
+    each outfile is noted in the journal of the set it lies in
+
+    journals: {base dir: job_journal}
+    """
+    def __init__(self, journals):
+        self.journals = journals
+
+    def _of(self, outfile):
+        return self.journals[scanner.owner(outfile, self.journals)]
+
+    def planned(self, outfile):
+        self._of(outfile).planned(outfile)
+
+    def started(self, outfiles):
+        by_set = {}
+        for outfile in outfiles:
+            by_set.setdefault(scanner.owner(outfile, self.journals),
+                              []).append(outfile)
+        for base, names in by_set.items():
+            self.journals[base].started(names)
+
+    def finished(self, outfile, ok=True):
+        self._of(outfile).finished(outfile, ok)
+
+    def sync(self, force=False):
+        for one in self.journals.values():
+            one.sync(force)
+
+    def close(self):
+        for one in self.journals.values():
+            one.close()
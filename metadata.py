@@ -0,0 +1,214 @@
+"""
+image and clip metadata from exiftool: capture time, orientation,
+dimensions and camera model
+
+exiftool is a perl program, starting it costs ~150ms; instead each
+worker keeps one `exiftool -stay_open True -@ -` running and feeds it
+batches of paths on stdin, one -json answer per batch (-execute{n} ends
+a batch, exiftool answers {readyn} after its output)
+
+results are kept in the scan index by size and mtime, so a rerun only
+reads new or changed files
+"""
+
+import json
+import logging
+import os
+import Queue
+import subprocess
+import time
+from multiprocessing.pool import ThreadPool
+
+EXIFTOOL = "exiftool"
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH = 200
+#sent once per process: -n numbers (orientation 1-8) instead of prose,
+#  -fast2 skips maker notes
+COMMON_ARGS = ["-json", "-n", "-fast2", "-DateTimeOriginal", "-CreateDate",
+               "-Orientation", "-ImageWidth", "-ImageHeight", "-Model"]
+FIELDS = ("taken", "orientation", "width", "height", "model")
+
+
+def parse_record(record):
+    """
+    exiftool -json record -> dict of FIELDS, None where not found
+    """
+    info = dict.fromkeys(FIELDS)
+    taken = record.get("DateTimeOriginal") or record.get("CreateDate")
+    #cameras without a clock write zeros
+    if taken and not str(taken).startswith("0000"):
+        info["taken"] = str(taken)
+    for key, tag in (("orientation", "Orientation"), ("width", "ImageWidth"),
+                     ("height", "ImageHeight")):
+        try:
+            info[key] = int(record[tag])
+        except (KeyError, TypeError, ValueError):
+            pass
+    if record.get("Model") is not None:
+        info["model"] = unicode(record["Model"]).strip().encode("utf-8")
+    return info
+
+
+class exif_tool(object):
+    """
+    one exiftool -stay_open process, used by one thread at a time
+
+    raises OSError when exiftool can not be started
+    """
+    def __init__(self, exiftool=EXIFTOOL):
+        self.count = 0
+        with open(os.devnull, "w") as devnull:
+            self.proc = subprocess.Popen(
+                [exiftool, "-stay_open", "True", "-@", "-",
+                 "-common_args"] + COMMON_ARGS,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=devnull)
+
+    def read(self, paths):
+        """
+        {path: info} of paths; files exiftool can not read are left out
+
+        raises IOError if the process went away, ValueError on output
+        that is not JSON
+        """
+        #one argument per line, so a newline can not be passed
+        paths = [path for path in paths if "\n" not in path]
+        if not paths:
+            return {}
+        self.count += 1
+        ready = "{{ready{}}}".format(self.count)
+        self.proc.stdin.write("".join(path + "\n" for path in paths) +
+                              "-execute{}\n".format(self.count))
+        self.proc.stdin.flush()
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise IOError("exiftool exited")
+            if line.rstrip() == ready:
+                break
+            lines.append(line)
+        out = "".join(lines).strip()
+        found = {}
+        for record in json.loads(out) if out else []:
+            if "SourceFile" in record:
+                path = record["SourceFile"].encode("utf-8")
+                found[path] = parse_record(record)
+        return found
+
+    def close(self):
+        try:
+            self.proc.stdin.write("-stay_open\nFalse\n")
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+
+
+class metadata_service(object):
+    """
+    up to n_workers exiftool processes reading batches in parallel,
+    started when first needed
+
+    exiftool: command to run (config_state.img_exif)
+    """
+    def __init__(self, n_workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH,
+                 exiftool=EXIFTOOL):
+        self.n_workers = max(1, n_workers)
+        self.batch_size = max(1, batch_size)
+        self.exiftool = exiftool
+        self.tools = Queue.Queue()
+        self.pool = None
+        self.missing = False
+        self.stats = {"files": 0, "cached": 0, "read": 0, "batches": 0,
+                      "seconds": 0.0}
+
+    def _read_batch(self, paths):
+        """
+        read one batch on a free exiftool, pool thread side
+        """
+        try:
+            tool = self.tools.get_nowait()
+        except Queue.Empty:
+            try:
+                tool = exif_tool(self.exiftool)
+            except OSError:
+                self.missing = True
+                return {}
+        try:
+            found = tool.read(paths)
+        except (IOError, OSError, ValueError):
+            #lost its place in the output, start a fresh one next time
+            tool.close()
+            return {}
+        self.tools.put(tool)
+        return found
+
+    def read(self, files, cache=None):
+        """
+        {path: info} of files, iterable of (path, size, mtime)
+
+        cache: scanindex.scan_index to answer from and record into,
+            used from the calling thread only
+        """
+        files = list(files)
+        self.stats["files"] += len(files)
+        found = {}
+        known = cache.get_metadata() if cache is not None else {}
+        todo = []
+        for path, size, mtime in files:
+            record = known.get(path)
+            if record is not None and record[:2] == (size, mtime):
+                found[path] = record[2]
+            else:
+                todo.append((path, size, mtime))
+        self.stats["cached"] += len(found)
+        if not todo or self.missing:
+            return found
+        if self.pool is None:
+            self.pool = ThreadPool(self.n_workers)
+        batches = [todo[i:i + self.batch_size]
+                   for i in range(0, len(todo), self.batch_size)]
+        start = time.time()
+        rows = []
+        for batch, answer in zip(batches, self.pool.imap(
+                self._read_batch, [[f[0] for f in b] for b in batches])):
+            for path, size, mtime in batch:
+                if path in answer:
+                    found[path] = answer[path]
+                    rows.append((path, size, mtime, answer[path]))
+        self.stats["seconds"] += time.time() - start
+        self.stats["batches"] += len(batches)
+        self.stats["read"] += len(rows)
+        if cache is not None:
+            cache.put_metadata(rows)
+        return found
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        while True:
+            try:
+                self.tools.get_nowait().close()
+            except Queue.Empty:
+                break
+
+
+def report(log, service):
+    """
+    log what the metadata service read
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    stats = service.stats
+    if service.missing:
+        log.warn("metadata: {} not found, nothing read".format(
+            service.exiftool))
+    rate = ""
+    if stats["seconds"] > 0:
+        rate = ", {:.0f} files/s".format(stats["read"] / stats["seconds"])
+    log.info("metadata: {} files, {} from the index, {} read in {} batches"
+             "{}".format(stats["files"], stats["cached"], stats["read"],
+                         stats["batches"], rate))
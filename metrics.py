@@ -0,0 +1,290 @@
+"""
+run metrics: counters, latency samples and stage timings of one run,
+written at its end as a JSON report and, optionally, a Prometheus
+textfile (node_exporter --collector.textfile.directory)
+
+    counters    files scanned and classified, jobs by kind, spec and
+                status (done, cached, skipped, failed), bytes read and
+                written
+    latencies   seconds per job, by kind and spec, reported as count,
+                sum and percentiles
+    tools       runs, wall, user and sys seconds of the external tools
+                (gm, ffmpeg)
+    stages      wall seconds and CPU of this process and of its
+                children (gm, ffmpeg, exiftool) per stage, from
+                getrusage (RUSAGE_SELF, RUSAGE_CHILDREN)
+
+children are only counted once they have been waited for, a stage's
+child CPU is that of the processes it started and reaped
+"""
+
+import contextlib
+import json
+import os
+import resource
+import socket
+import tempfile
+import threading
+import time
+
+REPORT_NAME = ".photo_work_report.json"
+PERCENTILES = (50, 90, 99)
+PREFIX = "photo_work_"
+#job status -> what a counter calls it
+STATUS_NAMES = {"done": "converted", "cached": "cached",
+                "skipped": "skipped", "failed": "failed"}
+
+
+def report_path(state_dir):
+    return os.path.join(state_dir, REPORT_NAME)
+
+
+def _cpu(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(ordered, pct):
+    """
+    nearest rank percentile of a sorted list, None if it is empty
+    """
+    if not ordered:
+        return None
+    rank = int(-(-pct * len(ordered) // 100))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class run_metrics(object):
+    """
+    metrics of one run, safe to feed from several threads
+
+    profile: profiling.run_profile to pass jobs and tool runs on to
+        (--profile), None for none
+    progress: progress.progress_reporter to pass finished jobs on to,
+        None for none
+    """
+    def __init__(self, profile=None, progress=None):
+        self.profile = profile
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.cpu_self = _cpu(resource.RUSAGE_SELF)
+        self.cpu_children = _cpu(resource.RUSAGE_CHILDREN)
+        #(name, labels) -> number
+        self.counters = {}
+        #(name, labels) -> list of values
+        self.samples = {}
+        #in the order they ran
+        self.stages = []
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.samples.setdefault(key, []).append(value)
+
+    def job(self, kind, spec, status, seconds=None, bytes_in=0,
+            bytes_out=0, infile=None):
+        """
+        account for one finished job (kind: img, vid)
+
+        seconds: its latency, only kept for jobs that did work (done)
+        """
+        self.count("jobs", kind=kind, spec=spec,
+                   status=STATUS_NAMES.get(status, status))
+        if self.progress is not None:
+            self.progress.finished(kind, spec, bytes_in)
+        if bytes_in:
+            self.count("bytes_read", bytes_in, kind=kind)
+        if bytes_out:
+            self.count("bytes_written", bytes_out, kind=kind)
+        if "done" == status and seconds is not None:
+            self.observe("job_seconds", seconds, kind=kind, spec=spec)
+            if self.profile is not None:
+                self.profile.job(kind, spec, infile, seconds)
+
+    def tool(self, name, wall, user, system, label=None):
+        """
+        account for one run of an external tool
+
+        label: what it worked on, for the profile's slowest runs
+        """
+        self.count("tool_runs", tool=name)
+        self.count("tool_seconds", wall, tool=name, clock="wall")
+        self.count("tool_seconds", user, tool=name, clock="user")
+        self.count("tool_seconds", system, tool=name, clock="sys")
+        if self.profile is not None:
+            self.profile.tool(name, wall, user, system, label)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        time the with block as stage name
+        """
+        start = time.time()
+        own = _cpu(resource.RUSAGE_SELF)
+        children = _cpu(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages.append({
+                    "name": name, "start": start,
+                    "seconds": time.time() - start,
+                    "cpu_self": _cpu(resource.RUSAGE_SELF) - own,
+                    "cpu_children": (_cpu(resource.RUSAGE_CHILDREN) -
+                                     children)})
+
+    def report(self, **extra):
+        """
+        the run as a JSON serializable dict, extra keys added on top
+        """
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels),
+                         "value": value}
+                        for (name, labels), value
+                        in sorted(self.counters.items())]
+            latencies = []
+            for (name, labels), values in sorted(self.samples.items()):
+                ordered = sorted(values)
+                entry = {"name": name, "labels": dict(labels),
+                         "count": len(ordered), "sum": sum(ordered),
+                         "min": ordered[0], "max": ordered[-1]}
+                for pct in PERCENTILES:
+                    entry["p{}".format(pct)] = percentile(ordered, pct)
+                latencies.append(entry)
+            stages = [dict(stage) for stage in self.stages]
+        report = {"host": socket.gethostname(), "start": self.start,
+                  "seconds": time.time() - self.start,
+                  "cpu_self": _cpu(resource.RUSAGE_SELF) - self.cpu_self,
+                  "cpu_children": (_cpu(resource.RUSAGE_CHILDREN) -
+                                   self.cpu_children),
+                  "counters": counters, "latencies": latencies,
+                  "stages": stages}
+        report.update(extra)
+        return report
+
+    def prometheus(self, report=None):
+        """
+        report (default: a fresh one) in the Prometheus text format
+        """
+        if report is None:
+            report = self.report()
+        lines = []
+        typed = set()
+
+        def sample(name, value, kind, labels=None):
+            name = PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} {}".format(name, kind))
+            lines.append("{}{} {}".format(
+                name, _labels(labels or {}), _number(value)))
+
+        for counter in report["counters"]:
+            sample(counter["name"] + "_total", counter["value"], "counter",
+                   counter["labels"])
+        for latency in report["latencies"]:
+            labels = latency["labels"]
+            name = PREFIX + latency["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} summary".format(name))
+            for pct in PERCENTILES:
+                lines.append("{}{} {}".format(
+                    name, _labels(dict(labels,
+                                       quantile=str(pct / 100.0))),
+                    _number(latency["p{}".format(pct)])))
+            lines.append("{}_sum{} {}".format(name, _labels(labels),
+                                              _number(latency["sum"])))
+            lines.append("{}_count{} {}".format(name, _labels(labels),
+                                                latency["count"]))
+        for stage in report["stages"]:
+            for clock in ("seconds", "cpu_self", "cpu_children"):
+                sample("stage_seconds", stage[clock], "gauge",
+                       {"stage": stage["name"], "clock": clock})
+        for clock in ("seconds", "cpu_self", "cpu_children"):
+            sample("run_seconds", report[clock], "gauge", {"clock": clock})
+        sample("last_run_timestamp_seconds", report["start"], "gauge")
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, path, prom_path=None, **extra):
+        """
+        write the JSON report to path and, if given, the Prometheus
+        textfile to prom_path; return the report
+        """
+        report = self.report(**extra)
+        if path:
+            _replace(path, json.dumps(report, indent=2, sort_keys=True) +
+                     "\n")
+        if prom_path:
+            _replace(prom_path, self.prometheus(report))
+        return report
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, _escape(value))
+                          for key, value in sorted(labels.items())) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+def _replace(path, text):
+    """
+    write text to path at once: the textfile collector must never read
+    half a file
+    """
+    out_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".metrics", dir=out_dir)
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def report(log, run):
+    """
+    log the highlights of a run report (run_metrics.report)
+    """
+    totals = {}
+    for counter in run["counters"]:
+        key = counter["labels"].get("status", counter["name"])
+        totals[key] = totals.get(key, 0) + counter["value"]
+    log.info("run: {:.1f}s wall, {:.1f}s CPU here, {:.1f}s CPU in tools;"
+             " {} converted, {} cached, {} skipped, {} failed; {} MB read,"
+             " {} MB written".format(
+                 run["seconds"], run["cpu_self"], run["cpu_children"],
+                 totals.get("converted", 0), totals.get("cached", 0),
+                 totals.get("skipped", 0), totals.get("failed", 0),
+                 totals.get("bytes_read", 0) >> 20,
+                 totals.get("bytes_written", 0) >> 20))
+    for latency in run["latencies"]:
+        log.info("latency {kind} {spec}: {count} jobs, p50 {p50:.2f}s,"
+                 " p90 {p90:.2f}s, p99 {p99:.2f}s".format(
+                     count=latency["count"], p50=latency["p50"],
+                     p90=latency["p90"], p99=latency["p99"],
+                     **latency["labels"]))
@@ -0,0 +1,225 @@
+"""
+perceptual hashes and near duplicate clusters (bursts, re-exports)
+
+dhash: 64 bit difference hash of a 9x8 grey thumbnail, taken from the
+small derivative the conversion already wrote (JPEG draft mode decodes
+it at 1/8 scale), never from the full size source
+
+hash_index finds every pair of hashes within a Hamming distance: the
+64 bits are cut into max_dist + 1 bands, two hashes that close agree on
+at least one whole band, so only hashes sharing a band value are
+compared; with numpy a block at a time with vectorized xor + popcount,
+without it one pair at a time (a BK-tree was tried for this: at 64 bits
+and distance 6 a search visits most of the tree, far slower)
+near pairs are joined into clusters (union-find)
+
+needs PIL/Pillow to hash, numpy is optional
+"""
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HASH_BITS = 64
+#distance up to which two images count as near duplicates
+DEFAULT_DISTANCE = 6
+DEFAULT_THREADS = 4
+#rows compared at once within a band bucket (numpy), bounds memory
+BLOCK = 256
+if numpy is not None:
+    POPCOUNT = numpy.array([bin(i).count("1") for i in range(256)],
+                           dtype=numpy.uint8)
+
+
+def dhash_image(img):
+    """
+    difference hash of a PIL image: is each pixel of a 9x8 grey
+    thumbnail brighter than its right neighbour
+    """
+    small = img.convert("L").resize((9, 8), Image.ANTIALIAS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+
+def dhash_file(path):
+    """
+    difference hash of an image file, None if it can not be read (or
+    there is no PIL)
+    """
+    if Image is None:
+        return None
+    try:
+        img = Image.open(path)
+        #JPEG: decode at the smallest DCT scale still above 9x8
+        img.draft("L", (64, 64))
+        return dhash_image(img)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def hash_files(paths, n_threads=DEFAULT_THREADS):
+    """
+    [dhash or None] for paths, on a pool of threads (PIL decodes with
+    the GIL released)
+    """
+    if not paths:
+        return []
+    pool = ThreadPool(max(1, n_threads))
+    try:
+        return pool.map(dhash_file, paths)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def to_signed(value):
+    """
+    64 bit hash as a signed int (sqlite INTEGER), and back with
+    to_unsigned
+    """
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(max_dist):
+    """
+    (shift, mask) of max_dist + 1 bands covering all bits
+    """
+    count = min(HASH_BITS, max_dist + 1)
+    bands = []
+    start = 0
+    for i in range(count):
+        width = (HASH_BITS - start) // (count - i)
+        bands.append((start, (1 << width) - 1))
+        start += width
+    return bands
+
+
+class hash_index(object):
+    """
+    near neighbour search over a list of 64 bit hashes, see module doc
+
+    items are the positions of the hashes in the list
+    """
+    def __init__(self, hashes):
+        self.hashes = [to_unsigned(h) for h in hashes]
+
+    def pairs(self, max_dist=DEFAULT_DISTANCE):
+        """
+        set of (i, j), i < j, of hashes within max_dist of each other
+        """
+        if numpy is not None:
+            return self._pairs_numpy(max_dist)
+        hashes = self.hashes
+        found = set()
+        for shift, mask in _bands(max_dist):
+            buckets = {}
+            for i, value in enumerate(hashes):
+                buckets.setdefault((value >> shift) & mask, []).append(i)
+            for members in buckets.itervalues():
+                for pos, i in enumerate(members):
+                    value = hashes[i]
+                    for j in members[pos + 1:]:
+                        if bin(value ^ hashes[j]).count("1") <= max_dist:
+                            found.add((i, j))
+        return found
+
+    def _pairs_numpy(self, max_dist):
+        values = numpy.array(self.hashes, dtype=numpy.uint64)
+        found = set()
+        for shift, mask in _bands(max_dist):
+            keys = (values >> numpy.uint64(shift)) & numpy.uint64(mask)
+            order = numpy.argsort(keys, kind="mergesort")
+            bounds = numpy.flatnonzero(numpy.diff(keys[order])) + 1
+            starts = numpy.concatenate(([0], bounds))
+            ends = numpy.concatenate((bounds, [len(order)]))
+            for start, end in zip(starts, ends):
+                if end - start > 1:
+                    found.update(self._near(values, order[start:end],
+                                            max_dist))
+        return found
+
+    def _near(self, values, members, max_dist):
+        """
+        pairs within max_dist among members (one band bucket)
+        """
+        members = numpy.sort(members)
+        member_values = values[members]
+        for lo in range(0, len(members), BLOCK):
+            block = member_values[lo:lo + BLOCK]
+            xor = block[:, None] ^ member_values[None, :]
+            dist = POPCOUNT[xor.view(numpy.uint8)].reshape(
+                xor.shape + (8,)).sum(axis=-1)
+            rows, cols = numpy.nonzero(dist <= max_dist)
+            for row, col in zip(rows + lo, cols):
+                if row < col:
+                    yield (int(members[row]), int(members[col]))
+
+    def query(self, value, max_dist=DEFAULT_DISTANCE):
+        """
+        positions of the hashes within max_dist of value
+        """
+        value = to_unsigned(value)
+        if numpy is not None:
+            values = numpy.array(self.hashes, dtype=numpy.uint64)
+            xor = values ^ numpy.uint64(value)
+            dist = POPCOUNT[xor.view(numpy.uint8)].reshape(-1, 8).sum(1)
+            return [int(i) for i in numpy.flatnonzero(dist <= max_dist)]
+        return [i for i, other in enumerate(self.hashes)
+                if distance(value, other) <= max_dist]
+
+    def clusters(self, max_dist=DEFAULT_DISTANCE):
+        """
+        lists of positions whose hashes are chained within max_dist,
+        largest cluster first, singles left out
+        """
+        parent = range(len(self.hashes))
+
+        def root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in self.pairs(max_dist):
+            a, b = root(i), root(j)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+        groups = {}
+        for i in range(len(self.hashes)):
+            groups.setdefault(root(i), []).append(i)
+        return sorted((group for group in groups.values() if len(group) > 1),
+                      key=lambda group: (-len(group), group[0]))
+
+
+def report(log, paths, clusters):
+    """
+    log near duplicate clusters (lists of positions in paths)
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    for group in clusters:
+        log.info("near duplicates: {}".format(
+            " ".join(paths[i] for i in group)))
+    log.info("near duplicates: {} clusters, {} images".format(
+        len(clusters), sum(len(group) for group in clusters)))
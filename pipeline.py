@@ -0,0 +1,129 @@
+"""
+generator stages connected by bounded queues
+
+stage(gen) runs a generator on its own thread and hands its items on
+through a bounded queue: when the consumer falls behind the producer
+blocks (backpressure), so memory stays flat however many files a card
+holds, and the consumer starts with the first item instead of waiting
+for the whole list
+
+    records = stage(scan(...))                         # thread 1
+    files = stage(select(records), inputs=[records])   # thread 2
+    jobs = stage(plan(files), inputs=[files])          # thread 3
+    try:
+        run_jobs(jobs)                # this thread, feeding the pool
+    finally:
+        jobs.close()                  # and the stages before it
+
+a stage is not cleaned up when it is dropped (its thread holds on to
+it), whoever reads it closes it, an exception on the way included
+"""
+
+import Queue
+import sys
+import threading
+
+DEFAULT_QUEUE = 256
+#how often blocked threads and the consumer look up (seconds)
+POLL = 0.2
+_ITEM, _DONE, _FAILED = range(3)
+
+
+class stage(object):
+    """
+    iterate gen on a thread, consume it from here
+
+    an exception in gen is raised from the consumer side; closing the
+    stage stops the thread at its next item
+
+    inputs: the stages gen reads from, closed along with this one
+    """
+    def __init__(self, gen, maxsize=DEFAULT_QUEUE, name="stage",
+                 inputs=()):
+        self.inputs = list(inputs)
+        self.queue = Queue.Queue(maxsize)
+        self.stop = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._run, args=(gen,),
+                                       name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=POLL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self, gen):
+        try:
+            for item in gen:
+                if not self._put((_ITEM, item)):
+                    return
+        except Exception:
+            self._put((_FAILED, sys.exc_info()))
+            return
+        finally:
+            if hasattr(gen, "close"):
+                gen.close()
+        self._put((_DONE, None))
+
+    def _unpack(self, kind, item):
+        if _FAILED == kind:
+            self.finished = True
+            raise item[0], item[1], item[2]
+        if _DONE == kind:
+            self.finished = True
+            raise StopIteration
+        return item
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.finished:
+            raise StopIteration
+        while True:
+            try:
+                #a timeout keeps the wait interruptible by Ctrl-C
+                kind, item = self.queue.get(timeout=POLL)
+            except Queue.Empty:
+                #closed from another thread: a stage reading this one
+                #  ends too, instead of waiting for items never to come
+                if self.stop.is_set():
+                    raise StopIteration
+                continue
+            return self._unpack(kind, item)
+
+    def take(self, n):
+        """
+        wait for one item, then add whatever else is ready, up to n
+
+        lets a consumer batch work without stalling on a slow producer
+        """
+        items = [self.next()]
+        while len(items) < n and not self.finished:
+            try:
+                kind, item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                items.append(self._unpack(kind, item))
+            except StopIteration:
+                break
+        return items
+
+    def ready(self):
+        """
+        about how many items are waiting to be taken, right now
+        """
+        return self.queue.qsize()
+
+    def close(self):
+        self.stop.set()
+        self.finished = True
+        for one in self.inputs:
+            one.close()
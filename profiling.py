@@ -0,0 +1,157 @@
+"""
+--profile: where a slow run spends its time
+
+    stages  cProfile of each stage (ingest: setup, preconv, conv;
+            cropresize: prep, conv); a stage made of generator
+            threads (pipeline.stage) gets a profile per thread, merged
+    tools   wall, user and sys seconds of every external tool run (gm
+            units, ffmpeg), fed through metrics.run_metrics.tool
+    jobs    the slowest jobs (file and spec) and the time per spec
+
+at the end the top entries of each are logged and the stage profiles
+are dumped as pstats files (python -m pstats FILE) next to each other:
+<prefix>.<stage>.pstats
+"""
+
+import contextlib
+import cProfile
+import heapq
+import logging
+import pstats
+import StringIO
+import threading
+
+PROFILE_NAME = ".photo_work_profile"
+DEFAULT_TOP = 20
+
+
+class run_profile(object):
+    """
+    stage profiles, tool runs and job times of one run
+
+    top: entries kept for and shown in each top list
+    """
+    def __init__(self, top=DEFAULT_TOP):
+        self.top = top
+        self.lock = threading.Lock()
+        #stage name -> pstats.Stats, in the order they started
+        self.stats = {}
+        self.order = []
+        #(seconds, kind, spec, infile) heap of the slowest jobs
+        self.slowest = []
+        #(kind, spec) -> [jobs, seconds]
+        self.specs = {}
+        #tool -> [runs, wall, user, system]
+        self.tools = {}
+        #(wall, tool, label, user, system) heap of the slowest runs
+        self.slow_runs = []
+
+    def add(self, name, profile):
+        """
+        merge a finished cProfile.Profile into stage name
+        """
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            return  # nothing ran under it
+        with self.lock:
+            if name in self.stats:
+                self.stats[name].add(stats)
+            else:
+                self.stats[name] = stats
+                self.order.append(name)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        profile the with block (this thread only) as stage name
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.add(name, profile)
+
+    def thread_stage(self, name, gen):
+        """
+        iterate gen under a profile of the thread iterating it (a
+        pipeline.stage thread), merged into stage name
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            for item in gen:
+                yield item
+        finally:
+            profile.disable()
+            self.add(name, profile)
+
+    def job(self, kind, spec, infile, seconds):
+        with self.lock:
+            entry = self.specs.setdefault((kind, spec), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            _keep(self.slowest, (seconds, kind, spec, infile), self.top)
+
+    def tool(self, name, wall, user, system, label=None):
+        with self.lock:
+            entry = self.tools.setdefault(name, [0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += user
+            entry[3] += system
+            _keep(self.slow_runs, (wall, name, label, user, system),
+                  self.top)
+
+    def report(self, log=None):
+        """
+        log the top lists and each stage's costliest functions
+        """
+        if log is None:
+            log = logging.getLogger("base")
+        for name, (runs, wall, user, system) in sorted(self.tools.items()):
+            log.info("profile tool {}: {} runs, {:.1f}s wall, {:.1f}s user,"
+                     " {:.1f}s sys".format(name, runs, wall, user, system))
+        for wall, name, label, user, system in sorted(self.slow_runs,
+                                                      reverse=True):
+            log.info("profile slow {}: {:.2f}s wall, {:.2f}s user, {:.2f}s"
+                     " sys  {}".format(name, wall, user, system, label))
+        for (kind, spec), (jobs, seconds) in sorted(
+                self.specs.items(), key=lambda item: -item[1][1]):
+            log.info("profile spec {} {}: {} jobs, {:.1f}s, {:.3f}s per"
+                     " job".format(kind, spec, jobs, seconds,
+                                   seconds / jobs))
+        for seconds, kind, spec, infile in sorted(self.slowest,
+                                                  reverse=True):
+            log.info("profile slow job: {:.2f}s {} {}  {}".format(
+                seconds, kind, spec, infile))
+        for name in self.order:
+            out = StringIO.StringIO()
+            stats = self.stats[name]
+            stats.stream = out
+            stats.sort_stats("cumulative").print_stats(self.top)
+            log.info("profile stage {}:\n{}".format(name,
+                                                    out.getvalue().strip()))
+
+    def dump(self, prefix):
+        """
+        write each stage's pstats file, return their paths
+        """
+        paths = []
+        for name in self.order:
+            path = "{}.{}.pstats".format(prefix, name)
+            self.stats[name].dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+def _keep(heap, entry, size):
+    """
+    keep the size largest entries in a min heap
+    """
+    if len(heap) < size:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
@@ -0,0 +1,223 @@
+"""
+throughput and ETA of a run, per stage (img, vid) and job spec
+
+jobs are counted as they are planned (total) and as they finish; a
+reporter thread looks at the counts at a fixed rate, so the cost per
+file is a couple of additions under a lock, whatever the refresh rate:
+    tty     one status line on stdout, rewritten in place every
+            TTY_INTERVAL seconds: per stage done/total, files/s, MB/s
+            and ETA
+    log     one log line per active spec every LOG_INTERVAL seconds,
+            when stdout is not a terminal or per file lines are on (-v)
+-q turns it off (for_verbosity)
+
+rates are over the time since a stage's first job was planned, and only
+shown once jobs have finished RATE_SPAN or more apart: a batch of image
+jobs, or a run of skips, finishes many at one time, which says nothing
+about the rate yet; the ETA is only given once planning is complete (a
+stream of jobs has no total before that)
+"""
+
+import logging
+import sys
+import threading
+import time
+
+TTY_INTERVAL = 0.5
+LOG_INTERVAL = 10.0
+#finishes at least this far apart (seconds) before a rate is shown
+RATE_SPAN = 0.5
+
+
+def _eta(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return "{}:{:02d}:{:02d}".format(seconds // 3600,
+                                         seconds // 60 % 60, seconds % 60)
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+class _task(object):
+    """
+    counts of one stage or spec
+
+    start: when its first job was planned (or finished, if none was)
+    first, last: when its first and latest jobs finished
+    """
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+        self.bytes = 0
+        self.start = None
+        self.first = None
+        self.last = None
+
+    def plan(self, now):
+        if self.start is None:
+            self.start = now
+        self.total += 1
+
+    def finish(self, now, size=0):
+        if self.start is None:
+            self.start = now
+        if self.first is None:
+            self.first = now
+        self.done += 1
+        self.bytes += size
+        self.last = now
+
+    def rates(self, now, planned):
+        """
+        (files/s, MB/s, ETA seconds), each None while not known
+        """
+        if self.first is None or self.last - self.first < RATE_SPAN:
+            return None, None, None
+        if planned and self.done >= self.total:
+            now = self.last  # finished, keep its rate
+        seconds = max(now - self.start, 1e-3)
+        files = self.done / seconds
+        mb = self.bytes / seconds / (1 << 20)
+        eta = None
+        if planned and files > 0:
+            eta = max(0, self.total - self.done) / files
+        return files, mb, eta
+
+    def line(self, now, planned):
+        files, mb, eta = self.rates(now, planned)
+        total = self.total if planned else "{}+".format(self.total)
+        if files is None:
+            return "{}/{} files, ? files/s, ? MB/s, ETA ?".format(
+                self.done, total)
+        return "{}/{} files, {:.1f} files/s, {:.1f} MB/s, ETA {}".format(
+            self.done, total, files, mb, _eta(eta))
+
+
+class progress_reporter(object):
+    """
+    see module doc; start() the thread, stop() it at the end of the run
+
+    tty: rewrite a status line on stream instead of logging, default:
+        whether stream is a terminal
+    """
+    def __init__(self, log=None, stream=None, tty=None, interval=None):
+        if log is None:
+            log = logging.getLogger("base")
+        if stream is None:
+            stream = sys.stdout
+        if tty is None:
+            tty = hasattr(stream, "isatty") and stream.isatty()
+        if interval is None:
+            interval = TTY_INTERVAL if tty else LOG_INTERVAL
+        self.log = log
+        self.stream = stream
+        self.tty = tty
+        self.interval = interval
+        self.lock = threading.Lock()
+        #stage -> _task, (stage, spec) -> _task, in first seen order
+        self.stages = {}
+        self.specs = {}
+        self.order = []
+        #stages whose planning is complete
+        self.planned_all = set()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.width = 0
+
+    def _tasks(self, stage, spec):
+        if stage not in self.stages:
+            self.stages[stage] = _task()
+        if (stage, spec) not in self.specs:
+            self.specs[(stage, spec)] = _task()
+            self.order.append((stage, spec))
+        return self.stages[stage], self.specs[(stage, spec)]
+
+    def planned(self, stage, spec):
+        """
+        one more job of stage and spec
+        """
+        now = time.time()
+        with self.lock:
+            for task in self._tasks(stage, spec):
+                task.plan(now)
+
+    def planning_done(self, stage):
+        """
+        every job of stage is planned, totals are final
+        """
+        with self.lock:
+            self.planned_all.add(stage)
+
+    def finished(self, stage, spec, size=0):
+        """
+        a job of stage and spec finished (any outcome), size: bytes read
+        """
+        now = time.time()
+        with self.lock:
+            for task in self._tasks(stage, spec):
+                task.finish(now, size)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="progress")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        stop the thread, leave a final line
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.show(final=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.show()
+
+    def show(self, final=False):
+        now = time.time()
+        with self.lock:
+            if self.tty:
+                parts = ["{} {}".format(stage, task.line(
+                    task.last if final else now,
+                    stage in self.planned_all))
+                    for stage, task in sorted(self.stages.items())
+                    if task.done or task.total]
+                lines = None
+            else:
+                lines = ["progress {} {}: {}".format(
+                    stage, spec, self.specs[(stage, spec)].line(
+                        self.specs[(stage, spec)].last if final else now,
+                        stage in self.planned_all))
+                    for stage, spec in self.order
+                    if final or self.specs[(stage, spec)].done <
+                    self.specs[(stage, spec)].total or
+                    stage not in self.planned_all]
+        if lines is not None:
+            for line in lines:
+                self.log.info(line)
+            return
+        text = " | ".join(parts)
+        #pad over what is left of a longer previous line
+        self.stream.write("\r" + text.ljust(self.width) +
+                          ("\n" if final and text else ""))
+        self.stream.flush()
+        self.width = 0 if final else len(text)
+
+
+def for_verbosity(verb_level, log=None):
+    """
+    a reporter for the -v/-q level (+1 per -q, -1 per -v), None when
+    quiet; log lines rather than a status line when per file lines are
+    shown
+    """
+    if verb_level > 0:
+        return None
+    if verb_level < 0:
+        return progress_reporter(log, tty=False)
+    return progress_reporter(log)
@@ -0,0 +1,350 @@
+"""
+persistent scan index of a dated set (base dir)
+
+sqlite file (in the set's state dir, see statedir) recording, for every
+entry found below the base dir: path (relative to the base), parent dir,
+size, mtime and file class
+
+rescans list only directories whose mtime changed since they were last
+listed (an entry was added, removed or renamed); unchanged directories
+are answered from the index, and files with the same size and mtime
+keep their recorded class instead of being classified again
+
+it also keeps per file probe results (ffprobe, see vidconv.probe),
+perceptual hashes (phash) and exiftool metadata (metadata) on the same
+size and mtime terms
+
+directory checks and listings run on threads (scanner.walk), the
+sqlite connection stays with the calling thread
+
+a read only index (dry runs) works on an in memory copy of the file,
+nothing it learns is written back
+"""
+
+import json
+import os
+import sqlite3
+
+import scanner
+
+INDEX_NAME = ".photo_work_index.sqlite"
+SCHEMA_VERSION = 1
+#commit every so many listed dirs, so an interrupted scan keeps its work
+COMMIT_EVERY = 200
+
+
+def index_path(state_dir):
+    return os.path.join(state_dir, INDEX_NAME)
+
+
+class scan_index(object):
+    """
+    sqlite backed record of a base dir, see module doc
+
+    path: the sqlite file, in the set's state dir (index_path of
+        statedir.state_dir), not in the base dir
+    """
+    def __init__(self, basedir, path, read_only=False):
+        self.basedir = basedir
+        self.path = path
+        if read_only:
+            self.db = sqlite3.connect(":memory:")
+            self.db.text_factory = str
+            if os.path.exists(path):
+                disk = sqlite3.connect(path)
+                disk.text_factory = str
+                self.db.executescript("\n".join(disk.iterdump()))
+                disk.close()
+        else:
+            self.db = sqlite3.connect(path)
+            self.db.text_factory = str
+            #keep the journal file around rather than creating and
+            #  deleting it on every commit: should --state-dir put the
+            #  index below a scanned dir, that dir's mtime stays put
+            self.db.execute("PRAGMA journal_mode = PERSIST")
+        self.setup_tables()
+        self.stats = {"dirs_listed": 0, "dirs_skipped": 0,
+                      "files_classified": 0}
+
+    def setup_tables(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            #older layout, start over
+            self.db.execute("DROP TABLE IF EXISTS dirs")
+            self.db.execute("DROP TABLE IF EXISTS entries")
+        self.db.execute("CREATE TABLE IF NOT EXISTS dirs ("
+                        " path TEXT PRIMARY KEY, mtime REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        " path TEXT PRIMARY KEY, dir TEXT,"
+                        " is_dir INTEGER, size INTEGER, mtime REAL,"
+                        " class TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_dir"
+                        " ON entries (dir)")
+        #ffprobe results, good while size and mtime match
+        self.db.execute("CREATE TABLE IF NOT EXISTS probes ("
+                        " path TEXT PRIMARY KEY, size INTEGER, mtime REAL,"
+                        " info TEXT)")
+        #perceptual hashes of derivatives, signed 64 bit (phash)
+        self.db.execute("CREATE TABLE IF NOT EXISTS phashes ("
+                        " path TEXT PRIMARY KEY, size INTEGER, mtime REAL,"
+                        " hash INTEGER)")
+        #exiftool metadata, info is a JSON dict (metadata.FIELDS)
+        self.db.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                        " path TEXT PRIMARY KEY, size INTEGER, mtime REAL,"
+                        " info TEXT)")
+        self.db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def _rel(self, path):
+        rel = os.path.relpath(path, self.basedir)
+        return "" if "." == rel else rel
+
+    def _abs(self, rel):
+        return os.path.join(self.basedir, rel) if rel else self.basedir
+
+    def scan(self, tops=None, classify=None, full=False,
+             n_threads=scanner.DEFAULT_THREADS):
+        """
+        generate (path, size, mtime, class) for every file below tops
+
+        tops: dir or list of dirs inside the base dir, default the base
+            dir itself
+        classify: callable(path) -> class, None to leave it unset
+        full: list every directory, ignoring recorded mtimes
+        n_threads: directories are checked and listed on this many
+            threads (scanner.walk), the index is only used from here
+        """
+        if tops is None:
+            tops = [self.basedir]
+        elif isinstance(tops, basestring):
+            tops = [tops]
+        #read only copies for the scan threads
+        dir_mtimes = {}
+        if not full:
+            dir_mtimes = dict(self.db.execute("SELECT path, mtime FROM dirs"))
+        subdirs = {}
+        for rel, parent in self.db.execute(
+                "SELECT path, dir FROM entries WHERE is_dir"):
+            subdirs.setdefault(parent, []).append(rel)
+
+        def visit(path):
+            rel_dir = self._rel(path)
+            try:
+                dir_mtime = os.stat(path).st_mtime
+            except OSError:
+                return (rel_dir, None, None), []
+            if dir_mtimes.get(rel_dir) == dir_mtime:
+                listing = None
+                below = subdirs.get(rel_dir, [])
+            else:
+                listing = self._read_dir(path, rel_dir)
+                below = [rel for rel, is_dir, size, mtime in listing
+                         if is_dir]
+            return (rel_dir, dir_mtime, listing), [self._abs(rel)
+                                                   for rel in below]
+
+        for rel_dir, dir_mtime, listing in scanner.walk(tops, visit,
+                                                        n_threads):
+            if dir_mtime is None:
+                self._forget(rel_dir)
+                continue
+            if listing is None:
+                self.stats["dirs_skipped"] += 1
+                rows = self.db.execute(
+                    "SELECT path, is_dir, size, mtime, class FROM entries"
+                    " WHERE dir = ? AND NOT is_dir", (rel_dir,)).fetchall()
+                if classify is not None:
+                    rows = [self._fill_class(r, classify) for r in rows]
+            else:
+                self.stats["dirs_listed"] += 1
+                rows = self._update_dir(rel_dir, dir_mtime, listing,
+                                        classify)
+            for rel, is_dir, size, mtime, file_class in rows:
+                if not is_dir:
+                    yield (self._abs(rel), size, mtime, file_class)
+        self.db.commit()
+
+    def _fill_class(self, row, classify):
+        """
+        classify a file recorded by a scan without a classifier
+        """
+        rel, is_dir, size, mtime, file_class = row
+        if is_dir or file_class is not None:
+            return row
+        file_class = classify(self._abs(rel))
+        self.stats["files_classified"] += 1
+        self.db.execute("UPDATE entries SET class = ? WHERE path = ?",
+                        (file_class, rel))
+        return (rel, is_dir, size, mtime, file_class)
+
+    def _read_dir(self, path, rel_dir):
+        """
+        [(rel, is_dir, size, mtime)] of a directory, scan thread side
+
+        dirs are typed from the listing (no stat), files cost one stat
+        for size and mtime (see scanner.list_stats)
+        """
+        listing = []
+        for name, is_dir, size, mtime in scanner.list_stats(path):
+            #the index (and its journal) of an older version, which kept
+            #  it in the base dir, or below a scanned dir (--state-dir)
+            if name.startswith(INDEX_NAME):
+                continue
+            rel = os.path.join(rel_dir, name)
+            listing.append((rel, int(is_dir), size, mtime))
+        return listing
+
+    def _update_dir(self, rel_dir, dir_mtime, listing, classify):
+        """
+        record a fresh listing of one directory, return its rows
+        """
+        known = dict((r[0], r) for r in self.db.execute(
+            "SELECT path, is_dir, size, mtime, class FROM entries"
+            " WHERE dir = ?", (rel_dir,)))
+        rows = []
+        for rel, is_dir, size, mtime in listing:
+            old = known.get(rel)
+            if old is not None and old[1] and not is_dir:
+                self._forget(rel)  # was a dir, drop what was below it
+                old = None
+            if is_dir:
+                file_class = None
+            elif (old is not None and old[4] is not None and
+                    old[2] == size and old[3] == mtime):
+                file_class = old[4]
+            elif classify is not None:
+                file_class = classify(self._abs(rel))
+                self.stats["files_classified"] += 1
+            else:
+                file_class = None
+            rows.append((rel, is_dir, size, mtime, file_class))
+        seen = set(r[0] for r in rows)
+        for rel in known:
+            if rel not in seen:
+                self._forget(rel)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO entries"
+            " (path, dir, is_dir, size, mtime, class)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(r[0], rel_dir) + r[1:] for r in rows])
+        self.db.execute("INSERT OR REPLACE INTO dirs (path, mtime)"
+                        " VALUES (?, ?)", (rel_dir, dir_mtime))
+        if 0 == self.stats["dirs_listed"] % COMMIT_EVERY:
+            self.db.commit()
+        return rows
+
+    def get_probe(self, path, size, mtime):
+        """
+        recorded probe info (dict) of a file, None if missing or stale
+        """
+        row = self.db.execute("SELECT size, mtime, info FROM probes"
+                              " WHERE path = ?", (self._rel(path),)).fetchone()
+        if row is None or (row[0], row[1]) != (size, mtime):
+            return None
+        return json.loads(row[2])
+
+    def put_probe(self, path, size, mtime, info):
+        self.db.execute("INSERT OR REPLACE INTO probes"
+                        " (path, size, mtime, info) VALUES (?, ?, ?, ?)",
+                        (self._rel(path), size, mtime, json.dumps(info)))
+
+    def get_phashes(self):
+        """
+        {path: (size, mtime, hash)} of all recorded perceptual hashes,
+        one query for a whole set
+        """
+        return dict((self._abs(rel), (size, mtime, value))
+                    for rel, size, mtime, value in self.db.execute(
+                        "SELECT path, size, mtime, hash FROM phashes"))
+
+    def put_phashes(self, rows):
+        """
+        record perceptual hashes, rows: (path, size, mtime, signed hash)
+        """
+        self.db.executemany("INSERT OR REPLACE INTO phashes"
+                            " (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                            [(self._rel(path), size, mtime, value)
+                             for path, size, mtime, value in rows])
+        self.db.commit()
+
+    def get_metadata(self):
+        """
+        {path: (size, mtime, info)} of all recorded metadata
+        """
+        return dict((self._abs(rel), (size, mtime, json.loads(info)))
+                    for rel, size, mtime, info in self.db.execute(
+                        "SELECT path, size, mtime, info FROM metadata"))
+
+    def put_metadata(self, rows):
+        """
+        record metadata, rows: (path, size, mtime, info)
+        """
+        self.db.executemany("INSERT OR REPLACE INTO metadata"
+                            " (path, size, mtime, info) VALUES (?, ?, ?, ?)",
+                            [(self._rel(path), size, mtime, json.dumps(info))
+                             for path, size, mtime, info in rows])
+        self.db.commit()
+
+    def _forget(self, rel):
+        """
+        drop an entry and, for a dir, everything recorded below it
+        """
+        #"/" sorts just before "0", so this range is everything in rel/
+        lo, hi = rel + "/", rel + "0"
+        for table in ("entries", "dirs", "probes", "phashes",
+                      "metadata"):
+            self.db.execute("DELETE FROM {} WHERE path = ?"
+                            " OR (path >= ? AND path < ?)".format(table),
+                            (rel, lo, hi))
+
+
+class index_set(object):
+    """
+    the scan indexes of several sets as one, for the per file records
+    (probes, metadata): each path goes to the index of the set it lies
+    in; for a scan, use the set's own index (of)
+
+    indexes: {base dir: scan_index}
+    """
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def of(self, basedir):
+        return self.indexes[basedir]
+
+    def _for(self, path):
+        return self.indexes.get(scanner.owner(path, self.indexes))
+
+    def get_probe(self, path, size, mtime):
+        index = self._for(path)
+        if index is None:
+            return None
+        return index.get_probe(path, size, mtime)
+
+    def put_probe(self, path, size, mtime, info):
+        index = self._for(path)
+        if index is not None:
+            index.put_probe(path, size, mtime, info)
+
+    def get_metadata(self):
+        found = {}
+        for index in self.indexes.values():
+            found.update(index.get_metadata())
+        return found
+
+    def put_metadata(self, rows):
+        by_set = {}
+        for row in rows:
+            by_set.setdefault(scanner.owner(row[0], self.indexes),
+                              []).append(row)
+        for basedir, set_rows in by_set.items():
+            if basedir is not None:
+                self.indexes[basedir].put_metadata(set_rows)
+
+    def close(self):
+        for index in self.indexes.values():
+            index.close()
@@ -0,0 +1,252 @@
+"""
+directory scanning without a stat per entry
+
+scandir (os.scandir in python 3.5+, or the scandir package on python 2)
+reports the type of each entry from the directory listing itself
+(d_type), so telling files from dirs costs no extra syscall; without it
+this falls back to listdir + an lstat per entry, which is what os.walk
+costs, so on python 2 the saving needs the scandir package installed
+
+list_stats() also wants size and mtime: one stat per file either way
+(scandir: entry.stat(), fallback: the lstat that typed the entry), dirs
+are never stat-ed
+
+walk() lists directories on a pool of threads and hands each listing to
+the caller as soon as it is made, so classifying (or whatever the caller
+does) starts with the first directory instead of after the whole tree
+"""
+
+import logging
+import os
+import Queue
+import stat
+import sys
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+DEFAULT_THREADS = 8
+#listings waiting for the caller, bounds memory if it is slow
+QUEUE_SIZE = 256
+#how often blocked threads and the caller look up (seconds)
+POLL = 0.2
+#kinds of items passed from the threads to the caller
+_RESULT, _DONE, _FAILED = range(3)
+
+
+def list_entries(path):
+    """
+    [(name, is_dir)] for a directory
+
+    symlinks to dirs are left out and not followed, like os.walk; only
+    symlinks cost a stat (to see where they point)
+    """
+    found = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                found.append((entry.name, True))
+            elif entry.is_symlink() and entry.is_dir():
+                continue
+            else:
+                found.append((entry.name, False))
+        return found
+    for name in os.listdir(path):
+        try:
+            mode = os.lstat(os.path.join(path, name)).st_mode
+            if stat.S_ISLNK(mode):
+                if os.path.isdir(os.path.join(path, name)):
+                    continue
+                found.append((name, False))
+            else:
+                found.append((name, stat.S_ISDIR(mode)))
+        except OSError:
+            continue
+    return found
+
+
+def list_stats(path):
+    """
+    [(name, is_dir, size, mtime)] for a directory, size 0 and mtime None
+    for dirs
+
+    symlinks as list_entries, a symlink to a file gets the size and
+    mtime of the file
+    """
+    found = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                found.append((entry.name, True, 0, None))
+                continue
+            try:
+                if entry.is_symlink() and entry.is_dir():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            found.append((entry.name, False, st.st_size, st.st_mtime))
+        return found
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        try:
+            st = os.lstat(entry_path)
+            if stat.S_ISLNK(st.st_mode):
+                st = os.stat(entry_path)
+                if stat.S_ISDIR(st.st_mode):
+                    continue
+            elif stat.S_ISDIR(st.st_mode):
+                found.append((name, True, 0, None))
+                continue
+        except OSError:
+            continue
+        found.append((name, False, st.st_size, st.st_mtime))
+    return found
+
+
+def list_dir(path):
+    """
+    (files, subdirs) of a directory, as full paths
+    """
+    files = []
+    dirs = []
+    for name, is_dir in list_entries(path):
+        if is_dir:
+            dirs.append(os.path.join(path, name))
+        else:
+            files.append(os.path.join(path, name))
+    return files, dirs
+
+
+def outermost(tops):
+    """
+    drop dirs that are inside another dir of the list (and repeats)
+    """
+    keyed = sorted((os.path.abspath(top), top) for top in tops)
+    kept = []
+    for abs_top, top in keyed:
+        if kept:
+            prev = kept[-1][0]
+            if abs_top == prev or abs_top.startswith(prev.rstrip(os.sep) +
+                                                     os.sep):
+                continue
+        kept.append((abs_top, top))
+    return [top for abs_top, top in kept]
+
+
+def owner(path, tops):
+    """
+    the dir of tops path lies in (the innermost one), None if none; by
+    name, path and tops as given
+    """
+    found = None
+    for top in tops:
+        if (path.startswith(os.path.join(top, "")) and
+                (found is None or len(top) > len(found))):
+            found = top
+    return found
+
+
+def _visit_files(path):
+    files, dirs = list_dir(path)
+    return (files or None), dirs
+
+
+def walk(tops, visit=None, n_threads=DEFAULT_THREADS):
+    """
+    generate visit results for every dir below tops, made on threads
+
+    visit(path) -> (result, subdirs), result None to yield nothing;
+        default: (list of file paths, subdirs)
+
+    results come in whatever order the threads finish; an OSError from
+    visit is logged and the dir skipped, anything else is raised here
+    """
+    log = logging.getLogger("base")
+    if visit is None:
+        visit = _visit_files
+    tops = outermost(tops)
+    if not tops:
+        return
+    todo = Queue.Queue()
+    done = Queue.Queue(QUEUE_SIZE)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [len(tops)]
+    for top in tops:
+        todo.put(top)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                done.put(item, timeout=POLL)
+                return
+            except Queue.Full:
+                pass
+
+    def work():
+        while not stop.is_set():
+            try:
+                path = todo.get(timeout=POLL)
+            except Queue.Empty:
+                continue
+            if path is None:
+                return
+            try:
+                result, subdirs = visit(path)
+            except OSError, e:
+                log.warn("cannot scan {}: {}".format(path, e))
+                result, subdirs = None, []
+            except Exception:
+                put((_FAILED, sys.exc_info()))
+                return
+            with lock:
+                pending[0] += len(subdirs)
+            for subdir in subdirs:
+                todo.put(subdir)
+            if result is not None:
+                put((_RESULT, result))
+            with lock:
+                pending[0] -= 1
+                last = 0 == pending[0]
+            if last:
+                put((_DONE, None))
+
+    threads = [threading.Thread(target=work, name="scan-{}".format(i))
+               for i in range(max(1, n_threads))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            try:
+                #a timeout keeps the wait interruptible by Ctrl-C
+                kind, item = done.get(timeout=POLL)
+            except Queue.Empty:
+                continue
+            if _DONE == kind:
+                break
+            if _FAILED == kind:
+                raise item[0], item[1], item[2]
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            todo.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def scan_files(tops, n_threads=DEFAULT_THREADS):
+    """
+    generate the path of every file below tops, see walk
+    """
+    for files in walk(tops, n_threads=n_threads):
+        for file_path in files:
+            yield file_path
@@ -0,0 +1,39 @@
+"""
+where the working state of a set is kept: scan index, job journal, run
+report and profile
+
+not in the media dir itself, which is left holding media (and the
+derivatives) only: each set dir gets a state dir of its own, named
+after the set and a hash of its absolute path so sets of the same name
+in different places do not share one,
+    <root>/<set dir name>-<hash>/
+root is DEFAULT_ROOT unless given (--state-dir)
+"""
+
+import errno
+import hashlib
+import os
+
+DEFAULT_ROOT = os.path.join("~", ".cache", "photo_work", "sets")
+#hex digits of the path hash in the dir name
+HASH_LEN = 12
+
+
+def state_dir(basedir, root=None, create=True):
+    """
+    state dir of the set dir basedir, below root (None: DEFAULT_ROOT)
+
+    create: make it if it is not there (not for dry runs)
+    """
+    path = os.path.abspath(basedir)
+    name = os.path.basename(path) or "root"
+    digest = hashlib.sha256(path).hexdigest()[:HASH_LEN]
+    state = os.path.join(os.path.expanduser(root or DEFAULT_ROOT),
+                         "{}-{}".format(name, digest))
+    if create:
+        try:
+            os.makedirs(state)
+        except OSError, e:
+            if errno.EEXIST != e.errno:
+                raise
+    return state
@@ -0,0 +1,5 @@
+"""
+unit tests of the pure pieces, no gm, ffmpeg or media needed
+
+    python -m unittest discover -s tests -t .
+"""
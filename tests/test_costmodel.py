@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import costmodel
+import imgconv
+import vidconv
+from tests.test_imgconv import jpeg_head
+from tests.test_vidconv import SPEC, clip, fake_probes
+
+
+class calibrate_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.path = os.path.join(self.dir, "cache", "costs.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_scale(self):
+        model = costmodel.cost_model(None)
+        #half way there (geometrically) per run
+        model.calibrate("img", 10.0, 40.0)
+        self.assertAlmostEqual(model.scale["img"], 2.0)
+        model.calibrate("img", 20.0, 80.0)
+        self.assertAlmostEqual(model.scale["img"], 4.0)
+        #nothing learned from a run without work
+        model.calibrate("vid", 0.0, 5.0)
+        model.calibrate("vid", 5.0, 0.0)
+        self.assertEqual(model.scale["vid"], 1.0)
+
+    def test_save(self):
+        model = costmodel.cost_model(self.path)
+        model.calibrate("vid", 1.0, 9.0)
+        model.save()
+        self.assertAlmostEqual(costmodel.cost_model(self.path).scale["vid"],
+                               3.0)
+        self.assertEqual(costmodel.cost_model(self.path).scale["img"], 1.0)
+
+    def test_unreadable(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as fh:
+            fh.write("{not json")
+        self.assertEqual(costmodel.cost_model(self.path).scale,
+                         {"img": 1.0, "vid": 1.0})
+        costmodel.cost_model(None).save()
+
+
+class images_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.infile = os.path.join(self.dir, "IMG_1.JPG")
+        with open(self.infile, "wb") as fh:
+            fh.write(jpeg_head(4000, 3000))
+        self.jobs = [imgconv.make_job(self.infile, os.path.join(
+            self.dir, name, "IMG_1.jpg"), {"name": name, "resizedims": dims})
+            for name, dims in (("sm", "800x600"), ("th", "100x100"))]
+        self.model = costmodel.cost_model(None)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_single_decode(self):
+        total = self.model.images(self.jobs, 4, 1, True)
+        #one decode at the size the largest output needs, no gm spawns
+        self.assertAlmostEqual(total["cpu"],
+                               self.model.img_cpu(1000 * 750, 2, 0))
+        self.assertAlmostEqual(total["wall"], total["cpu"] / 2)
+        self.assertEqual(total["bytes"],
+                         int((800 * 600 + 100 * 75) *
+                             costmodel.JPEG_BYTES_PX))
+        self.assertEqual(total["src_bytes"], os.path.getsize(self.infile))
+
+    def test_per_job(self):
+        total = self.model.images(self.jobs, 4, 1, False)
+        self.assertAlmostEqual(total["cpu"], self.model.img_cpu(
+            1000 * 750 + 500 * 375, 2, 2))
+        total = self.model.images(self.jobs, 1, 10, False)
+        self.assertAlmostEqual(total["cpu"], self.model.img_cpu(
+            1000 * 750 + 500 * 375, 2, 1))
+        self.assertAlmostEqual(total["wall"], total["cpu"])
+
+    def test_scaled(self):
+        estimate = self.model.images(self.jobs, 1, 1, False)["cpu"]
+        self.model.calibrate("img", estimate, 4 * estimate)
+        self.assertAlmostEqual(self.model.images(self.jobs, 1, 1,
+                                                 False)["cpu"],
+                               2 * estimate)
+
+
+class videos_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.outdir = os.path.join(self.dir, "vid-sm")
+        os.mkdir(self.outdir)
+        self.info = {}
+        self.model = costmodel.cost_model(None)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def jobs(self, name, **facts):
+        infile = os.path.join(self.dir, name)
+        with open(infile, "wb") as fh:
+            fh.write("\x00" * 1000)
+        self.info[infile] = clip(**facts)
+        return vidconv.make_jobs(infile, self.outdir, SPEC)
+
+    def hd(self, seconds):
+        return dict(width=1920, height=1080, bitrate=8e6, vcodec="h264",
+                    acodec="ac3", duration=seconds, fps=25.0)
+
+    def test_transcode(self):
+        jobs = self.jobs("a.mts", **self.hd(10.0))
+        total = self.model.videos(jobs, 2, 0, fake_probes(self.info))
+        frames = 10.0 * 25.0
+        cpu = frames * (costmodel.VID_ENCODE_MPX["draft"] * 0.2304 +
+                        costmodel.VID_DECODE_MPX * 1920 * 1080 / 1e6)
+        self.assertEqual(total["jobs"], 1)
+        self.assertAlmostEqual(total["cpu"], cpu)
+        self.assertAlmostEqual(total["wall"], cpu / 2)
+        #one encode uses ENCODE_THREADS at most
+        total = self.model.videos(jobs, 16, 0, fake_probes(self.info))
+        self.assertAlmostEqual(total["wall"],
+                               cpu / costmodel.ENCODE_THREADS)
+        self.assertEqual(total["bytes"],
+                         int(10.0 * costmodel.VID_BITRATE["draft"] / 8))
+
+    def test_link_and_existing(self):
+        jobs = (self.jobs("b.webm", width=640, height=360, bitrate=1e6,
+                          vcodec="vp9", acodec="opus", duration=5.0,
+                          fps=25.0) +
+                self.jobs("c.mts", **self.hd(10.0)))
+        with open(os.path.join(self.outdir, "c.mp4"), "w") as fh:
+            fh.write("encoded before")
+        total = self.model.videos(jobs, 2, 0, fake_probes(self.info))
+        self.assertEqual((total["jobs"], total["existing"]), (1, 1))
+        self.assertEqual((total["cpu"], total["bytes"]), (0.0, 0))
+
+    def test_segments(self):
+        jobs = self.jobs("d.mts", **self.hd(600.0))
+        whole = self.model.videos(jobs, 16, 0, fake_probes(self.info))
+        split = self.model.videos(jobs, 16, 300, fake_probes(self.info))
+        self.assertAlmostEqual(split["cpu"], whole["cpu"])
+        #segments spread over the threads
+        self.assertAlmostEqual(split["wall"], whole["cpu"] / 16)
+        self.assertTrue(split["wall"] < whole["wall"])
+
+    def test_video_cpu(self):
+        jobs = self.jobs("e.mts", **self.hd(10.0))
+        estimate = self.model.videos(jobs, 2, 0,
+                                     fake_probes(self.info))["cpu"]
+        probed = [dict(jobs[0], **self.info[jobs[0]["infile"]])]
+        self.assertAlmostEqual(self.model.video_cpu(probed), estimate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import cropresize
+
+log = logging.getLogger("test")
+log.addHandler(logging.NullHandler())
+
+
+class plan_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.outdir = os.path.join(self.dir, "0800")
+        os.mkdir(self.outdir)
+        open(os.path.join(self.outdir, "OLD.JPG"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def source(self, *parts):
+        return os.path.join(self.dir, "jpg", *parts)
+
+    def test_one_job_per_name(self):
+        sources = [self.source("a", "IMG.JPG"), self.source("b", "IMG.JPG"),
+                   self.source("a", "OLD.JPG"), self.source("b", "NEW.JPG")]
+        jobs = cropresize.plan_img_jobs(log, self.dir, sources)
+        #first source to want a name gets it, one on disk is kept
+        self.assertEqual([(job["infile"], job["outfile"]) for job in jobs], [
+            (sources[0], os.path.join(self.outdir, "IMG.JPG")),
+            (sources[3], os.path.join(self.outdir, "NEW.JPG"))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dedupe
+
+
+class finder_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        big = os.urandom(3 * dedupe.EDGE_SIZE)
+        #middle differs only: same size and edges, other contents
+        middle = (big[:dedupe.EDGE_SIZE] + "x" * dedupe.EDGE_SIZE +
+                  big[-dedupe.EDGE_SIZE:])
+        self.files = [
+            self.write("a.jpg", big),
+            self.write("b.jpg", "small one"),
+            self.write("c.jpg", big),
+            self.write("d.jpg", middle),
+            self.write("e.jpg", os.urandom(len(big))),
+            self.write("f.jpg", "other size"),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return (path, len(data))
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_find(self):
+        for n_threads in (1, 4):
+            finder = dedupe.duplicate_finder(n_threads)
+            #POOL_MIN and over: the edge stage runs on the pool
+            self.assertEqual(finder.find(reversed(self.files)),
+                             [[self.path("a.jpg"), self.path("c.jpg")]])
+            finder.close()
+            stats = finder.stats
+            #b and f alone at their size: never read
+            self.assertEqual(stats["edge_hashed"], 4)
+            #e differs at the edges: never read whole
+            self.assertEqual(stats["full_hashed"], 3)
+            self.assertEqual(stats["duplicates"], 1)
+            self.assertEqual(stats["dup_bytes"], 3 * dedupe.EDGE_SIZE)
+
+    def test_check(self):
+        finder = dedupe.duplicate_finder()
+        found = [finder.check(path, size) for path, size in self.files]
+        finder.close()
+        self.assertEqual(found, [None, None, self.path("a.jpg"),
+                                 None, None, None])
+        self.assertEqual(finder.stats["edge_hashed"], 4)
+        self.assertEqual(finder.stats["full_hashed"], 3)
+        #every stage below POOL_MIN: hashed inline, no pool
+        self.assertEqual(finder.pool, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import derivcache
+
+SPEC = {"name": "sm", "loc": "sm", "type": "im", "resize": True,
+        "resizedims": "800x600", "crop": False}
+
+
+class key_test(unittest.TestCase):
+    def setUp(self):
+        self.cache = derivcache.derivative_cache("/nonexistent")
+
+    def test_inputs(self):
+        key = self.cache.key("a" * 64, SPEC)
+        self.assertEqual(key, self.cache.key("a" * 64, dict(SPEC)))
+        self.assertNotEqual(key, self.cache.key("b" * 64, SPEC))
+        self.assertNotEqual(key, self.cache.key("a" * 64, SPEC, "pil"))
+        self.assertNotEqual(key, self.cache.key(
+            "a" * 64, dict(SPEC, resizedims="640x480")))
+        self.assertNotEqual(key, self.cache.key(
+            "a" * 64, dict(SPEC, crop=True, cropdims="800x600")))
+
+    def test_spec_names(self):
+        #where the output goes is no part of what it is
+        self.assertEqual(self.cache.key("a" * 64, SPEC),
+                         self.cache.key("a" * 64,
+                                        dict(SPEC, name="x", loc="y")))
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, self.cache.key, "a" * 64, SPEC, "vips")
+
+
+class store_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.cache = derivcache.derivative_cache(
+            os.path.join(self.dir, "cache"), 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return path
+
+    def test_fetch(self):
+        outfile = self.write("out.jpg", "derivative")
+        key = self.cache.key(self.cache.source_hash(outfile), SPEC)
+        target = os.path.join(self.dir, "again.jpg")
+        tmp = os.path.join(self.dir, ".again.part.jpg")
+        self.assertFalse(self.cache.fetch(key, target, tmp))
+        self.cache.store(key, outfile)
+        self.assertTrue(self.cache.fetch(key, target, tmp))
+        with open(target, "rb") as fh:
+            self.assertEqual(fh.read(), "derivative")
+        self.assertFalse(os.path.exists(tmp))
+        #a copy, not a link into the cache
+        self.assertEqual(os.stat(target).st_nlink, 1)
+        self.assertEqual(os.stat(outfile).st_nlink, 1)
+
+    def test_evict(self):
+        keys = []
+        for i in range(4):
+            key = self.cache.key(str(i) * 64, SPEC)
+            self.cache.store(key, self.write("{}.jpg".format(i), "x" * 400))
+            #entry i last used at time i, entry 0 the oldest
+            os.utime(self.cache.entry_dir(key), (i * 100, i * 100))
+            keys.append(key)
+        #entry 1 used again, now the most recent
+        self.assertTrue(self.cache.fetch(
+            keys[1], os.path.join(self.dir, "f.jpg"),
+            os.path.join(self.dir, ".f.part.jpg")))
+        self.assertEqual(self.cache.evict(), (2, 800))
+        left = [key for key in keys
+                if os.path.isdir(self.cache.entry_dir(key))]
+        self.assertEqual(left, [keys[1], keys[3]])
+        #under the limit: nothing more to do
+        self.assertEqual(self.cache.evict(), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import filetypes
+
+
+class sniff_test(unittest.TestCase):
+    def test_headers(self):
+        cases = [
+            ("\xff\xd8\xff\xe0\x00\x10JFIF", "img"),
+            ("II*\x00\x08\x00\x00\x00", "raw"),
+            ("MM\x00*\x00\x00\x00\x08", "raw"),
+            ("IIRO\x08\x00\x00\x00", "raw"),
+            ("FUJIFILMCCD-RAW 0201", "raw"),
+            ("II\x1a\x00\x00\x00HEAPCCDR", "raw"),
+            ("\x00\x00\x00\x18ftypcrx \x00\x00\x00\x01", "raw"),
+            ("\x00\x00\x00\x18ftypheic\x00\x00\x00\x00", "misc"),
+            ("\x00\x00\x00\x18ftypisom\x00\x00\x02\x00", "vid"),
+            ("RIFF\x00\x00\x00\x00AVI LIST", "vid"),
+            ("\x00\x00\x01\xba\x44\x00", "vid"),
+            ("\x1a\x45\xdf\xa3\x01\x00", "vid"),
+            ("plain text", None),
+            ("", None),
+        ]
+        for head, want in cases:
+            self.assertEqual(filetypes.sniff_header(head), want, repr(head))
+
+    def test_transport_stream(self):
+        packet = "\x47" + "\x00" * 187
+        self.assertEqual(filetypes.sniff_header(packet * 3), "vid")
+        #m2ts: 4 byte timestamp ahead of each packet
+        self.assertEqual(
+            filetypes.sniff_header(("\x00" * 4 + packet) * 3), "vid")
+        #one sync byte alone is not a stream
+        self.assertEqual(filetypes.sniff_header(packet), None)
+
+
+class classifier_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return path
+
+    def classifier(self, sniff):
+        return filetypes.file_classifier(["jpg", ".JPEG"], ["cr2"],
+                                         ["mts"], sniff)
+
+    def test_by_ext(self):
+        cls = self.classifier("unknown")
+        #listed suffixes are not read, the header would say otherwise
+        self.assertEqual(cls.classify(self.write("a.JPG", "text")), "img")
+        self.assertEqual(cls.classify(self.write("b.cr2", "text")), "raw")
+        self.assertEqual(cls.stats["by_ext"], 2)
+        self.assertEqual(cls.stats["sniffed"], 0)
+
+    def test_sniff_unknown(self):
+        cls = self.classifier("unknown")
+        jpeg = self.write("c.bin", "\xff\xd8\xff\xe1")
+        self.assertEqual(cls.classify(jpeg), "img")
+        self.assertEqual(cls.classify(self.write("d.bin", "text")), "misc")
+        #same file again: from the memo, not read
+        self.assertEqual(cls.classify(jpeg), "img")
+        self.assertEqual(cls.stats["sniffed"], 2)
+        self.assertEqual(cls.stats["memo"], 1)
+
+    def test_sniff_modes(self):
+        path = self.write("e.jpg", "\x1a\x45\xdf\xa3")
+        self.assertEqual(self.classifier("all").classify(path), "vid")
+        self.assertEqual(self.classifier("unknown").classify(path), "img")
+        other = self.write("f.bin", "\xff\xd8\xff")
+        self.assertEqual(self.classifier("none").classify(other), "misc")
+
+    def test_wanted_class(self):
+        cls = self.classifier("unknown")
+        self.assertEqual(cls.wanted_class("im"), "img")
+        self.assertEqual(cls.wanted_class({"type": "vid"}), "vid")
+        self.assertEqual(cls.wanted_class("misc"), "misc")
+        self.assertEqual(cls.wanted_class("other"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import logging
+import os
+import shutil
+import signal
+import struct
+import tempfile
+import unittest
+
+import imgconv
+import pipeline
+
+log = logging.getLogger("test")
+log.addHandler(logging.NullHandler())
+
+
+def segment(marker, payload):
+    return struct.pack(">BBH", 0xff, marker, len(payload) + 2) + payload
+
+
+def jpeg_head(width, height, sof=0xC0, extra=""):
+    """
+    markers up to the frame header of a JPEG, the rest is not read
+    """
+    return ("\xff\xd8" + segment(0xE0, "JFIF\x00\x01\x01\x00\x00\x01"
+                                 "\x00\x01\x00\x00") + extra +
+            segment(sof, struct.pack(">BHHB", 8, height, width, 3) +
+                    "\x01\x22\x00\x02\x11\x01\x03\x11\x01"))
+
+
+class jpeg_dimensions_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        path = os.path.join(self.dir, "img.jpg")
+        with open(path, "wb") as fh:
+            fh.write(data)
+        return path
+
+    def test_baseline(self):
+        path = self.write(jpeg_head(4000, 3000))
+        self.assertEqual(imgconv.jpeg_dimensions(path), (4000, 3000))
+
+    def test_progressive_after_exif(self):
+        #DHT (C4) is no frame header, fill bytes ahead of a marker
+        extra = (segment(0xE1, "Exif\x00\x00" + "\x00" * 300) +
+                 segment(0xC4, "\x00" * 20) + "\xff\xff")
+        path = self.write(jpeg_head(640, 480, 0xC2, extra))
+        self.assertEqual(imgconv.jpeg_dimensions(path), (640, 480))
+
+    def test_not_jpeg(self):
+        self.assertEqual(imgconv.jpeg_dimensions(self.write("II*\x00")),
+                         None)
+        #scan before any frame header
+        path = self.write("\xff\xd8" + segment(0xDA, "\x00" * 10))
+        self.assertEqual(imgconv.jpeg_dimensions(path), None)
+        #cut short in the frame header
+        self.assertEqual(
+            imgconv.jpeg_dimensions(self.write(jpeg_head(10, 10)[:-12])),
+            None)
+        self.assertEqual(
+            imgconv.jpeg_dimensions(os.path.join(self.dir, "none.jpg")),
+            None)
+
+
+class decode_size_test(unittest.TestCase):
+    def spec(self, dims):
+        return {"resizedims": dims, "crop": False}
+
+    def test_scales(self):
+        size = (4000, 3000)
+        self.assertEqual(imgconv.decode_size(size, [self.spec("800x600")]),
+                         (1000, 750))
+        self.assertEqual(imgconv.decode_size(size, [self.spec("100x100")]),
+                         (500, 375))
+        #the largest spec decides
+        self.assertEqual(imgconv.decode_size(size, [
+            self.spec("100x100"), self.spec("1920x1080")]), (2000, 1500))
+        #never below the full size for a spec larger than the source
+        self.assertEqual(imgconv.decode_size((640, 480),
+                                             [self.spec("800x600")]),
+                         (640, 480))
+
+    def test_rounds_up(self):
+        #libjpeg rounds scaled sizes up
+        self.assertEqual(imgconv.decode_size((4001, 3001),
+                                             [self.spec("100x100")]),
+                         (501, 376))
+
+
+class convert_cmd_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.infile = os.path.join(self.dir, "IMG_1.JPG")
+        with open(self.infile, "wb") as fh:
+            fh.write(jpeg_head(4000, 3000))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def job(self, dims, crop=False):
+        spec = {"resizedims": dims, "crop": crop, "cropdims": dims}
+        return imgconv.make_job(self.infile,
+                                os.path.join(self.dir, "out", "IMG_1.jpg"),
+                                spec)
+
+    def test_size_hint(self):
+        result = {}
+        cmd = imgconv.convert_cmd(self.job("800x600"), result)
+        self.assertEqual(cmd[2:4], ["-size", "1000x750"])
+        self.assertEqual(cmd[cmd.index("-resize") + 1], "800x600>")
+        self.assertEqual(result["px_full"], 4000 * 3000)
+        self.assertEqual(result["px_decoded"], 1000 * 750)
+        self.assertEqual(cmd[-1], os.path.join(self.dir, "out",
+                                               ".IMG_1.part.jpg"))
+
+    def test_no_hint(self):
+        #without a result the source is not read
+        cmd = imgconv.convert_cmd(self.job("800x600"))
+        self.assertNotIn("-size", cmd)
+        #full size decode needed: no hint either
+        result = {}
+        cmd = imgconv.convert_cmd(self.job("4000x3000"), result)
+        self.assertNotIn("-size", cmd)
+        self.assertEqual(result["px_decoded"], result["px_full"])
+
+    def test_crop(self):
+        cmd = imgconv.convert_cmd(self.job("300x300", crop=True), {})
+        self.assertEqual(cmd[-5:-1], ["-gravity", "center", "-extent",
+                                      "300x300"])
+
+
+def work(unit):
+    """
+    stands in for a gm run: "kill" takes the worker down, "error"
+    raises, anything else is done
+    """
+    results = []
+    for job in imgconv._unit_jobs(unit):
+        if "kill" in job["infile"]:
+            os.kill(os.getpid(), signal.SIGKILL)
+        if "error" in job["infile"]:
+            raise ValueError("no good")
+        results.append(imgconv._new_result(job))
+    return results
+
+
+class fake_journal(object):
+    def __init__(self):
+        self.handed_out = []
+        #outfile -> [ok, ...], one entry each time it was finished
+        self.results = {}
+
+    def started(self, outfiles):
+        self.handed_out.extend(outfiles)
+
+    def finished(self, outfile, ok=True):
+        self.results.setdefault(outfile, []).append(ok)
+
+    def sync(self):
+        pass
+
+
+class run_units_test(unittest.TestCase):
+    def jobs(self, *names):
+        return [imgconv.make_job("/nonexistent/" + name,
+                                 "/nonexistent/out/" + name, {"name": "x"})
+                for name in names]
+
+    def run_units(self, units, n_jobs):
+        summary = {"done": 0, "skipped": 0, "cached": 0, "failed": 0,
+                   "spawns": 0, "px_full": 0, "px_decoded": 0}
+        jrnl = fake_journal()
+        imgconv._run_units(log, work, iter(units), n_jobs, None, summary,
+                           jrnl)
+        #every job handed out is accounted for exactly once
+        self.assertEqual(sorted(jrnl.handed_out), sorted(jrnl.results))
+        self.assertTrue(all(1 == len(oks) for oks in jrnl.results.values()))
+        return summary, jrnl
+
+    def test_lost_workers(self):
+        jobs = self.jobs(*["{}{}".format(kind, i) for i in range(4)
+                           for kind in ("ok", "kill", "error")])
+        summary, jrnl = self.run_units(jobs, 3)
+        self.assertEqual((summary["done"], summary["failed"]), (4, 8))
+        for outfile, oks in jrnl.results.items():
+            self.assertEqual(oks, ["ok" in outfile], outfile)
+
+    def test_lost_batch(self):
+        #the worker takes the whole unit down with it
+        units = [self.jobs("ok0", "ok1"), self.jobs("ok2", "kill0", "ok3"),
+                 self.jobs("ok4")]
+        summary, jrnl = self.run_units(units, 2)
+        self.assertEqual((summary["done"], summary["failed"]), (3, 3))
+        self.assertEqual(jrnl.results["/nonexistent/out/ok2"], [False])
+
+    def test_in_process(self):
+        summary, jrnl = self.run_units(self.jobs("ok0", "error0", "ok1"), 1)
+        self.assertEqual((summary["done"], summary["failed"]), (2, 1))
+
+
+
+class stream_units_test(unittest.TestCase):
+    def jobs(self, count):
+        return [imgconv.make_job("/in/{}".format(i), "/out/{}".format(i),
+                                 {"name": "x"}) for i in range(count)]
+
+    def ready_stage(self, jobs):
+        """
+        stage with every job already queued, a planner ahead of the pool
+        """
+        jobs = pipeline.stage(iter(jobs))
+        jobs.thread.join()
+        return jobs
+
+    def test_spread(self):
+        jobs = self.jobs(50)
+        units = list(imgconv.stream_units(self.ready_stage(jobs), 50,
+                                          False, 4))
+        #shared out as chunk_jobs does a list, not one unit of 50
+        self.assertEqual([len(unit) for unit in units], [13, 13, 13, 11])
+        self.assertEqual(sum(units, []), jobs)
+        units = list(imgconv.stream_units(self.ready_stage(jobs), 50,
+                                          False, 1))
+        self.assertEqual([len(unit) for unit in units], [50])
+
+    def test_batch_size(self):
+        units = list(imgconv.stream_units(self.ready_stage(self.jobs(50)),
+                                          10, False, 2))
+        #batch size bound until the last 10 are shared by both workers
+        self.assertEqual([len(unit) for unit in units],
+                         [10, 10, 10, 10, 6, 4])
+
+    def test_generator(self):
+        #read ahead on a stage of its own, every job once and in order
+        jobs = self.jobs(30)
+        units = list(imgconv.stream_units((job for job in jobs), 8,
+                                          False, 3))
+        self.assertEqual(sum(units, []), jobs)
+        self.assertTrue(all(1 <= len(unit) <= 8 for unit in units))
+
+if __name__ == '__main__':
+    unittest.main()
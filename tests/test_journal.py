@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import journal
+
+
+class journal_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.path = journal.journal_path(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_one(self):
+        """
+        a run killed part way: a done, b failed, c and d in flight
+        """
+        jrnl = journal.job_journal(self.path)
+        for name in "abcd":
+            jrnl.planned(name)
+        jrnl.started(["a", "b"])
+        jrnl.finished("a")
+        jrnl.finished("b", ok=False)
+        jrnl.started(["c", "d"])
+        jrnl.close()
+
+    def test_resume(self):
+        self.run_one()
+        jrnl = journal.job_journal(self.path, resume=True)
+        self.assertEqual(jrnl.done, set(["a"]))
+        self.assertEqual(jrnl.failed, set(["b"]))
+        self.assertEqual(jrnl.in_flight, set(["c", "d"]))
+        #the second run gets b and c done, then a third one resumes
+        jrnl.started(["b", "c"])
+        jrnl.finished("b")
+        jrnl.finished("c")
+        jrnl.close()
+        jrnl = journal.job_journal(self.path, resume=True)
+        self.assertEqual(jrnl.done, set(["a", "b", "c"]))
+        self.assertEqual(jrnl.failed, set())
+        self.assertEqual(jrnl.in_flight, set(["d"]))
+        jrnl.close()
+
+    def test_torn_line(self):
+        self.run_one()
+        with open(self.path, "a") as fh:
+            fh.write("D\td")
+        jrnl = journal.job_journal(self.path, resume=True)
+        #the torn line does not count and is cut off
+        self.assertEqual(jrnl.in_flight, set(["c", "d"]))
+        jrnl.finished("d")
+        jrnl.close()
+        with open(self.path) as fh:
+            self.assertEqual(fh.read().splitlines()[-1], "D\td")
+        jrnl = journal.job_journal(self.path, resume=True)
+        self.assertEqual(jrnl.done, set(["a", "d"]))
+        jrnl.close()
+
+    def test_new_run(self):
+        self.run_one()
+        with open(self.path) as fh:
+            first = fh.read()
+        #not resuming: the old journal is moved aside, not replayed
+        jrnl = journal.job_journal(self.path)
+        self.assertEqual(jrnl.done, set())
+        jrnl.close()
+        with open(self.path + ".1") as fh:
+            self.assertEqual(fh.read(), first)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_sync_interval(self):
+        synced = []
+        fsync = os.fsync
+        saved = journal.SYNC_SECONDS, journal.SYNC_EVERY
+        os.fsync = synced.append
+        journal.SYNC_SECONDS, journal.SYNC_EVERY = 3600, 3
+        try:
+            jrnl = journal.job_journal(self.path)
+            jrnl.started(["a", "b"])
+            jrnl.sync()
+            #flushed, but not yet due for an fsync
+            self.assertEqual(len(synced), 0)
+            with open(self.path) as fh:
+                self.assertEqual(len(fh.readlines()), 2)
+            jrnl.finished("a")
+            jrnl.sync()
+            self.assertEqual(len(synced), 1)
+            #nothing new: nothing to sync, even when forced
+            jrnl.sync(True)
+            self.assertEqual(len(synced), 1)
+            jrnl.finished("b")
+            jrnl.close()
+            self.assertEqual(len(synced), 2)
+        finally:
+            os.fsync = fsync
+            journal.SYNC_SECONDS, journal.SYNC_EVERY = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
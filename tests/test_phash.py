@@ -0,0 +1,74 @@
+import random
+import unittest
+
+import phash
+
+
+def brute_force(hashes, max_dist):
+    return set((i, j) for i in range(len(hashes))
+               for j in range(i + 1, len(hashes))
+               if phash.distance(hashes[i], hashes[j]) <= max_dist)
+
+
+def near_copies(rand, count):
+    """
+    random 64 bit hashes, each of a few bases with up to 10 bits flipped,
+    so there are pairs on both sides of every distance tested
+    """
+    bases = [rand.getrandbits(64) for i in range(count // 10)]
+    hashes = []
+    for i in range(count):
+        value = rand.choice(bases)
+        for bit in rand.sample(range(64), rand.randint(0, 10)):
+            value ^= 1 << bit
+        hashes.append(value)
+    return hashes
+
+
+class index_test(unittest.TestCase):
+    def setUp(self):
+        self.hashes = near_copies(random.Random(1), 300)
+
+    def check_pairs(self):
+        index = phash.hash_index(self.hashes)
+        for max_dist in (0, 3, phash.DEFAULT_DISTANCE, 10):
+            self.assertEqual(index.pairs(max_dist),
+                             brute_force(self.hashes, max_dist), max_dist)
+
+    def test_pairs(self):
+        numpy = phash.numpy
+        phash.numpy = None
+        try:
+            self.check_pairs()
+        finally:
+            phash.numpy = numpy
+
+    @unittest.skipIf(phash.numpy is None, "no numpy")
+    def test_pairs_numpy(self):
+        self.check_pairs()
+
+    def test_signed(self):
+        #as kept in sqlite, the index takes them either way
+        signed = [phash.to_signed(value) for value in self.hashes]
+        self.assertTrue(any(value < 0 for value in signed))
+        self.assertEqual([phash.to_unsigned(value) for value in signed],
+                         self.hashes)
+        self.assertEqual(phash.hash_index(signed).pairs(4),
+                         brute_force(self.hashes, 4))
+
+    def test_query(self):
+        index = phash.hash_index(self.hashes)
+        value = self.hashes[7] ^ 0b101
+        self.assertEqual(index.query(value, 4), [
+            i for i, other in enumerate(self.hashes)
+            if phash.distance(value, other) <= 4])
+
+    def test_clusters(self):
+        #0-1 and 1-2 are close, 0-2 not: one cluster all the same
+        base = 0
+        hashes = [base, base ^ 0b1111, base ^ 0b11111111, (1 << 64) - 1]
+        self.assertEqual(phash.hash_index(hashes).clusters(4), [[0, 1, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import itertools
+import threading
+import unittest
+
+import pipeline
+
+
+def numbers(count=None, fail_at=None):
+    for i in itertools.count():
+        if count is not None and i >= count:
+            return
+        if i == fail_at:
+            raise KeyError(i)
+        yield i
+
+
+class stage_test(unittest.TestCase):
+    def test_items(self):
+        self.assertEqual(list(pipeline.stage(numbers(500), maxsize=4)),
+                         range(500))
+
+    def test_error(self):
+        #raised on the consumer side, after the items before it
+        seen = []
+        jobs = pipeline.stage(numbers(fail_at=3))
+        with self.assertRaises(KeyError):
+            for item in jobs:
+                seen.append(item)
+        self.assertEqual(seen, [0, 1, 2])
+        self.assertRaises(StopIteration, jobs.next)
+
+    def test_error_downstream(self):
+        #through a stage reading a failing one
+        first = pipeline.stage(numbers(fail_at=10))
+        second = pipeline.stage((i * 2 for i in first), inputs=[first])
+        self.assertRaises(KeyError, list, second)
+
+    def test_take(self):
+        jobs = pipeline.stage(numbers(10))
+        jobs.thread.join()
+        #10 items and the end marker
+        self.assertEqual(jobs.ready(), 11)
+        self.assertEqual(jobs.take(4), [0, 1, 2, 3])
+        self.assertEqual(jobs.take(100), [4, 5, 6, 7, 8, 9])
+        self.assertRaises(StopIteration, jobs.take, 1)
+
+    def test_close(self):
+        #endless producers blocked on full queues
+        first = pipeline.stage(numbers(), maxsize=2)
+        second = pipeline.stage((i for i in first), maxsize=2,
+                                inputs=[first])
+        self.assertEqual(second.next(), 0)
+        second.close()
+        for one in (first, second):
+            one.thread.join(5)
+            self.assertFalse(one.thread.is_alive())
+        self.assertRaises(StopIteration, second.next)
+
+    def test_close_waiting(self):
+        #the thread of a stage waiting on a silent input ends on close
+        release = threading.Event()
+
+        def silent():
+            release.wait()
+            yield 1
+
+        first = pipeline.stage(silent())
+        second = pipeline.stage((i for i in first), inputs=[first])
+        second.close()
+        second.thread.join(5)
+        self.assertFalse(second.thread.is_alive())
+        release.set()
+        first.thread.join(5)
+        self.assertFalse(first.thread.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
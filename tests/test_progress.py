@@ -0,0 +1,82 @@
+import logging
+import unittest
+
+import progress
+
+
+class lines(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+class task_test(unittest.TestCase):
+    def task(self, total, start=100.0):
+        task = progress._task()
+        for i in range(total):
+            task.plan(start)
+        return task
+
+    def test_batches(self):
+        task = self.task(100)
+        #one unit of 50 jobs comes back at once: no rate from that
+        for i in range(50):
+            task.finish(102.0 + i * 1e-5)
+        self.assertEqual(task.rates(102.5, True), (None, None, None))
+        self.assertEqual(task.line(102.5, True),
+                         "50/100 files, ? files/s, ? MB/s, ETA ?")
+        #the next one: over the time since planning began
+        for i in range(50):
+            task.finish(104.0, 1 << 20)
+        files, mb, eta = task.rates(110.0, True)
+        self.assertAlmostEqual(files, 25.0, 3)
+        self.assertAlmostEqual(mb, 12.5, 3)
+        self.assertEqual(eta, 0)
+
+    def test_skips(self):
+        #a rerun skipping everything is done in no time: no rate at all
+        task = self.task(2)
+        task.finish(100.001)
+        task.finish(100.002)
+        self.assertEqual(task.line(100.002, True),
+                         "2/2 files, ? files/s, ? MB/s, ETA ?")
+
+    def test_eta(self):
+        task = self.task(10)
+        for i in range(1, 6):
+            task.finish(100.0 + i)
+        files, mb, eta = task.rates(105.0, True)
+        self.assertAlmostEqual(files, 1.0)
+        self.assertAlmostEqual(eta, 5.0)
+        #not all planned yet: no ETA, and the total is open
+        self.assertEqual(task.rates(105.0, False)[2], None)
+        self.assertTrue(task.line(105.0, False).startswith("5/10+ files"))
+
+
+class reporter_test(unittest.TestCase):
+    def test_log_lines(self):
+        log = logging.getLogger("test.progress")
+        log.propagate = False
+        handler = lines()
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        reporter = progress.progress_reporter(log, tty=False)
+        for spec in ("sm", "lg"):
+            reporter.planned("img", spec)
+        reporter.planning_done("img")
+        reporter.finished("img", "sm", 100)
+        reporter.show()
+        #only the spec still going
+        self.assertEqual(handler.lines, [
+            "progress img lg: 0/1 files, ? files/s, ? MB/s, ETA ?"])
+        reporter.finished("img", "lg")
+        reporter.show(final=True)
+        self.assertEqual(len(handler.lines), 3)
+        log.removeHandler(handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
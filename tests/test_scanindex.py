@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import scanindex
+
+
+class scan_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.base = os.path.join(self.dir, "2013-01-01_set")
+        self.path = scanindex.index_path(self.dir)
+        for name in ("a/1.jpg", "a/2.jpg", "b/c/3.mts", "4.txt"):
+            self.write(name)
+        self.classified = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name):
+        path = os.path.join(self.base, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fh:
+            fh.write(name)
+        return path
+
+    def touch_dir(self, name, when):
+        """
+        set a dir mtime to a known value, a change within the clock
+        resolution would go unseen
+        """
+        os.utime(os.path.join(self.base, name), (when, when))
+
+    def classify(self, path):
+        self.classified.append(os.path.relpath(path, self.base))
+        return os.path.splitext(path)[1][1:]
+
+    def scan(self, index, **kwargs):
+        return sorted((os.path.relpath(path, self.base), file_class)
+                      for path, size, mtime, file_class in
+                      index.scan(classify=self.classify, n_threads=2,
+                                 **kwargs))
+
+    def test_unchanged(self):
+        index = scanindex.scan_index(self.base, self.path)
+        found = self.scan(index)
+        self.assertEqual(found, [("4.txt", "txt"), ("a/1.jpg", "jpg"),
+                                 ("a/2.jpg", "jpg"), ("b/c/3.mts", "mts")])
+        self.assertEqual(index.stats["dirs_listed"], 4)
+        index.close()
+        #a new process: every dir answered from the index, nothing read
+        self.classified = []
+        index = scanindex.scan_index(self.base, self.path)
+        self.assertEqual(self.scan(index), found)
+        self.assertEqual(index.stats["dirs_listed"], 0)
+        self.assertEqual(index.stats["dirs_skipped"], 4)
+        self.assertEqual(self.classified, [])
+        #full: listed again, classes kept for unchanged files
+        self.scan(index, full=True)
+        self.assertEqual(index.stats["dirs_listed"], 4)
+        self.assertEqual(self.classified, [])
+        index.close()
+
+    def test_changed_dir(self):
+        index = scanindex.scan_index(self.base, self.path)
+        self.scan(index)
+        self.write("a/5.jpg")
+        self.touch_dir("a", 1000000000)
+        self.classified = []
+        found = self.scan(index)
+        self.assertIn(("a/5.jpg", "jpg"), found)
+        #stats add up: only a/ listed again, only the new file classified
+        self.assertEqual(index.stats["dirs_listed"], 5)
+        self.assertEqual(self.classified, ["a/5.jpg"])
+        index.close()
+
+    def test_forget(self):
+        index = scanindex.scan_index(self.base, self.path)
+        self.scan(index)
+        clip = os.path.join(self.base, "b/c/3.mts")
+        index.put_probe(clip, 9, 1.0, {"duration": 1.0})
+        #b/ turns into a file: everything below it goes, probes too
+        shutil.rmtree(os.path.join(self.base, "b"))
+        self.write("b")
+        self.touch_dir("", 1000000000)
+        found = self.scan(index)
+        self.assertEqual(found, [("4.txt", "txt"), ("a/1.jpg", "jpg"),
+                                 ("a/2.jpg", "jpg"), ("b", "")])
+        self.assertEqual(index.get_probe(clip, 9, 1.0), None)
+        self.assertEqual(index.db.execute(
+            "SELECT count(*) FROM dirs WHERE path LIKE 'b%'").fetchone(),
+            (0,))
+        index.close()
+
+    def test_gone_top(self):
+        index = scanindex.scan_index(self.base, self.path)
+        self.scan(index)
+        shutil.rmtree(os.path.join(self.base, "a"))
+        found = self.scan(index, tops=os.path.join(self.base, "a"))
+        self.assertEqual(found, [])
+        self.assertEqual(index.db.execute(
+            "SELECT count(*) FROM entries WHERE path LIKE 'a/%'"
+            ).fetchone(), (0,))
+        index.close()
+
+    def test_read_only(self):
+        index = scanindex.scan_index(self.base, self.path)
+        self.scan(index)
+        index.close()
+        self.write("a/5.jpg")
+        self.touch_dir("a", 1000000000)
+        index = scanindex.scan_index(self.base, self.path, read_only=True)
+        self.assertIn(("a/5.jpg", "jpg"), self.scan(index))
+        index.close()
+        #what the copy learned is not written back
+        self.classified = []
+        index = scanindex.scan_index(self.base, self.path)
+        self.scan(index)
+        self.assertEqual(self.classified, ["a/5.jpg"])
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
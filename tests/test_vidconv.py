@@ -0,0 +1,248 @@
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+import vidconv
+
+log = logging.getLogger("test")
+log.addHandler(logging.NullHandler())
+
+SPEC = {"name": "vid-sm", "loc": "vid-sm", "type": "vid",
+        "resizedims": "640x360", "profile": "draft"}
+
+
+def clip(**facts):
+    """
+    probe result of a clip, unknown where not given
+    """
+    info = dict((key, None) for key in vidconv.PROBE_KEYS)
+    info.update(facts)
+    return info
+
+
+class fake_probes(object):
+    """
+    stands in for the scan index probe cache, so ffprobe is not run
+
+    info: {path: probe result}
+    """
+    def __init__(self, info):
+        self.info = info
+
+    def get_probe(self, path, size, mtime):
+        return self.info[path]
+
+    def put_probe(self, path, size, mtime, info):
+        pass
+
+
+class plan_clip_test(unittest.TestCase):
+    def plan(self, infile, **facts):
+        job = vidconv.make_jobs(infile, "/out", SPEC)[0]
+        job.update(clip(**facts))
+        return vidconv.plan_clip(job)
+
+    def test_small_web_clip(self):
+        facts = dict(width=640, height=360, bitrate=1e6, vcodec="vp9",
+                     acodec="opus")
+        self.assertEqual(self.plan("/in/a.webm", **facts),
+                         ("link", "/out/a.webm"))
+        #web codecs, other container: stream copied into the right one
+        self.assertEqual(self.plan("/in/a.mkv", **facts),
+                         ("remux", "/out/a.webm"))
+        self.assertEqual(self.plan("/in/b.mov", width=360, height=640,
+                                   bitrate=1e6, vcodec="h264",
+                                   acodec="aac"),
+                         ("remux", "/out/b.mp4"))
+
+    def test_transcode(self):
+        web = dict(vcodec="vp9", acodec="opus")
+        #too big, too dense, or not known to be small
+        for facts in (dict(width=1920, height=1080, bitrate=1e6),
+                      dict(width=640, height=360, bitrate=8e6),
+                      dict(width=640, height=360),
+                      dict(width=640, height=360, bitrate=1e6,
+                           vcodec="h264", acodec="ac3")):
+            self.assertEqual(self.plan("/in/c.webm", **dict(web, **facts)),
+                             ("transcode", "/out/c.webm"), facts)
+
+    def test_names(self):
+        job = vidconv.make_jobs("/in/d.mts", "/out", SPEC)[0]
+        self.assertEqual(vidconv.preview_names(job),
+                         ["/out/d.webm", "/out/d.mp4"])
+
+
+def scaled(scale, width, height):
+    """
+    frame size an even fit_filter scale gives a width x height frame,
+    its expressions evaluated as ffmpeg would
+    """
+    names = {"iw": width, "ih": height, "a": float(width) / height,
+             "min": min, "trunc": int, "gt": lambda x, y: int(x > y),
+             "if_": lambda cond, x, y: x if cond else y}
+    exprs = re.match(r"scale='(.*)':'(.*)'$", scale).groups()
+    #ffmpeg divides as floats
+    out_w, out_h = [eval(re.sub(r"(\d+)", r"\1.0",
+                                expr.replace("if(", "if_(")), names)
+                    for expr in exprs]
+    #-2: follows the other side by the aspect ratio, rounded to even
+    if -2 == out_w:
+        out_w = int(round(out_h * width / float(height) / 2)) * 2
+    if -2 == out_h:
+        out_h = int(round(out_w * height / float(width) / 2)) * 2
+    return out_w, out_h
+
+
+class fit_filter_test(unittest.TestCase):
+    def test_even(self):
+        scale = vidconv.fit_filter("640x360", even=True)
+        self.assertEqual(scaled(scale, 1920, 1080), (640, 360))
+        #wider or taller than the box, odd sides rounded down to even
+        self.assertEqual(scaled(scale, 1920, 800), (640, 266))
+        self.assertEqual(scaled(scale, 1080, 1920), (202, 360))
+        self.assertEqual(scaled(scale, 1440, 1080), (480, 360))
+        #never upscaled
+        self.assertEqual(scaled(scale, 320, 240), (320, 240))
+        self.assertEqual(scaled(scale, 321, 179), (320, 178))
+
+    def test_any_size(self):
+        self.assertEqual(vidconv.fit_filter("160x90"),
+                         "scale='min(160,iw)':'min(90,ih)'"
+                         ":force_original_aspect_ratio=decrease")
+
+    def test_profile(self):
+        self.assertIn("libvpx-vp9", vidconv.profile_args("draft"))
+        self.assertRaises(ValueError, vidconv.profile_args, "lossless")
+
+
+class link_test(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.infile = os.path.join(self.dir, "e.webm")
+        with open(self.infile, "wb") as fh:
+            fh.write("\x1a\x45\xdf\xa3 small clip")
+        os.utime(self.infile, (1000000000, 1000000000))
+        self.outdir = os.path.join(self.dir, "vid-sm")
+        os.mkdir(self.outdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_copied(self):
+        probes = fake_probes({self.infile: clip(
+            width=640, height=360, bitrate=1e6, vcodec="vp9",
+            acodec="opus", duration=2.0, fps=25.0)})
+        jobs = vidconv.make_jobs(self.infile, self.outdir, SPEC)
+        summary = vidconv.run_jobs(log, jobs, probes=probes)
+        self.assertEqual((summary["done"], summary["linked"]), (1, 1))
+        outfile = os.path.join(self.outdir, "e.webm")
+        with open(outfile, "rb") as fh:
+            self.assertEqual(fh.read(), "\x1a\x45\xdf\xa3 small clip")
+        #a copy: the preview can be edited, the original stays as it is
+        self.assertEqual(os.stat(self.infile).st_nlink, 1)
+        self.assertEqual(os.stat(outfile).st_mtime, 1000000000)
+        self.assertEqual(os.listdir(self.outdir), ["e.webm"])
+
+
+#stands in for ffmpeg: logs the threads of each run, fails for "bad"
+#  clips, writes the output otherwise
+FAKE_FFMPEG = """#!{python}
+import sys, time
+threads = int(sys.argv[sys.argv.index("-threads") + 1])
+infile = sys.argv[sys.argv.index("-i") + 1]
+with open({events!r}, "a") as fh:
+    fh.write("start %d\\n" % threads)
+time.sleep(0.1)
+with open({events!r}, "a") as fh:
+    fh.write("end %d\\n" % threads)
+if "bad" in infile:
+    sys.exit(1)
+with open(sys.argv[-1], "w") as fh:
+    fh.write("encoded")
+"""
+
+
+class run_jobs_test(unittest.TestCase):
+    """
+    the scheduler, with an ffmpeg that logs the threads it was given
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="photo_work_test")
+        self.events = os.path.join(self.dir, "events")
+        ffmpeg = os.path.join(self.dir, "ffmpeg")
+        with open(ffmpeg, "w") as fh:
+            fh.write(FAKE_FFMPEG.format(python=sys.executable,
+                                        events=self.events))
+        os.chmod(ffmpeg, 0755)
+        self.saved = vidconv.FFMPEG, vidconv.POLL
+        vidconv.FFMPEG, vidconv.POLL = ffmpeg, 0.01
+        self.outdir = os.path.join(self.dir, "vid-sm")
+        os.mkdir(self.outdir)
+
+    def tearDown(self):
+        vidconv.FFMPEG, vidconv.POLL = self.saved
+        shutil.rmtree(self.dir)
+
+    def run_jobs(self, names, n_jobs, threads):
+        jobs, info = [], {}
+        for i, name in enumerate(names):
+            infile = os.path.join(self.dir, name)
+            with open(infile, "w") as fh:
+                fh.write(name)
+            #too big to link: every clip is transcoded
+            info[infile] = clip(width=1920, height=1080, bitrate=8e6,
+                                vcodec="h264", acodec="ac3",
+                                duration=10.0 + i, fps=25.0)
+            jobs += vidconv.make_jobs(infile, self.outdir, SPEC)
+        return vidconv.run_jobs(log, jobs, n_jobs, threads, 0,
+                                fake_probes(info))
+
+    def peaks(self):
+        """
+        most encodes and threads in use at once
+        """
+        running = threads = most = most_threads = 0
+        with open(self.events) as fh:
+            for line in fh:
+                event, count = line.split()
+                sign = 1 if "start" == event else -1
+                running += sign
+                threads += sign * int(count)
+                most = max(most, running)
+                most_threads = max(most_threads, threads)
+        return most, most_threads
+
+    def test_thread_budget(self):
+        summary = self.run_jobs(["{}.mts".format(i) for i in range(6)], 3,
+                                7)
+        self.assertEqual((summary["done"], summary["failed"]), (6, 0))
+        #the whole budget in use, never more
+        self.assertEqual(self.peaks(), (3, 7))
+
+    def test_more_jobs_than_threads(self):
+        summary = self.run_jobs(["{}.mts".format(i) for i in range(4)], 4,
+                                2)
+        self.assertEqual(summary["done"], 4)
+        self.assertEqual(self.peaks(), (2, 2))
+
+    def test_failed_and_skipped(self):
+        with open(os.path.join(self.outdir, "old.webm"), "w") as fh:
+            fh.write("encoded before")
+        summary = self.run_jobs(["a.mts", "bad.mts", "old.mts"], 2, 4)
+        self.assertEqual((summary["done"], summary["failed"],
+                          summary["skipped"]), (1, 1, 1))
+        self.assertEqual(sorted(os.listdir(self.outdir)),
+                         ["a.webm", "old.webm"])
+
+    def test_default_jobs(self):
+        self.assertEqual(vidconv.default_jobs(8), 4)
+        self.assertEqual(vidconv.default_jobs(3), 1)
+        self.assertEqual(vidconv.default_jobs(1), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
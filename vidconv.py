@@ -0,0 +1,725 @@
+"""
+video transcode scheduler
+
+shared by cropresize.py and ingest.py
+
+a video job is a dict like an image job (imgconv.make_job):
+    infile  source clip
+    outfile preview to create (webm)
+    spec    output config / job spec dict
+
+several ffmpeg processes run at once, and a global CPU thread budget
+(default: one thread per core) is split between them through per job
+"-threads", so they do not each start a thread per core and fight over
+the CPU; when fewer clips are left than slots, the running ones get
+the spare threads
+
+clips are probed (ffprobe) for duration and frame rate and the shortest
+go first: quick previews come out early and the long clips run together
+at the end; the encode speed (frames per second) of every clip is logged
+
+a "vid" type job spec with an encode "profile" asks for a transcoded
+preview, one without asks for stills instead: a poster frame and
+optionally a sprite strip of scrub thumbnails; each still is taken with
+an input side seek to a keyframe and only that keyframe is decoded, a
+handful of frames per clip rather than all of them
+
+transcodes use a named encode profile (PROFILES: draft, standard,
+archive) from the job spec "profile" and are scaled to fit the spec's
+"resizedims", keeping the aspect ratio and never upscaling; specs of
+another type (cropresize's "video") are transcodes too, with
+DEFAULT_PROFILE unless they name one
+
+long clips (SEGMENT_MIN and up) are cut at keyframes into segments
+(stream copy, no re-encode), the segments are encoded as separate jobs
+of the same scheduler, so a single long clip can use every slot, and
+the encoded parts are joined losslessly (concat demuxer, stream copy)
+
+clips are probed once (results kept in the scan index when one is
+given); a small clip that already plays in a browser is copied as its
+preview (a reflink where the filesystem can, never a hardlink), or
+remuxed (stream copy) if only its container is wrong, and only the
+rest is transcoded
+
+like images, previews are written to a hidden temporary name and
+renamed into place when complete
+"""
+
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import derivcache
+import imgconv
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+#fewest threads worth giving one encode, sets the default concurrency
+MIN_THREADS = 2
+#guess for clips ffprobe can not read: bytes per second (~24 Mbit AVCHD)
+BYTES_PER_SECOND = 3 << 20
+#how often the scheduler looks at its encodes (seconds)
+POLL = 0.2
+VID_DIMS = "640x360"
+#webm encode settings by speed tier, picked with the job spec "profile"
+#  draft: realtime deadline, fastest cpu-used, row based multithreading
+#      and tile columns so all threads have work, bitrate capped
+#  standard: good deadline at a middle speed, constant quality
+#  archive: slow, best quality, alt-ref frames
+#  all: stereo opus audio, libopus rejects surround layouts such as the
+#      5.1(side) AC3 of camcorders unless downmixed (-ac 2)
+PROFILES = {
+    "draft": ["-c:v", "libvpx-vp9", "-deadline", "realtime",
+              "-cpu-used", "8", "-row-mt", "1", "-tile-columns", "2",
+              "-frame-parallel", "1", "-b:v", "800k",
+              "-c:a", "libopus", "-b:a", "64k", "-ac", "2"],
+    "standard": ["-c:v", "libvpx-vp9", "-deadline", "good",
+                 "-cpu-used", "4", "-row-mt", "1", "-tile-columns", "2",
+                 "-crf", "33", "-b:v", "0",
+                 "-c:a", "libopus", "-b:a", "96k", "-ac", "2"],
+    "archive": ["-c:v", "libvpx-vp9", "-deadline", "good",
+                "-cpu-used", "1", "-row-mt", "1", "-tile-columns", "1",
+                "-auto-alt-ref", "1", "-lag-in-frames", "25",
+                "-crf", "28", "-b:v", "0",
+                "-c:a", "libopus", "-b:a", "128k", "-ac", "2"],
+}
+DEFAULT_PROFILE = "standard"
+#clips this long (seconds) and up are encoded in segments, in parallel
+SEGMENT_MIN = 300
+#target segment length, cuts land on the next keyframe
+SEGMENT_SECONDS = 60
+PROBE_KEYS = ("duration", "fps", "vcodec", "acodec", "width", "height",
+              "bitrate", "format")
+#(container, video codecs, audio codecs) that play in a browser as is,
+#  None: no audio
+WEB_FORMATS = ((".webm", ("vp8", "vp9", "av1"), ("vorbis", "opus", None)),
+               (".mp4", ("h264",), ("aac", "mp3", None)))
+#small clips up to this bitrate are copied, not transcoded (bits/s)
+MAX_COPY_BITRATE = 2500000
+#poster frame position, part of the clip length (skips a black start)
+POSTER_AT = 0.1
+SPRITE_DIMS = "160x90"
+
+
+def default_threads():
+    return imgconv.default_jobs()
+
+
+def default_jobs(threads=None):
+    """
+    concurrent encodes for a thread budget
+    """
+    if threads is None:
+        threads = default_threads()
+    return max(1, threads // MIN_THREADS)
+
+
+def outname(vid_file, ext="webm"):
+    """
+    preview name for a clip: <card date>_<name>.<ext>
+
+    the card date is taken from the card dir under raw-media
+    (raw-media/2013-01-01_-card/...), nothing for clips elsewhere
+    """
+    outbase = os.path.splitext(os.path.basename(vid_file))[0]
+    parts = vid_file.split("raw-media" + os.sep, 1)
+    if 2 == len(parts):
+        return "{}_{}.{}".format(parts[1][0:11], outbase, ext)
+    return "{}.{}".format(outbase, ext)
+
+
+def _rate(text):
+    """
+    float from an ffprobe rate ("30000/1001"), None if unknown
+    """
+    try:
+        num, denom = text.split("/")
+        return float(num) / float(denom) or None
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def probe(path, cache=None):
+    """
+    stream facts of a clip: duration (seconds), fps, vcodec, acodec,
+    width, height, bitrate (bits/s) and format; values None when
+    ffprobe can not tell (or is missing)
+
+    cache: scanindex.scan_index keeping results by size and mtime, so
+        an unchanged clip is probed once
+    """
+    st = None
+    if cache is not None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            cache = None
+        else:
+            info = cache.get_probe(path, st.st_size, st.st_mtime)
+            if info is not None:
+                return info
+    info = dict((key, None) for key in PROBE_KEYS)
+    cmd = [FFPROBE, "-v", "error", "-show_entries",
+           "stream=codec_type,codec_name,width,height,avg_frame_rate"
+           ":format=duration,bit_rate,format_name", "-of", "json", path]
+    try:
+        out = subprocess.check_output(cmd)
+        found = json.loads(out)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return info
+    fmt = found.get("format", {})
+    info["format"] = fmt.get("format_name")
+    for key, field in (("duration", "duration"), ("bitrate", "bit_rate")):
+        try:
+            info[key] = float(fmt[field])
+        except (KeyError, TypeError, ValueError):
+            pass
+    for stream in found.get("streams", []):
+        if "video" == stream.get("codec_type") and info["vcodec"] is None:
+            info["vcodec"] = stream.get("codec_name")
+            info["width"] = stream.get("width")
+            info["height"] = stream.get("height")
+            info["fps"] = _rate(stream.get("avg_frame_rate"))
+        elif "audio" == stream.get("codec_type") and info["acodec"] is None:
+            info["acodec"] = stream.get("codec_name")
+    if cache is not None:
+        cache.put_probe(path, st.st_size, st.st_mtime, info)
+    return info
+
+
+def plan_clip(job):
+    """
+    cheapest way to a preview of a probed clip, (mode, outfile)
+
+    link: already a small web file (webm or mp4), copied as is
+    remux: small, web codecs in another container, stream copied
+    transcode: anything else
+
+    small: fits the spec's resizedims (either way round, phones record
+    portrait as rotated landscape) and is under its max_bitrate
+    """
+    spec = job["spec"]
+    width, height = imgconv.parse_dims(spec.get("resizedims", VID_DIMS))
+    max_bitrate = spec.get("max_bitrate", MAX_COPY_BITRATE)
+    dims = (job["width"], job["height"])
+    small = (None not in dims and job["bitrate"] is not None and
+             job["bitrate"] <= max_bitrate and
+             (dims[0] <= width and dims[1] <= height or
+              dims[0] <= height and dims[1] <= width))
+    if not small:
+        return "transcode", job["outfile"]
+    ext = os.path.splitext(job["infile"])[1].lower()
+    for container, vcodecs, acodecs in WEB_FORMATS:
+        if job["vcodec"] in vcodecs and job["acodec"] in acodecs:
+            outfile = os.path.splitext(job["outfile"])[0] + container
+            if ext == container:
+                return "link", outfile
+            return "remux", outfile
+    return "transcode", job["outfile"]
+
+
+def preview_names(job):
+    """
+    every output name a job may end up with (a transcode can turn into
+    a link or remux, which keep the source container)
+    """
+    if "transcode" != job.get("mode", "transcode"):
+        return [job["outfile"]]
+    stem = os.path.splitext(job["outfile"])[0]
+    return [stem + container for container, vcodecs, acodecs in WEB_FORMATS]
+
+
+def _length(job):
+    """
+    sort key, clip length in seconds (estimated from the size if
+    unknown)
+    """
+    if job["duration"] is not None:
+        return job["duration"]
+    try:
+        return float(os.path.getsize(job["infile"])) / BYTES_PER_SECOND
+    except OSError:
+        return 0.0
+
+
+def make_jobs(vid_file, outdir, spec):
+    """
+    jobs for one clip and job spec
+
+    a "vid" type spec with an encode "profile", or a spec of another
+    type, makes a transcoded preview (<name>.webm); a "vid" spec
+    without one makes a poster (<name>.jpg) and, with "sprite" set, a
+    strip of that many scrub thumbnails (<name>.sprite.jpg)
+    """
+    if "vid" != spec.get("type") or spec.get("profile"):
+        job = imgconv.make_job(vid_file, os.path.join(
+            outdir, outname(vid_file)), spec)
+        job["mode"] = "transcode"
+        return [job]
+    poster = imgconv.make_job(vid_file, os.path.join(
+        outdir, outname(vid_file, "jpg")), spec)
+    poster["mode"] = "poster"
+    jobs = [poster]
+    if spec.get("sprite"):
+        sprite = imgconv.make_job(vid_file, os.path.join(
+            outdir, outname(vid_file, "sprite.jpg")), spec)
+        sprite["mode"] = "sprite"
+        jobs.append(sprite)
+    return jobs
+
+
+def fit_filter(dims, even=False):
+    """
+    scale filter fitting the frame into dims ("640x360"), keeping the
+    aspect ratio and never upscaling
+
+    even: both sides rounded down to even numbers, as 4:2:0 video needs
+    """
+    width, height = imgconv.parse_dims(dims)
+    if not even:
+        return ("scale='min({0},iw)':'min({1},ih)'"
+                ":force_original_aspect_ratio=decrease".format(width,
+                                                               height))
+    #wider than the box: width bounds it, the other side follows (-2)
+    wide = "gt(a,{}/{})".format(width, height)
+    return ("scale='if({0},trunc(min({1},iw)/2)*2,-2)'"
+            ":'if({0},-2,trunc(min({2},ih)/2)*2)'".format(wide, width,
+                                                          height))
+
+
+def profile_args(name):
+    """
+    ffmpeg output options of an encode profile
+    """
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError("unknown encode profile: {}".format(name))
+
+
+def _seek_input(path, at):
+    """
+    input options for a fast seek: the demuxer jumps to the keyframe
+    before "at" and only keyframes are decoded, the first one is used
+    as is (no decoding forward to the exact time)
+    """
+    return ["-skip_frame", "nokey", "-ss", "{:.3f}".format(at),
+            "-noaccurate_seek", "-i", path]
+
+
+def thumb_times(duration, count):
+    """
+    evenly spread times for count thumbnails, off the very ends
+    """
+    step = duration / (count + 1)
+    return [step * (i + 1) for i in range(count)]
+
+
+def encode_cmd(job, threads):
+    """
+    ffmpeg command for a job, writing to its temporary name
+
+    ValueError when the job can not be done (unknown encode profile,
+    sprite of a clip of unknown length)
+    """
+    cmd = [FFMPEG, "-nostdin", "-v", "error", "-y"]
+    tmp = imgconv.tmp_path(job["outfile"])
+    mode = job.get("mode", "transcode")
+    if "poster" == mode:
+        at = (job["duration"] or 0.0) * POSTER_AT
+        return (cmd + ["-threads", str(threads)] +
+                _seek_input(job["infile"], at) +
+                ["-frames:v", "1", "-vf",
+                 fit_filter(job["spec"].get("resizedims", "640x360")),
+                 "-q:v", "3", tmp])
+    if "sprite" == mode:
+        if not job["duration"]:
+            raise ValueError("unknown clip length")
+        count = max(2, int(job["spec"]["sprite"]))
+        scale = fit_filter(job["spec"].get("spritedims", SPRITE_DIMS))
+        graph = []
+        for i, at in enumerate(thumb_times(job["duration"], count)):
+            cmd += ["-threads", "1"] + _seek_input(job["infile"], at)
+            graph.append("[{0}:v]{1}[t{0}]".format(i, scale))
+        graph.append("".join("[t{}]".format(i) for i in range(count)) +
+                     "hstack=inputs={}".format(count))
+        return cmd + ["-filter_complex", ";".join(graph),
+                      "-frames:v", "1", "-q:v", "3", tmp]
+    if "split" == mode:
+        #stream copy cuts at keyframes only, into ~SEGMENT_SECONDS parts
+        return cmd + ["-i", job["infile"], "-map", "0:v:0", "-map", "0:a?",
+                      "-c", "copy", "-f", "segment",
+                      "-segment_time", str(SEGMENT_SECONDS),
+                      "-reset_timestamps", "1",
+                      os.path.join(job["clip"]["workdir"], "seg%04d.mkv")]
+    if "remux" == mode:
+        cmd += ["-i", job["infile"], "-map", "0:v:0", "-map", "0:a?",
+                "-c", "copy"]
+        if tmp.endswith(".mp4"):
+            cmd += ["-movflags", "+faststart"]
+        return cmd + [tmp]
+    if "join" == mode:
+        return cmd + ["-f", "concat", "-safe", "0",
+                      "-i", os.path.join(job["clip"]["workdir"],
+                                         "concat.txt"),
+                      "-c", "copy", tmp]
+    spec = job["spec"]
+    return (cmd + ["-threads", str(threads), "-i", job["infile"],
+                   "-vf", fit_filter(spec.get("resizedims", VID_DIMS),
+                                     even=True),
+                   "-threads", str(threads)] +
+            profile_args(spec.get("profile", DEFAULT_PROFILE)) + [tmp])
+
+
+def segment_dir(outfile):
+    """
+    hidden work dir for the segments of a clip, next to its preview
+    """
+    stem = os.path.splitext(os.path.basename(outfile))[0]
+    return os.path.join(os.path.dirname(outfile),
+                        ".{}.segments".format(stem))
+
+
+def _split_job(job):
+    """
+    turn a long transcode into the first step of a segmented one
+
+    the clip dict is shared by the split, segment and join steps
+    """
+    job["mode"] = "split"
+    job["clip"] = {"source": job["infile"], "outfile": job["outfile"],
+                   "workdir": segment_dir(job["outfile"]),
+                   "duration": job["duration"], "fps": job["fps"],
+                   "start": None, "left": 0, "parts": [],
+                   "failed": False}
+    return job
+
+
+def run_jobs(log, jobs, n_jobs=None, threads=None, segment_min=None,
+             probes=None, journal=None, metrics=None):
+    """
+    transcode video jobs, return a summary dict of counts
+
+    n_jobs: encodes at once, None for the thread budget / MIN_THREADS
+    threads: CPU thread budget shared by the encodes, None for one per
+        core
+    segment_min: clips at least this long (seconds) are cut at
+        keyframes into segments, encoded in parallel and joined again
+        (stream copy); None for SEGMENT_MIN, 0 to never split
+    probes: scanindex.scan_index to keep probe results in (see probe)
+    journal: journal.job_journal to record the jobs in, by their
+        planned outfile, flushed after every ffmpeg run
+    metrics: metrics.run_metrics to account the jobs to, None for none
+
+    transcodes of small web playable clips are turned into a link or a
+    remux (plan_clip), the preview then keeps the source container
+
+    the summary also has the CPU seconds the ffmpeg runs used ("cpu")
+    and the probed, planned jobs it ran ("probed"), for calibrating
+    cost estimates without probing the clips again
+    """
+    if log is None:
+        log = logging.getLogger("base")
+    if threads is None:
+        threads = default_threads()
+    if n_jobs is None:
+        n_jobs = default_jobs(threads)
+    if segment_min is None:
+        segment_min = SEGMENT_MIN
+    threads = max(1, threads)
+    n_jobs = max(1, min(n_jobs, threads))
+    summary = {"done": 0, "skipped": 0, "failed": 0, "remuxed": 0,
+               "linked": 0, "frames": 0, "seconds": 0.0, "cpu": 0.0,
+               "probed": []}
+    todo = []
+    for job in jobs:
+        transcode = "transcode" == job.get("mode", "transcode")
+        existing = [outfile for outfile in preview_names(job)
+                    if os.path.exists(outfile)]
+        if existing:
+            log.log(imgconv.FILE_LOG,
+                    "skipping existant file: %s" % existing[0])
+            summary["skipped"] += 1
+            if journal is not None:
+                journal.finished(job["outfile"])
+            if metrics is not None:
+                metrics.job("vid", job["spec"]["name"], "skipped")
+            continue
+        #the name it was planned with, a link or remux changes it
+        job = dict(job, planned=job["outfile"])
+        if journal is not None:
+            journal.started([job["planned"]])
+        job.update(probe(job["infile"], probes))
+        if transcode:
+            job["mode"], job["outfile"] = plan_clip(job)
+        summary["probed"].append(dict(job))
+        if "link" == job["mode"]:
+            _link(log, summary, job, journal, metrics)
+        elif ("transcode" == job["mode"] and segment_min and
+                job["duration"] and job["duration"] >= segment_min):
+            todo.append(_split_job(job))
+        else:
+            todo.append(job)
+    todo.sort(key=_length)
+    if todo:
+        log.info("ffmpeg for {} clips, {} at a time on {} threads".format(
+            len(todo), n_jobs, threads))
+    #Popen -> (job, threads, start time)
+    running = {}
+    free = threads
+    try:
+        while todo or running:
+            while todo and len(running) < n_jobs and free > 0:
+                job = todo.pop(0)
+                if "clip" in job and job["clip"]["failed"]:
+                    _drop_part(job["clip"])
+                    continue
+                #split what is free between the slots that can still
+                #  fill, so the tail of the queue gets the spare threads
+                share = max(1, free // min(n_jobs - len(running),
+                                           len(todo) + 1))
+                share = min(share, free)
+                if "split" == job.get("mode"):
+                    job["clip"]["start"] = time.time()
+                    shutil.rmtree(job["clip"]["workdir"], True)
+                    os.makedirs(job["clip"]["workdir"])
+                try:
+                    proc = subprocess.Popen(encode_cmd(job, share))
+                except (OSError, ValueError), e:
+                    _failed(log, summary, job, e, journal, metrics)
+                    continue
+                running[proc] = (job, share, time.time())
+                free -= share
+            time.sleep(POLL)
+            for proc in list(running):
+                usage = _reap(proc)
+                if usage is None:
+                    continue
+                job, share, start = running.pop(proc)
+                free += share
+                summary["cpu"] += usage[0] + usage[1]
+                if metrics is not None:
+                    metrics.tool(FFMPEG, time.time() - start, usage[0],
+                                 usage[1], "{} {}".format(
+                                     job.get("mode", "transcode"),
+                                     job["outfile"]))
+                #next steps of a segmented clip go first, so a started
+                #  clip finishes before new ones begin
+                todo[0:0] = _finish(log, summary, job, share,
+                                    proc.returncode, time.time() - start,
+                                    journal, metrics)
+                if journal is not None:
+                    journal.sync()
+    except BaseException:
+        if sys.exc_info()[0] is KeyboardInterrupt:
+            log.warn("interrupted, stopping encodes")
+        for proc, (job, share, start) in running.items():
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+            imgconv._remove_partial(imgconv.tmp_path(job["outfile"]))
+        for job in todo + [job for job, share, start in running.values()]:
+            if "clip" in job:
+                shutil.rmtree(job["clip"]["workdir"], True)
+        raise
+    return summary
+
+
+def _reap(proc):
+    """
+    (user, sys) CPU seconds of a finished ffmpeg, which is reaped (its
+    returncode set), None while it runs
+
+    read as the growth of the RUSAGE_CHILDREN totals across the poll()
+    that reaps it; nothing else reaps children while the encodes run,
+    so the growth is this ffmpeg's
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if proc.poll() is None:
+        return None
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (after.ru_utime - before.ru_utime,
+            after.ru_stime - before.ru_stime)
+
+
+def _link(log, summary, job, journal=None, metrics=None):
+    """
+    a source that is fine as a preview, copied rather than run through
+    ffmpeg; not hardlinked, editing the preview must leave the original
+    as it was
+    """
+    tmp = imgconv.tmp_path(job["outfile"])
+    try:
+        derivcache.copy_file(job["infile"], tmp)
+        shutil.copystat(job["infile"], tmp)
+        os.rename(tmp, job["outfile"])
+    except (IOError, OSError), e:
+        _failed(log, summary, job, e, journal, metrics)
+        return
+    if journal is not None:
+        journal.finished(job["planned"])
+    if metrics is not None:
+        #no encode, nothing worth timing
+        metrics.job("vid", job["spec"]["name"], "done")
+    summary["done"] += 1
+    summary["linked"] += 1
+    log.log(imgconv.FILE_LOG, "linked {}".format(job["outfile"]))
+
+
+def _failed(log, summary, job, error, journal=None, metrics=None):
+    """
+    count and log a failed job; for a step of a segmented clip, fail
+    the clip (once) and drop the step
+    """
+    imgconv._remove_partial(imgconv.tmp_path(job["outfile"]))
+    if "clip" not in job:
+        summary["failed"] += 1
+        log.error("failed {}: {}".format(job["outfile"], error))
+        if journal is not None:
+            journal.finished(job["planned"], False)
+        if metrics is not None:
+            metrics.job("vid", job["spec"]["name"], "failed")
+        return
+    clip = job["clip"]
+    if not clip["failed"]:
+        clip["failed"] = True
+        summary["failed"] += 1
+        if journal is not None:
+            journal.finished(job["planned"], False)
+        if metrics is not None:
+            metrics.job("vid", job["spec"]["name"], "failed")
+        log.error("failed {}: {}".format(clip["outfile"], error))
+    if "segment" == job["mode"]:
+        _drop_part(clip)
+    else:
+        shutil.rmtree(clip["workdir"], True)
+
+
+def _drop_part(clip):
+    """
+    a segment of a failed clip is done with, the last one out cleans up
+    """
+    clip["left"] -= 1
+    if clip["left"] <= 0:
+        shutil.rmtree(clip["workdir"], True)
+
+
+def _finish(log, summary, job, threads, ret, elapsed, journal=None,
+            metrics=None):
+    """
+    account for a finished ffmpeg run, return the jobs that follow
+    from it (steps of a segmented clip)
+    """
+    mode = job.get("mode", "transcode")
+    if ret:
+        _failed(log, summary, job, "{} exited with {}".format(FFMPEG, ret),
+                journal, metrics)
+        return []
+    if "split" == mode:
+        return _split_done(log, summary, job, journal, metrics)
+    if "segment" == mode and job["clip"]["failed"]:
+        _drop_part(job["clip"])
+        return []
+    tmp = imgconv.tmp_path(job["outfile"])
+    try:
+        #keep the source times (and mode), as for images
+        shutil.copystat(job["infile"], tmp)
+        os.rename(tmp, job["outfile"])
+    except (IOError, OSError), e:
+        _failed(log, summary, job, e, journal, metrics)
+        return []
+    if "segment" == mode:
+        return _segment_done(log, job)
+    if "join" == mode:
+        clip = job["clip"]
+        shutil.rmtree(clip["workdir"], True)
+        elapsed = time.time() - clip["start"]
+        job = dict(job, duration=clip["duration"], fps=clip["fps"])
+        threads = "{} segments".format(len(clip["parts"]))
+    else:
+        threads = "{} threads".format(threads)
+    summary["done"] += 1
+    if journal is not None:
+        journal.finished(job["planned"])
+    if metrics is not None:
+        try:
+            sizes = (os.path.getsize(job["infile"]),
+                     os.path.getsize(job["outfile"]))
+        except OSError:
+            sizes = (0, 0)
+        metrics.job("vid", job["spec"]["name"], "done", elapsed,
+                    sizes[0], sizes[1], job["infile"])
+    if "remux" == mode:
+        summary["remuxed"] += 1
+        log.log(imgconv.FILE_LOG, "remuxed {} ({:.1f}s)".format(
+            job["outfile"], elapsed))
+    elif mode in ("poster", "sprite"):
+        log.log(imgconv.FILE_LOG, "proccessed {} ({:.1f}s)".format(
+            job["outfile"], elapsed))
+    elif job["duration"] and job["fps"]:
+        frames = int(job["duration"] * job["fps"])
+        summary["frames"] += frames
+        summary["seconds"] += elapsed
+        #the speed of every transcode is worth seeing without -v
+        log.info("encoded {}: {:.1f} fps ({}, {:.1f}s)".format(
+            job["outfile"], frames / max(elapsed, 0.001), threads,
+            elapsed))
+    else:
+        log.log(imgconv.FILE_LOG, "encoded {} ({}, {:.1f}s)".format(
+            job["outfile"], threads, elapsed))
+    return []
+
+
+def _split_done(log, summary, job, journal=None, metrics=None):
+    """
+    segment jobs for the parts a split wrote
+    """
+    clip = job["clip"]
+    names = sorted(name for name in os.listdir(clip["workdir"])
+                   if name.startswith("seg") and name.endswith(".mkv"))
+    if not names:
+        _failed(log, summary, job, "no segments written", journal,
+                metrics)
+        return []
+    log.log(imgconv.FILE_LOG, "split {} into {} segments".format(
+        clip["source"], len(names)))
+    parts = []
+    for name in names:
+        part = dict(job, mode="segment",
+                    infile=os.path.join(clip["workdir"], name),
+                    outfile=os.path.join(clip["workdir"],
+                                         os.path.splitext(name)[0] +
+                                         ".webm"))
+        parts.append(part)
+    clip["parts"] = [part["outfile"] for part in parts]
+    clip["left"] = len(parts)
+    return parts
+
+
+def _segment_done(log, job):
+    """
+    the join job once the last segment of a clip is encoded
+    """
+    clip = job["clip"]
+    clip["left"] -= 1
+    if clip["left"] > 0:
+        return []
+    with open(os.path.join(clip["workdir"], "concat.txt"), "w") as fh:
+        for part in clip["parts"]:
+            fh.write("file '{}'\n".format(os.path.basename(part)))
+    return [dict(job, mode="join", infile=clip["source"],
+                 outfile=clip["outfile"])]
+
+
+def encode_fps(summary):
+    """
+    overall frames encoded per second of encode time, None if unknown
+    """
+    if not summary["frames"] or not summary["seconds"]:
+        return None
+    return summary["frames"] / summary["seconds"]